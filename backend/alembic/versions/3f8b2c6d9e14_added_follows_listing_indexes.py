@@ -0,0 +1,30 @@
+"""added (side, is_pending, id) indexes for follow listings
+
+Revision ID: 3f8b2c6d9e14
+Revises: a7d4e1f08c62
+Create Date: 2026-10-18 15:32:47.120934
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f8b2c6d9e14'
+down_revision: Union[str, Sequence[str], None] = 'a7d4e1f08c62'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_follows_followed', 'follows', ['followed_id', 'is_pending', 'id'], unique=False)
+    op.create_index('ix_follows_follower', 'follows', ['follower_id', 'is_pending', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_follows_follower', table_name='follows')
+    op.drop_index('ix_follows_followed', table_name='follows')
@@ -0,0 +1,44 @@
+"""added comments.created_at and keyset pagination indexes
+
+Revision ID: 5e2a9d7c3b10
+Revises: c1bf47af9141
+Create Date: 2026-10-18 11:03:27.518204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5e2a9d7c3b10'
+down_revision: Union[str, Sequence[str], None] = 'c1bf47af9141'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('comments', sa.Column('created_at', sa.DateTime(), nullable=True))
+    # existing comments have no date, give them the date of their post (ties are broken by id)
+    op.execute("UPDATE comments SET created_at = (SELECT posts.created_at FROM posts WHERE posts.id = comments.post_id)")
+    op.create_index('ix_comments_post_created', 'comments', ['post_id', 'created_at', 'id'], unique=False)
+
+    op.drop_index('ix_posts_user_created', table_name='posts')
+    op.drop_index('ix_posts_space_created', table_name='posts')
+    op.create_index('ix_posts_created', 'posts', ['created_at', 'id'], unique=False)
+    op.create_index('ix_posts_user_created', 'posts', ['user_id', 'created_at', 'id'], unique=False)
+    op.create_index('ix_posts_space_created', 'posts', ['space_id', 'created_at', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_posts_space_created', table_name='posts')
+    op.drop_index('ix_posts_user_created', table_name='posts')
+    op.drop_index('ix_posts_created', table_name='posts')
+    op.create_index('ix_posts_user_created', 'posts', ['user_id', 'created_at'], unique=False)
+    op.create_index('ix_posts_space_created', 'posts', ['space_id', 'created_at'], unique=False)
+
+    op.drop_index('ix_comments_post_created', table_name='comments')
+    op.drop_column('comments', 'created_at')
@@ -0,0 +1,46 @@
+"""added unique likes and like counter shards
+
+Revision ID: 8c5e1a7f3b20
+Revises: 3f8b2c6d9e14
+Create Date: 2026-10-18 15:48:12.584301
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8c5e1a7f3b20'
+down_revision: Union[str, Sequence[str], None] = '3f8b2c6d9e14'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('like_counter_shards',
+    sa.Column('post_id', sa.Integer(), nullable=False),
+    sa.Column('shard', sa.Integer(), nullable=False),
+    sa.Column('delta', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['post_id'], ['posts.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('post_id', 'shard')
+    )
+    #drop the duplicated likes before enforcing one like per user and post
+    op.execute("""
+        DELETE FROM likes
+        WHERE id NOT IN (SELECT MIN(id) FROM likes GROUP BY post_id, user_id)
+    """)
+    op.create_unique_constraint('unique_like', 'likes', ['post_id', 'user_id'])
+    #the lost updates of the old read-modify-write counter are fixed from the likes themselves
+    op.execute("""
+        UPDATE posts
+        SET likes_nbr = (SELECT COUNT(*) FROM likes WHERE likes.post_id = posts.id)
+    """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_constraint('unique_like', 'likes', type_='unique')
+    op.drop_table('like_counter_shards')
@@ -0,0 +1,47 @@
+"""added full-text and trigram search indexes
+
+Revision ID: a3e7c9b2d418
+Revises: f2c8d5a1e930
+Create Date: 2026-10-18 19:02:15.487930
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a3e7c9b2d418'
+down_revision: Union[str, Sequence[str], None] = 'f2c8d5a1e930'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    #other databases use the in-memory search backend, there is nothing to create
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    #weights A/B/C match POST_FIELDS in app/manage/search.py, the config SEARCH_TEXT_CONFIG
+    op.execute("""
+        ALTER TABLE posts ADD COLUMN search_vector tsvector GENERATED ALWAYS AS (
+            setweight(to_tsvector('simple', coalesce(title, '')), 'A') ||
+            setweight(to_tsvector('simple', replace(coalesce(tags, ''), ',', ' ')), 'B') ||
+            setweight(to_tsvector('simple', coalesce(content, '')), 'C')
+        ) STORED
+    """)
+    op.execute("CREATE INDEX ix_posts_search_vector ON posts USING gin (search_vector)")
+    op.execute("CREATE INDEX ix_users_username_trgm ON users USING gin (username gin_trgm_ops)")
+    op.execute("CREATE INDEX ix_spaces_name_trgm ON spaces USING gin (name gin_trgm_ops)")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute("DROP INDEX IF EXISTS ix_spaces_name_trgm")
+    op.execute("DROP INDEX IF EXISTS ix_users_username_trgm")
+    op.execute("DROP INDEX IF EXISTS ix_posts_search_vector")
+    op.execute("ALTER TABLE posts DROP COLUMN IF EXISTS search_vector")
@@ -0,0 +1,32 @@
+"""added (conversation, id) indexes for chat history paging
+
+Revision ID: a7d4e1f08c62
+Revises: 5e2a9d7c3b10
+Create Date: 2026-10-18 11:41:09.337815
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a7d4e1f08c62'
+down_revision: Union[str, Sequence[str], None] = '5e2a9d7c3b10'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_dm_messages_conversation', 'dm_messages', ['sender_id', 'recipient_id', 'id'], unique=False)
+    op.create_index('ix_group_chat_messages_conversation', 'group_chat_messages', ['group_chat_id', 'id'], unique=False)
+    op.create_index('ix_room_messages_conversation', 'room_messages', ['room_id', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_room_messages_conversation', table_name='room_messages')
+    op.drop_index('ix_group_chat_messages_conversation', table_name='group_chat_messages')
+    op.drop_index('ix_dm_messages_conversation', table_name='dm_messages')
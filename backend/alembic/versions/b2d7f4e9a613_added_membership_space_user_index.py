@@ -0,0 +1,28 @@
+"""added (space_id, user_id) index on membership
+
+Revision ID: b2d7f4e9a613
+Revises: 8c5e1a7f3b20
+Create Date: 2026-10-18 16:05:31.902417
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b2d7f4e9a613'
+down_revision: Union[str, Sequence[str], None] = '8c5e1a7f3b20'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_membership_space_user', 'membership', ['space_id', 'user_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_membership_space_user', table_name='membership')
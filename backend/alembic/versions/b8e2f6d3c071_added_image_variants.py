@@ -0,0 +1,31 @@
+"""added image variants to post attachments and profile pictures
+
+Revision ID: b8e2f6d3c071
+Revises: a3e7c9b2d418
+Create Date: 2026-10-18 21:12:40.318504
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b8e2f6d3c071'
+down_revision: Union[str, Sequence[str], None] = 'a3e7c9b2d418'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    #the existing images keep no variants, the clients fall back to the full url
+    op.add_column('post_attachments', sa.Column('variants', sa.JSON(), nullable=True))
+    op.add_column('users', sa.Column('pfp_variants', sa.JSON(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('users', 'pfp_variants')
+    op.drop_column('post_attachments', 'variants')
@@ -0,0 +1,68 @@
+"""added feed entries (materialized home timelines) and followers_nbr
+
+Revision ID: c1bf47af9141
+Revises: 9b0ee81dd707
+Create Date: 2026-10-18 10:12:41.203318
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c1bf47af9141'
+down_revision: Union[str, Sequence[str], None] = '9b0ee81dd707'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('feed_entries',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('post_id', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['post_id'], ['posts.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('user_id', 'post_id', name='unique_feed_entry')
+    )
+    op.create_index(op.f('ix_feed_entries_id'), 'feed_entries', ['id'], unique=False)
+    op.create_index('ix_feed_entries_user_created', 'feed_entries', ['user_id', 'created_at', 'post_id'], unique=False)
+    op.create_index('ix_posts_user_created', 'posts', ['user_id', 'created_at'], unique=False)
+    op.create_index('ix_posts_space_created', 'posts', ['space_id', 'created_at'], unique=False)
+    op.add_column('users', sa.Column('followers_nbr', sa.Integer(), nullable=True))
+
+    # backfill the follower counters from the accepted follows
+    op.execute("""
+        UPDATE users SET followers_nbr = (
+            SELECT COUNT(*) FROM follows
+            WHERE follows.followed_id = users.id AND follows.is_pending = false
+        )
+    """)
+    # seed the timelines with the existing posts of followed users and joined spaces
+    op.execute("""
+        INSERT INTO feed_entries (user_id, post_id, created_at)
+        SELECT audience.user_id, audience.post_id, audience.created_at FROM (
+            SELECT follows.follower_id AS user_id, posts.id AS post_id, posts.created_at AS created_at
+            FROM follows JOIN posts ON posts.user_id = follows.followed_id
+            WHERE follows.is_pending = false
+            UNION
+            SELECT membership.user_id AS user_id, posts.id AS post_id, posts.created_at AS created_at
+            FROM membership JOIN posts ON posts.space_id = membership.space_id
+            WHERE posts.user_id != membership.user_id
+        ) AS audience
+    """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('users', 'followers_nbr')
+    op.drop_index('ix_posts_space_created', table_name='posts')
+    op.drop_index('ix_posts_user_created', table_name='posts')
+    op.drop_index('ix_feed_entries_user_created', table_name='feed_entries')
+    op.drop_index(op.f('ix_feed_entries_id'), table_name='feed_entries')
+    op.drop_table('feed_entries')
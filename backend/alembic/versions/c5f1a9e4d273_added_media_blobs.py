@@ -0,0 +1,50 @@
+"""added content addressed media blobs with reference counts
+
+Revision ID: c5f1a9e4d273
+Revises: b8e2f6d3c071
+Create Date: 2026-10-18 22:03:17.528930
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c5f1a9e4d273'
+down_revision: Union[str, Sequence[str], None] = 'b8e2f6d3c071'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('media_blobs',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('sha256', sa.String(length=64), nullable=False),
+    sa.Column('profile', sa.String(length=20), nullable=False),
+    sa.Column('file', sa.Text(), nullable=False),
+    sa.Column('file_public_id', sa.Text(), nullable=False),
+    sa.Column('variants', sa.JSON(), nullable=True),
+    sa.Column('refcount', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('sha256', 'profile', name='unique_media_blob')
+    )
+    op.create_index(op.f('ix_media_blobs_id'), 'media_blobs', ['id'], unique=False)
+    #the existing uploads have no hash, they stay unshared (blob_id null)
+    op.add_column('post_attachments', sa.Column('blob_id', sa.Integer(), nullable=True))
+    op.create_foreign_key('post_attachments_blob_id_fkey', 'post_attachments', 'media_blobs', ['blob_id'], ['id'])
+    op.add_column('users', sa.Column('pfp_blob_id', sa.Integer(), nullable=True))
+    op.create_foreign_key('users_pfp_blob_id_fkey', 'users', 'media_blobs', ['pfp_blob_id'], ['id'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_constraint('users_pfp_blob_id_fkey', 'users', type_='foreignkey')
+    op.drop_column('users', 'pfp_blob_id')
+    op.drop_constraint('post_attachments_blob_id_fkey', 'post_attachments', type_='foreignkey')
+    op.drop_column('post_attachments', 'blob_id')
+    op.drop_index(op.f('ix_media_blobs_id'), table_name='media_blobs')
+    op.drop_table('media_blobs')
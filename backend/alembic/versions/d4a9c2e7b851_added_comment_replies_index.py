@@ -0,0 +1,28 @@
+"""added (parent_id, created_at, id) index on comments
+
+Revision ID: d4a9c2e7b851
+Revises: b2d7f4e9a613
+Create Date: 2026-10-18 17:12:44.318205
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd4a9c2e7b851'
+down_revision: Union[str, Sequence[str], None] = 'b2d7f4e9a613'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_comments_parent_created', 'comments', ['parent_id', 'created_at', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_comments_parent_created', table_name='comments')
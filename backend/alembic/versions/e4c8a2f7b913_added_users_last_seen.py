@@ -0,0 +1,28 @@
+"""added users last_seen
+
+Revision ID: e4c8a2f7b913
+Revises: d9a4b7e2f615
+Create Date: 2026-10-18 23:31:07.518240
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e4c8a2f7b913'
+down_revision: Union[str, Sequence[str], None] = 'd9a4b7e2f615'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('users', sa.Column('last_seen', sa.DateTime(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('users', 'last_seen')
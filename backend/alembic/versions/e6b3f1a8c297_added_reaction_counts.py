@@ -0,0 +1,47 @@
+"""added unique reactions and per type reaction counts
+
+Revision ID: e6b3f1a8c297
+Revises: d4a9c2e7b851
+Create Date: 2026-10-18 17:41:09.665120
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e6b3f1a8c297'
+down_revision: Union[str, Sequence[str], None] = 'd4a9c2e7b851'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('reaction_counts',
+    sa.Column('comment_id', sa.Integer(), nullable=False),
+    sa.Column('reaction_type', sa.String(length=20), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['comment_id'], ['comments.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('comment_id', 'reaction_type')
+    )
+    #drop the duplicated reactions before enforcing one reaction of each type per user
+    op.execute("""
+        DELETE FROM reactions
+        WHERE id NOT IN (SELECT MIN(id) FROM reactions GROUP BY comment_id, user_id, reaction_type)
+    """)
+    op.create_unique_constraint('unique_reaction', 'reactions', ['comment_id', 'user_id', 'reaction_type'])
+    op.execute("""
+        INSERT INTO reaction_counts (comment_id, reaction_type, count)
+        SELECT comment_id, reaction_type, COUNT(*) FROM reactions
+        WHERE comment_id IS NOT NULL AND reaction_type IS NOT NULL
+        GROUP BY comment_id, reaction_type
+    """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_constraint('unique_reaction', 'reactions', type_='unique')
+    op.drop_table('reaction_counts')
@@ -0,0 +1,40 @@
+"""added read watermarks, dropped dm_messages.is_read
+
+Revision ID: f1b9d6c4a582
+Revises: e4c8a2f7b913
+Create Date: 2026-10-19 00:12:44.630915
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f1b9d6c4a582'
+down_revision: Union[str, Sequence[str], None] = 'e4c8a2f7b913'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('read_watermarks',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('kind', sa.String(length=10), nullable=False),
+    sa.Column('conversation_id', sa.Integer(), nullable=False),
+    sa.Column('last_read_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('user_id', 'kind', 'conversation_id')
+    )
+    op.create_index('ix_dm_messages_inbox', 'dm_messages', ['recipient_id', 'sender_id', 'id'], unique=False)
+    # is_read was never set, there is nothing to carry over
+    op.drop_column('dm_messages', 'is_read')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.add_column('dm_messages', sa.Column('is_read', sa.Boolean(), nullable=True))
+    op.drop_index('ix_dm_messages_inbox', table_name='dm_messages')
+    op.drop_table('read_watermarks')
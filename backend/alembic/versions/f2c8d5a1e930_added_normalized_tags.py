@@ -0,0 +1,91 @@
+"""added normalized tags, post tags and hourly tag counts
+
+Revision ID: f2c8d5a1e930
+Revises: e6b3f1a8c297
+Create Date: 2026-10-18 18:20:37.140583
+
+"""
+from datetime import datetime, timedelta
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f2c8d5a1e930'
+down_revision: Union[str, Sequence[str], None] = 'e6b3f1a8c297'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    tags = op.create_table('tags',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=50), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('name')
+    )
+    op.create_index(op.f('ix_tags_id'), 'tags', ['id'], unique=False)
+    post_tags = op.create_table('post_tags',
+    sa.Column('post_id', sa.Integer(), nullable=False),
+    sa.Column('tag_id', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['post_id'], ['posts.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['tag_id'], ['tags.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('post_id', 'tag_id')
+    )
+    op.create_index('ix_post_tags_tag_created', 'post_tags', ['tag_id', 'created_at', 'post_id'], unique=False)
+    tag_counts = op.create_table('tag_counts',
+    sa.Column('tag_id', sa.Integer(), nullable=False),
+    sa.Column('bucket', sa.DateTime(), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['tag_id'], ['tags.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('tag_id', 'bucket')
+    )
+    op.create_index('ix_tag_counts_bucket', 'tag_counts', ['bucket'], unique=False)
+
+    #backfill from the comma separated posts.tags, normalized like app/manage/tags.py
+    bind = op.get_bind()
+    posts = bind.execute(sa.text("SELECT id, tags, created_at, for_space FROM posts WHERE tags IS NOT NULL AND tags != ''")).all()
+    post_names = {}
+    for post_id, post_tags_text, created_at, for_space in posts:
+        names = []
+        for tag in post_tags_text.split(','):
+            name = tag.strip().lstrip('#').strip().lower()
+            if name and len(name) <= 50 and name not in names:
+                names.append(name)
+        post_names[post_id] = (names, created_at, for_space)
+        bind.execute(sa.text("UPDATE posts SET tags = :tags WHERE id = :id"), {'tags': ','.join(names) or None, 'id': post_id})
+
+    all_names = sorted({name for names, _, _ in post_names.values() for name in names})
+    if not all_names:
+        return
+    op.bulk_insert(tags, [{'name': name} for name in all_names])
+    tag_ids = dict(bind.execute(sa.text("SELECT name, id FROM tags")).all())
+    op.bulk_insert(post_tags, [
+        {'post_id': post_id, 'tag_id': tag_ids[name], 'created_at': created_at or datetime.now()}
+        for post_id, (names, created_at, _) in post_names.items() for name in names
+    ])
+    #the trending window only needs the last day (TAG_TRENDING_WINDOW_HOURS)
+    since = datetime.now() - timedelta(hours=24)
+    counts = {}
+    for names, created_at, for_space in post_names.values():
+        if for_space or not created_at or created_at < since:
+            continue
+        bucket = created_at.replace(minute=0, second=0, microsecond=0)
+        for name in names:
+            counts[(tag_ids[name], bucket)] = counts.get((tag_ids[name], bucket), 0) + 1
+    if counts:
+        op.bulk_insert(tag_counts, [{'tag_id': tag_id, 'bucket': bucket, 'count': count} for (tag_id, bucket), count in counts.items()])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_tag_counts_bucket', table_name='tag_counts')
+    op.drop_table('tag_counts')
+    op.drop_index('ix_post_tags_tag_created', table_name='post_tags')
+    op.drop_table('post_tags')
+    op.drop_index(op.f('ix_tags_id'), table_name='tags')
+    op.drop_table('tags')
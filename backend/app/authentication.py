@@ -3,6 +3,8 @@ from passlib.context import CryptContext
 from datetime import datetime,timedelta
 from jose import jwt
 from app.dependencies import SessionDep,Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select
 from app.models.users import User
 from fastapi import APIRouter,Depends
 from sqlalchemy import or_
@@ -12,6 +14,10 @@ from app.schemas.users_schemas import UserCreate,UserDisplay
 from app.dependencies import SessionDep
 from typing import Annotated
 from fastapi.security import OAuth2PasswordRequestForm
+from sqlalchemy.orm import make_transient_to_detached
+from app.identity_cache import identity_cache,user_snapshot
+from app.manage.search import search_index
+from app.manage.autocomplete import autocomplete
 import dotenv
 import os
 
@@ -78,6 +84,8 @@ async def register(user:UserCreate,db:SessionDep):
     db.add(user_db)
     db.commit()
     db.refresh(user_db)
+    search_index.user_saved(user_db)
+    autocomplete.user_saved(user_db)
     return user_db
 
 
@@ -104,18 +112,83 @@ async def login(form_data : Annotated[OAuth2PasswordRequestForm,Depends()],db:Se
     }
 
 
-    
-def current_user(token:Annotated[str,oauth2_scheme],db:Session):
+
+def resolve_identity(token:str, db:Session) -> dict|None:
+    """
+    Resolve a token to a user snapshot
+
+    The token is only decoded and the user only loaded on a cache miss, warm tokens cost nothing.
+    """
+    if not token:
+        return None
+    snapshot = identity_cache.get(token)
+    if snapshot is not None:
+        return snapshot
+
     payload = verify_token(token)
-    
-    if not payload:
-        raise HTTPException(status_code=401, detail="Invalid token")
+    if not payload or not payload.get('sub'):
+        return None
     email = payload['sub']  #retrieve the email from the decoded token
 
     user = db.query(User).filter(User.email==email).first()  #search for the user with the email
+    if not user:
+        return None
+    snapshot = user_snapshot(user)
+    identity_cache.set(token,snapshot,payload.get('exp'))
+    return snapshot
+
+
+def attach_user(snapshot:dict, db:Session) -> User:
+    """Get a session bound User from a snapshot without querying the db"""
+    user = db.identity_map.get(db.identity_key(User,snapshot['id']))
+    if user is not None:
+        return user
+    user = User(**snapshot)
+    make_transient_to_detached(user)   #the snapshot is considered loaded, the other columns load lazily
+    db.add(user)
     return user
 
 
+def current_user(token:Annotated[str,oauth2_scheme],db:Session):
+    snapshot = resolve_identity(token,db)
+    if not snapshot:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    return attach_user(snapshot,db)
+
+
+async def resolve_identity_async(token:str, db:AsyncSession) -> dict|None:
+    """resolve_identity for the routers running on the AsyncSession"""
+    if not token:
+        return None
+    snapshot = identity_cache.get(token)
+    if snapshot is not None:
+        return snapshot
+
+    payload = verify_token(token)
+    if not payload or not payload.get('sub'):
+        return None
+    result = await db.execute(select(User).where(User.email==payload['sub']))
+    user = result.scalars().first()
+    if not user:
+        return None
+    snapshot = user_snapshot(user)
+    identity_cache.set(token,snapshot,payload.get('exp'))
+    return snapshot
+
+
+async def current_user_async(token:str, db:AsyncSession) -> User:
+    """
+    current_user for the routers running on the AsyncSession
+
+    Only the snapshot columns are loaded, the other ones can not be lazily loaded
+    outside of db.run_sync, use a sql expression to update them.
+    """
+    snapshot = await resolve_identity_async(token,db)
+    if not snapshot:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    return attach_user(snapshot,db.sync_session)
+
+
 
 @auth_router.get('/current_user/',response_model=UserDisplay)
 async def get_current_user(db:SessionDep,token:Annotated[str|None,Depends(oauth2_scheme)]=None):
@@ -128,21 +201,12 @@ def current_user2(
     db: SessionDep
 ) -> Optional[User]:
     if not token:   # No token provided
-        print("zbu")
         return None
-    
-    print("Got token:", token)  
 
-    payload = verify_token(token)
-    if not payload:
+    snapshot = resolve_identity(token,db)
+    if not snapshot:
         return None  # instead of raising
-
-    email = payload.get("sub")
-    if not email:
-        return None
-
-    user = db.query(User).filter(User.email == email).first()
-    return user
+    return attach_user(snapshot,db)
 
 
 @auth_router.get("/currentuser/", response_model=UserDisplay)
@@ -1,14 +1,138 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine,event
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine,async_sessionmaker,AsyncSession
+from sqlalchemy.dialects import postgresql,sqlite
+from threading import Lock
+import time
 import dotenv
 import os
 dotenv.load_dotenv()
 
 
 DATABASE_URL = os.getenv('DATABASE_URL')
-engine = create_engine(DATABASE_URL)
+
+#connection pool settings, shared by the sync and the async engine (each engine has its own pool)
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE',5))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW',10))
+DB_POOL_TIMEOUT = int(os.getenv('DB_POOL_TIMEOUT',30))          #seconds to wait for a free connection
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE',1800))        #seconds, reconnect before the server/proxy drops idle connections
+DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING','true').lower() in ('1','true','yes')
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv('DB_STATEMENT_TIMEOUT_MS',0))   #0 disables it
+
+
+def engine_options(url:str, is_async:bool = False) -> dict:
+    """create_engine kwargs for the configured pool, sqlite keeps its own defaults"""
+    url = make_url(url)
+    if url.get_backend_name() == 'sqlite':
+        return {}
+    options = {
+        'pool_size' : DB_POOL_SIZE,
+        'max_overflow' : DB_MAX_OVERFLOW,
+        'pool_timeout' : DB_POOL_TIMEOUT,
+        'pool_recycle' : DB_POOL_RECYCLE,
+        'pool_pre_ping' : DB_POOL_PRE_PING,
+    }
+    if DB_STATEMENT_TIMEOUT_MS and url.get_backend_name() == 'postgresql':
+        if is_async:   #asyncpg
+            options['connect_args'] = {'server_settings' : {'statement_timeout' : str(DB_STATEMENT_TIMEOUT_MS)}}
+        else:          #psycopg2
+            options['connect_args'] = {'options' : f'-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}'}
+    return options
+
+
+class PoolMetrics:
+    """Checkout/checkin counters of an engine's pool, fed by pool events"""
+    def __init__(self) -> None:
+        self.connects = 0
+        self.checkouts = 0
+        self.checkins = 0
+        self.invalidations = 0
+        self.total_held_ms = 0.0
+        self.max_held_ms = 0.0
+        self._lock = Lock()
+
+    def listen(self, engine):
+        event.listen(engine, 'connect', self.on_connect)
+        event.listen(engine, 'checkout', self.on_checkout)
+        event.listen(engine, 'checkin', self.on_checkin)
+        event.listen(engine, 'invalidate', self.on_invalidate)
+
+    def on_connect(self, dbapi_connection, connection_record):
+        with self._lock:
+            self.connects += 1
+
+    def on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        connection_record.info['checked_out_at'] = time.perf_counter()
+        with self._lock:
+            self.checkouts += 1
+
+    def on_checkin(self, dbapi_connection, connection_record):
+        checked_out_at = connection_record.info.pop('checked_out_at', None)
+        with self._lock:
+            self.checkins += 1
+            if checked_out_at is not None:
+                held_ms = (time.perf_counter() - checked_out_at) * 1000
+                self.total_held_ms += held_ms
+                self.max_held_ms = max(self.max_held_ms, held_ms)
+
+    def on_invalidate(self, dbapi_connection, connection_record, exception):
+        with self._lock:
+            self.invalidations += 1
+
+    def snapshot(self, engine) -> dict:
+        pool = engine.pool
+        with self._lock:
+            return {
+                'pool' : pool.status(),
+                'checked_out' : pool.checkedout() if hasattr(pool, 'checkedout') else None,
+                'connects' : self.connects,
+                'checkouts' : self.checkouts,
+                'checkins' : self.checkins,
+                'invalidations' : self.invalidations,
+                'avg_held_ms' : round(self.total_held_ms / self.checkins, 3) if self.checkins else 0,
+                'max_held_ms' : round(self.max_held_ms, 3),
+            }
+
+
+engine = create_engine(DATABASE_URL, **engine_options(DATABASE_URL))
 #engine = create_engine('sqlite:///socmel.db')
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+pool_metrics = PoolMetrics()
+pool_metrics.listen(engine)
+
+
+def upsert_insert(model):
+    """
+    INSERT supporting on_conflict_do_nothing / on_conflict_do_update, the construct is dialect specific
+
+    The only place the dialect is picked for an upsert, the modules (likes, reactions, tags,
+    media blobs, read watermarks) import it rather than keeping their own copy.
+    """
+    dialect = postgresql if engine.dialect.name == 'postgresql' else sqlite
+    return dialect.insert(model)
+
+
+#async drivers for the sync urls we support
+ASYNC_DRIVERS = {
+    'postgresql' : 'postgresql+asyncpg',
+    'sqlite' : 'sqlite+aiosqlite',
+}
+
+def to_async_url(url:str) -> str:
+    url = make_url(url)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f'no async driver configured for {backend}, set ASYNC_DATABASE_URL')
+    return url.set(drivername=ASYNC_DRIVERS[backend]).render_as_string(hide_password=False)
+
+
+ASYNC_DATABASE_URL = os.getenv('ASYNC_DATABASE_URL') or to_async_url(DATABASE_URL)
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **engine_options(ASYNC_DATABASE_URL, is_async=True))
+#expire_on_commit=False: attributes can not be lazily refreshed after a commit outside of the greenlet
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+async_pool_metrics = PoolMetrics()
+async_pool_metrics.listen(async_engine.sync_engine)
 
 Base = declarative_base()
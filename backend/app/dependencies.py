@@ -1,7 +1,9 @@
 from fastapi import Depends
 from typing import Annotated
 from sqlalchemy.orm import Session
-from app.database import SessionLocal
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import SessionLocal,AsyncSessionLocal
+from app.loaders import UserLoader
 
 
 def get_db():
@@ -12,9 +14,17 @@ def get_db():
         db.close()
 
 
-SessionDep = Annotated[Session, Depends(get_db)]
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
 
 
+SessionDep = Annotated[Session, Depends(get_db)]
+AsyncSessionDep = Annotated[AsyncSession, Depends(get_async_db)]
+
 
+def get_user_loader(db: AsyncSessionDep):
+    return UserLoader(db)   #one per request, shares the request's session
 
 
+UserLoaderDep = Annotated[UserLoader, Depends(get_user_loader)]
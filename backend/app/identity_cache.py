@@ -0,0 +1,90 @@
+from collections import OrderedDict
+from threading import Lock
+from typing import Dict, Optional, Set
+import time
+import os
+import dotenv
+
+dotenv.load_dotenv()
+
+
+IDENTITY_CACHE_SIZE = int(os.getenv('IDENTITY_CACHE_SIZE',10000))
+IDENTITY_CACHE_TTL = int(os.getenv('IDENTITY_CACHE_TTL',60))   #seconds, also bounds staleness across workers
+
+#only the identity columns are cached: a profile field (pfp, xp, ...) cached here would be served stale
+#by the other workers until the ttl, it is loaded from the row when a request needs it
+SNAPSHOT_FIELDS = ('id','username','email','is_active')
+
+
+class IdentityCache:
+    """
+    Bounded LRU cache of token -> user snapshot
+
+    Entries expire after IDENTITY_CACHE_TTL seconds or when the token itself expires,
+    whichever comes first. All the tokens of a user can be dropped at once with invalidate_user.
+    """
+    def __init__(self, max_size: int = IDENTITY_CACHE_SIZE, ttl: int = IDENTITY_CACHE_TTL) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        # token -> (expires_at, snapshot)
+        self._entries: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+        # user_id -> tokens cached for this user
+        self._user_tokens: Dict[int, Set[str]] = {}
+        self._lock = Lock()   #sync endpoints run in the threadpool
+
+    def get(self, token: str) -> Optional[dict]:
+        with self._lock:
+            entry = self._entries.get(token)
+            if not entry:
+                return None
+            expires_at, snapshot = entry
+            if expires_at <= time.time():
+                self._drop(token)
+                return None
+            self._entries.move_to_end(token)
+            return snapshot
+
+    def set(self, token: str, snapshot: dict, token_exp: Optional[float] = None):
+        """
+        Args:
+            token: the raw bearer token
+            snapshot: the compact user data (see SNAPSHOT_FIELDS)
+            token_exp: the `exp` claim of the token, if any
+        """
+        expires_at = time.time() + self.ttl
+        if token_exp:
+            expires_at = min(expires_at, float(token_exp))
+        with self._lock:
+            if token in self._entries:
+                self._drop(token)
+            self._entries[token] = (expires_at, snapshot)
+            self._user_tokens.setdefault(snapshot['id'], set()).add(token)
+            while len(self._entries) > self.max_size:   #evict the least recently used
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+
+    def invalidate_user(self, user_id: int):
+        """Forget every token of a user (call this after the user's email, password or profile change)"""
+        with self._lock:
+            for token in self._user_tokens.pop(user_id, set()):
+                self._entries.pop(token, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._user_tokens.clear()
+
+    def _drop(self, token: str):
+        _, snapshot = self._entries.pop(token)
+        tokens = self._user_tokens.get(snapshot['id'])
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._user_tokens[snapshot['id']]
+
+
+def user_snapshot(user) -> dict:
+    return {field: getattr(user, field) for field in SNAPSHOT_FIELDS}
+
+
+identity_cache = IdentityCache()
@@ -0,0 +1,94 @@
+import asyncio
+import io
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict
+import os
+import dotenv
+
+dotenv.load_dotenv()
+
+
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS',2))                      #processes decoding/encoding images, per worker
+IMAGE_FORMAT = os.getenv('IMAGE_FORMAT','webp').lower()                #webp or jpeg, every stored image is re-encoded
+IMAGE_QUALITY = int(os.getenv('IMAGE_QUALITY',80))
+IMAGE_MAX_BYTES = int(os.getenv('IMAGE_MAX_BYTES',20*1024*1024))       #bigger uploads are refused before decoding
+IMAGE_MAX_PIXELS = int(os.getenv('IMAGE_MAX_PIXELS',50_000_000))       #decompression bomb guard
+
+#longest side of each stored size, 'full' replaces the original
+POST_IMAGE_SIZES = {'full': 2048, 'medium': 1080, 'thumb': 320}
+PFP_IMAGE_SIZES = {'full': 512, 'medium': 256, 'small': 64}
+DM_IMAGE_SIZES = {'full': 2048}   #dm_messages only has room for one url
+
+EXTENSIONS = {'webp': '.webp', 'jpeg': '.jpg'}
+
+
+class InvalidImage(ValueError):
+    pass
+
+
+def derive(source: bytes | str, sizes: Dict[str, int], fmt: str = IMAGE_FORMAT, quality: int = IMAGE_QUALITY) -> Dict[str, bytes]:
+    """
+    Decode an image once and encode it at every size (runs in the process pool)
+
+    The orientation tag is applied to the pixels, then no metadata (EXIF, GPS, comments) is written back.
+    Animated images keep their first frame.
+
+    Args:
+        source: the file content, or the path of a local file (read by the image process itself)
+        sizes: name -> longest side, images are never upscaled
+
+    Returns:
+        name -> encoded bytes
+    """
+    from PIL import Image, ImageOps, UnidentifiedImageError
+    Image.MAX_IMAGE_PIXELS = IMAGE_MAX_PIXELS
+    try:
+        image = Image.open(source if isinstance(source, str) else io.BytesIO(source))
+        if image.width * image.height > IMAGE_MAX_PIXELS:
+            raise InvalidImage('the image is too large')
+        largest = max(sizes.values())
+        image.draft('RGB', (largest, largest))   #jpeg: decode at a reduced scale when the image is much bigger
+        image = ImageOps.exif_transpose(image)
+        keep_alpha = fmt == 'webp' and ('A' in image.getbands() or 'transparency' in image.info)
+        image = image.convert('RGBA' if keep_alpha else 'RGB')   #the pixels are decoded here, truncated files fail here
+    except Image.DecompressionBombError:
+        raise InvalidImage('the image is too large')
+    except (UnidentifiedImageError, OSError):
+        raise InvalidImage('the file is not a valid image')
+
+    encoded = {}
+    for name, side in sorted(sizes.items(), key=lambda item: -item[1]):   #each size is resized from the previous one
+        image.thumbnail((side, side), Image.Resampling.LANCZOS)
+        out = io.BytesIO()
+        if fmt == 'webp':
+            image.save(out, 'WEBP', quality=quality, method=4)
+        else:
+            image.save(out, 'JPEG', quality=quality, optimize=True, progressive=True)
+        encoded[name] = out.getvalue()
+    return encoded
+
+
+_pool: ProcessPoolExecutor | None = None
+
+
+def image_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:   #started on first use, spawn: the workers do not inherit the server's threads and sockets
+        _pool = ProcessPoolExecutor(IMAGE_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+    return _pool
+
+
+def shutdown_image_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(cancel_futures=True)
+        _pool = None
+
+
+async def derive_async(source: bytes | str, sizes: Dict[str, int]) -> Dict[str, bytes]:
+    """derive() in the process pool, the event loop only waits"""
+    #files on disk come from the chunked uploads, their size was checked against UPLOAD_MAX_BYTES
+    if not isinstance(source, str) and len(source) > IMAGE_MAX_BYTES:
+        raise InvalidImage(f'images are limited to {IMAGE_MAX_BYTES // (1024*1024)} MB')
+    return await asyncio.get_running_loop().run_in_executor(image_pool(), derive, source, sizes, IMAGE_FORMAT, IMAGE_QUALITY)
@@ -0,0 +1,59 @@
+import asyncio
+from typing import Dict, Iterable, List, Optional
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.models.users import User
+
+
+class UserLoader:
+    """
+    Per request batch loader for users (DataLoader style)
+
+    Every load() made before the event loop gets back to the loader is answered by a single
+    `WHERE id IN (...)` query, and a user is only fetched once per request.
+
+    usage:
+        users = await loader.load_many(ids)
+        author, owner = await asyncio.gather(loader.load(post.user_id), loader.load(space.owner_id))
+    """
+    def __init__(self, db: AsyncSession) -> None:
+        self.db = db
+        self._cache: Dict[int, asyncio.Future] = {}
+        self._queue: List[int] = []
+        self._scheduled = False
+
+    def load(self, user_id: int) -> asyncio.Future:
+        """Future resolving to the user, or None if it does not exist"""
+        if user_id in self._cache:
+            return self._cache[user_id]
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._cache[user_id] = future
+        self._queue.append(user_id)
+        if not self._scheduled:   #the batch is sent once the current callers have queued their ids
+            self._scheduled = True
+            loop.call_soon(lambda: asyncio.ensure_future(self._dispatch()))
+        return future
+
+    async def load_many(self, user_ids: Iterable[int]) -> List[Optional[User]]:
+        return list(await asyncio.gather(*(self.load(user_id) for user_id in user_ids)))
+
+    def prime(self, user: User):
+        """Seed the cache with a user already loaded"""
+        if user.id not in self._cache:
+            future = asyncio.get_running_loop().create_future()
+            future.set_result(user)
+            self._cache[user.id] = future
+
+    async def _dispatch(self):
+        user_ids, self._queue = self._queue, []
+        self._scheduled = False
+        try:
+            users = (await self.db.scalars(select(User).where(User.id.in_(user_ids)))).all()
+        except Exception as error:
+            for user_id in user_ids:
+                self._cache.pop(user_id).set_exception(error)
+            return
+        by_id = {user.id: user for user in users}
+        for user_id in user_ids:
+            self._cache[user_id].set_result(by_id.get(user_id))
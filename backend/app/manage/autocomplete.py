@@ -0,0 +1,176 @@
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from threading import Lock
+from typing import Dict, List, Set, Tuple
+from sqlalchemy import select, or_
+from sqlalchemy.orm import Session
+from app.models.users import User
+from app.models.follows import Follow
+from app.models.spaces import Space, membership
+from app.manage.search import SEARCH_BACKEND, escape_like
+import time
+import os
+import dotenv
+
+dotenv.load_dotenv()
+
+
+AUTOCOMPLETE_SCAN_MAX = int(os.getenv('AUTOCOMPLETE_SCAN_MAX',2000))            #entries read per lookup, bounds the latency of 1 letter prefixes
+AUTOCOMPLETE_SCOPE_TTL = int(os.getenv('AUTOCOMPLETE_SCOPE_TTL',60))            #seconds a user's follows/spaces are kept
+AUTOCOMPLETE_SCOPE_CACHE_SIZE = int(os.getenv('AUTOCOMPLETE_SCOPE_CACHE_SIZE',10000))
+AUTOCOMPLETE_REBUILD_MINUTES = int(os.getenv('AUTOCOMPLETE_REBUILD_MINUTES',10)) #full reload, picks up the changes made on the other workers
+
+
+class PrefixIndex:
+    """
+    Names kept in a sorted array of (lowercase name, id), a prefix is a contiguous range found with bisect
+
+    add/remove are O(n) list moves (memmove), lookups are O(log n + results).
+    """
+    def __init__(self, names: Dict[int, str] | None = None) -> None:
+        self.names: Dict[int, str] = dict(names or {})
+        self.keys: List[Tuple[str, int]] = sorted((name.lower(), id) for id, name in self.names.items())
+
+    def add(self, id: int, name: str):
+        self.remove(id)
+        self.names[id] = name
+        insort(self.keys, (name.lower(), id))
+
+    def remove(self, id: int):
+        name = self.names.pop(id, None)
+        if name is None:
+            return
+        i = bisect_left(self.keys, (name.lower(), id))
+        if i < len(self.keys) and self.keys[i] == (name.lower(), id):
+            del self.keys[i]
+
+    def prefix(self, prefix: str, limit: int, skip: Set[int] = frozenset()) -> List[int]:
+        """Ids of the names starting with prefix, in name order"""
+        prefix = prefix.lower()
+        start = bisect_left(self.keys, (prefix,))
+        ids = []
+        for i in range(start, min(start + AUTOCOMPLETE_SCAN_MAX, len(self.keys))):
+            key, id = self.keys[i]
+            if not key.startswith(prefix):
+                break
+            if id in skip:
+                continue
+            ids.append(id)
+            if len(ids) == limit:
+                break
+        return ids
+
+
+class ScopeCache:
+    """
+    Small prefix indexes of the followed users and joined spaces of the recent callers
+    (LRU with TTL, like the membership sets), so their matches are found without scanning the big arrays
+    """
+    def __init__(self, max_size: int = AUTOCOMPLETE_SCOPE_CACHE_SIZE, ttl: int = AUTOCOMPLETE_SCOPE_TTL) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self._scopes: OrderedDict[int, Tuple[float, Dict[str, PrefixIndex]]] = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, user_id: int, db: Session, indexes: Dict[str, PrefixIndex]) -> Dict[str, PrefixIndex]:
+        with self._lock:
+            entry = self._scopes.get(user_id)
+            if entry and entry[0] > time.time():
+                self._scopes.move_to_end(user_id)
+                return entry[1]
+        followed = db.scalars(select(Follow.followed_id).where(Follow.follower_id == user_id, Follow.is_pending == False)).all()
+        spaces = db.scalars(select(membership.c.space_id).where(membership.c.user_id == user_id)).all()
+        scopes = {
+            'users': PrefixIndex({id: indexes['users'].names[id] for id in followed if id in indexes['users'].names}),
+            'spaces': PrefixIndex({id: indexes['spaces'].names[id] for id in spaces if id in indexes['spaces'].names}),
+        }
+        with self._lock:
+            self._scopes[user_id] = (time.time() + self.ttl, scopes)
+            self._scopes.move_to_end(user_id)
+            while len(self._scopes) > self.max_size:
+                self._scopes.popitem(last=False)
+        return scopes
+
+    def forget(self, user_id: int):
+        with self._lock:
+            self._scopes.pop(user_id, None)
+
+
+class Autocomplete:
+    """
+    As-you-type lookup of usernames and space names
+
+    The names live in memory (loaded on first use, updated by register, profile edit and space
+    create/edit/delete, reloaded every AUTOCOMPLETE_REBUILD_MINUTES). Results from the caller's
+    follows (users) or spaces come first, then everyone else; on PostgreSQL the trigram index
+    fills in when the prefix has too few matches (typos).
+    """
+    def __init__(self) -> None:
+        self.indexes: Dict[str, PrefixIndex] | None = None
+        self.scopes = ScopeCache()
+        self._lock = Lock()
+
+    def _load(self, db: Session) -> Dict[str, PrefixIndex]:
+        return {
+            'users': PrefixIndex(dict(db.execute(select(User.id, User.username)).all())),
+            'spaces': PrefixIndex(dict(db.execute(select(Space.id, Space.name)).all())),
+        }
+
+    def rebuild(self, db: Session):
+        indexes = self._load(db)   #built aside, lookups keep using the old arrays meanwhile
+        with self._lock:
+            self.indexes = indexes
+
+    def _update(self, kind: str, id: int, name: str | None = None):
+        with self._lock:
+            if self.indexes is None:
+                return
+            if name is None:
+                self.indexes[kind].remove(id)
+            else:
+                self.indexes[kind].add(id, name)
+
+    def user_saved(self, user: User):
+        self._update('users', user.id, user.username)
+
+    def space_saved(self, space: Space):
+        self._update('spaces', space.id, space.name)
+
+    def space_deleted(self, space_id: int):
+        self._update('spaces', space_id)
+
+    def lookup(self, kind: str, prefix: str, db: Session, user_id: int | None = None, limit: int = 8) -> List[dict]:
+        """
+        Args:
+            kind: 'users' or 'spaces'
+            user_id: the caller, their follows/spaces are listed first
+
+        Returns:
+            [{'id', 'name', 'scoped'}] scoped first, then by name
+        """
+        if self.indexes is None:
+            self.rebuild(db)
+        indexes = self.indexes
+        scope = self.scopes.get(user_id, db, indexes)[kind] if user_id else PrefixIndex()
+        with self._lock:
+            first = scope.prefix(prefix, limit)
+            rest = indexes[kind].prefix(prefix, limit - len(first), skip=set(first)) if len(first) < limit else []
+            results = [{'id': id, 'name': indexes[kind].names.get(id) or scope.names[id], 'scoped': id in scope.names} for id in first + rest]
+        if len(results) < limit and SEARCH_BACKEND == 'postgres':
+            results += self._similar(kind, prefix, db, limit - len(results), {result['id'] for result in results}, set(scope.names))
+        return results
+
+    def _similar(self, kind: str, text: str, db: Session, limit: int, skip: Set[int], scope: Set[int]) -> List[dict]:
+        #trigram fallback, only reached when the prefix range ran short
+        model = User if kind == 'users' else Space
+        name_col = User.username if kind == 'users' else Space.name
+        stmt = select(model.id, name_col).where(
+            or_(name_col.op('%')(text), name_col.ilike('%' + escape_like(text) + '%'))
+        )
+        if skip:
+            stmt = stmt.where(model.id.not_in(skip))
+        rows = db.execute(stmt.order_by(name_col.op('<->')(text)).limit(limit)).all()
+        return [{'id': id, 'name': name, 'scoped': id in scope} for id, name in rows]
+
+
+autocomplete = Autocomplete()
@@ -0,0 +1,147 @@
+import asyncio
+from abc import ABC, abstractmethod
+import json
+import logging
+import os
+from typing import Awaitable, Callable, Dict, Optional, Set
+import dotenv
+
+dotenv.load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+
+#unset: single process, events never leave the worker
+#redis://host:6379/0: every worker subscribes to BACKPLANE_CHANNEL and delivers to its own connections
+BACKPLANE_URL = os.getenv('BACKPLANE_URL')
+BACKPLANE_CHANNEL = os.getenv('BACKPLANE_CHANNEL','socmel:ws')
+
+Handler = Callable[[dict], Awaitable[None]]
+
+
+class Backplane(ABC):
+    """
+    Routes websocket events (dm, group and room messages, membership changes) between workers
+
+    Every worker publishes the events it produces and handles all the published events,
+    delivering them to the connections it holds.
+    """
+    def __init__(self) -> None:
+        self.handler: Optional[Handler] = None
+
+    async def start(self, handler: Handler):
+        self.handler = handler
+
+    @abstractmethod
+    async def publish(self, event: dict):
+        ...
+
+    async def stop(self):
+        pass
+
+
+class InProcessBackplane(Backplane):
+    """Single worker: events are handled right away"""
+    async def publish(self, event: dict):
+        if self.handler:
+            await self.handler(event)
+
+
+class PubSubBackplane(Backplane):
+    """
+    Redis style pub/sub backplane
+
+    Args:
+        client: a redis.asyncio client, or anything with the same publish()/pubsub() api (see LocalBroker)
+        channel: the channel shared by all the workers
+    """
+    def __init__(self, client, channel: str = BACKPLANE_CHANNEL) -> None:
+        super().__init__()
+        self.client = client
+        self.channel = channel
+        self._pubsub = None
+        self._reader: Optional[asyncio.Task] = None
+
+    async def start(self, handler: Handler):
+        await super().start(handler)
+        self._pubsub = self.client.pubsub()
+        await self._pubsub.subscribe(self.channel)
+        self._reader = asyncio.create_task(self._read())
+
+    async def publish(self, event: dict):
+        await self.client.publish(self.channel, json.dumps(event))
+
+    async def stop(self):
+        if self._reader:
+            self._reader.cancel()
+            try:
+                await self._reader
+            except asyncio.CancelledError:
+                pass
+            self._reader = None
+        if self._pubsub:
+            await self._pubsub.unsubscribe(self.channel)
+            await self._pubsub.aclose()
+            self._pubsub = None
+
+    async def _read(self):
+        async for message in self._pubsub.listen():
+            if message['type'] != 'message':   #subscribe confirmations
+                continue
+            try:
+                await self.handler(json.loads(message['data']))
+            except Exception:
+                logger.exception('backplane event dropped')   #one bad event must not stop the reader
+
+
+class LocalBroker:
+    """
+    In memory stand-in for a redis server, implements the part of the redis.asyncio api used by PubSubBackplane
+
+    Several PubSubBackplane sharing one LocalBroker behave like workers sharing one redis.
+    """
+    def __init__(self) -> None:
+        self._subscribers: Dict[str, Set['LocalPubSub']] = {}
+
+    async def publish(self, channel: str, data) -> int:
+        subscribers = self._subscribers.get(channel, set())
+        for pubsub in subscribers:
+            pubsub.queue.put_nowait({'type': 'message', 'channel': channel, 'data': data})
+        return len(subscribers)
+
+    def pubsub(self) -> 'LocalPubSub':
+        return LocalPubSub(self)
+
+
+class LocalPubSub:
+    def __init__(self, broker: LocalBroker) -> None:
+        self.broker = broker
+        self.channels: Set[str] = set()
+        self.queue: asyncio.Queue = asyncio.Queue()
+
+    async def subscribe(self, *channels: str):
+        for channel in channels:
+            self.channels.add(channel)
+            self.broker._subscribers.setdefault(channel, set()).add(self)
+            self.queue.put_nowait({'type': 'subscribe', 'channel': channel, 'data': len(self.channels)})
+
+    async def unsubscribe(self, *channels: str):
+        for channel in channels or tuple(self.channels):
+            self.channels.discard(channel)
+            self.broker._subscribers.get(channel, set()).discard(self)
+
+    async def listen(self):
+        while True:
+            yield await self.queue.get()
+
+    async def aclose(self):
+        await self.unsubscribe()
+
+
+def backplane_from_url(url: Optional[str] = BACKPLANE_URL) -> Backplane:
+    if not url:
+        return InProcessBackplane()
+    if url.startswith('memory://'):
+        return PubSubBackplane(LocalBroker())
+    import redis.asyncio as redis   #only needed when running several workers
+    return PubSubBackplane(redis.from_url(url))
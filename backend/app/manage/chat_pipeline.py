@@ -0,0 +1,192 @@
+import asyncio
+import logging
+import os
+from datetime import datetime
+from typing import Dict, List, Tuple
+from sqlalchemy import insert, text
+from sqlalchemy.exc import IntegrityError
+from app.database import AsyncSessionLocal, async_engine
+from app.models.messages import DmMessage, GroupChatMessage, RoomMessage
+import dotenv
+
+dotenv.load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+
+CHAT_FLUSH_INTERVAL_MS = int(os.getenv('CHAT_FLUSH_INTERVAL_MS',50))   #max time a message waits before being written
+CHAT_FLUSH_SIZE = int(os.getenv('CHAT_FLUSH_SIZE',500))                #a batch this big is written right away
+CHAT_FLUSH_RETRIES = int(os.getenv('CHAT_FLUSH_RETRIES',3))            #attempts before the messages of a batch are given up
+
+
+class IdAllocator:
+    """
+    Hands out primary keys before the row is written, so a message can be delivered
+    (and paged by id) right away while its insert waits for the next batch
+
+    The ids are reserved from the table's sequence in blocks: the messages asking for an id while a
+    reservation is running wait for the next one, which takes them all in one round trip
+    (nextval over generate_series). A block is sized to the messages waiting, nothing is kept
+    aside, so the ids stay close to the order the messages were sent in across the workers.
+    """
+    def __init__(self, model) -> None:
+        self.model = model
+        self._waiting: List[asyncio.Future] = []
+        self._task: asyncio.Task | None = None
+
+    async def next_id(self) -> int:
+        future = asyncio.get_running_loop().create_future()
+        self._waiting.append(future)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._reserve())
+        return await future
+
+    async def _reserve(self):
+        while self._waiting:
+            waiting, self._waiting = self._waiting, []
+            try:
+                async with AsyncSessionLocal() as db:
+                    ids = (await db.scalars(
+                        text(f"select nextval(pg_get_serial_sequence('{self.model.__tablename__}','id')) from generate_series(1,:n)"),
+                        {'n': len(waiting)},
+                    )).all()
+            except Exception as e:
+                for future in waiting:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for future, id in zip(waiting, sorted(ids)):   #first come, smallest id
+                if not future.done():
+                    future.set_result(id)
+
+
+class MessagePipeline:
+    """
+    Write-behind persistence of chat messages
+
+    submit() gives the message its id and timestamp and returns at once, the message can be delivered.
+    The rows are inserted in micro batches (every CHAT_FLUSH_INTERVAL_MS or CHAT_FLUSH_SIZE messages,
+    one transaction per batch) and the future returned with each message tells when it is durable.
+    The ids come from the shared sequence in the order the messages are submitted, but a row may be
+    committed up to one flush after a bigger id from another worker: a since_id sync made in that
+    window can miss it (the connected clients got it live).
+    Without a sequence (sqlite, development) the message is written at once and gets its id from the insert.
+    """
+    def __init__(self, flush_interval_ms: int = CHAT_FLUSH_INTERVAL_MS, flush_size: int = CHAT_FLUSH_SIZE) -> None:
+        self.flush_interval = flush_interval_ms / 1000
+        self.flush_size = flush_size
+        self.allocators = {model: IdAllocator(model) for model in (DmMessage, GroupChatMessage, RoomMessage)}
+        # (model, row, persisted future) waiting for the next flush
+        self._pending: List[Tuple[type, dict, asyncio.Future]] = []
+        self._full = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the flush loop and write what is left"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        while self._pending:
+            await self.flush()
+
+    async def submit(self, model, **values) -> Tuple[dict, asyncio.Future]:
+        """
+        Args:
+            model: DmMessage, GroupChatMessage or RoomMessage
+            values: the column values of the message
+
+        Returns:
+            (row, persisted), row holds every column value including id and timestamp,
+            persisted resolves once the row is committed (or fails with the error)
+        """
+        if async_engine.dialect.name != 'postgresql':
+            return await self._write_now(model, {'timestamp': datetime.now(), **values})
+        self.start()
+        row = {'id': await self.allocators[model].next_id(), 'timestamp': datetime.now(), **values}
+        persisted = asyncio.get_running_loop().create_future()
+        self._pending.append((model, row, persisted))
+        if len(self._pending) >= self.flush_size:
+            self._full.set()
+        return row, persisted
+
+    async def _write_now(self, model, row: dict) -> Tuple[dict, asyncio.Future]:
+        #ids continuing after max(id) would collide between processes, the database assigns them instead
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(insert(model).values(**row))
+            await db.commit()
+        row['id'] = result.inserted_primary_key[0]
+        persisted = asyncio.get_running_loop().create_future()
+        persisted.set_result(row['id'])
+        return row, persisted
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._full.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._full.clear()
+            if self._pending:
+                try:
+                    await self.flush()
+                except Exception:
+                    logger.exception('chat flush failed')   #the futures carry the error, keep the loop alive
+
+    async def flush(self):
+        batch, self._pending = self._pending[:self.flush_size], self._pending[self.flush_size:]
+        rows: Dict[type, list] = {}
+        for model, row, _ in batch:
+            rows.setdefault(model, []).append(row)
+
+        for attempt in range(1, CHAT_FLUSH_RETRIES+1):
+            try:
+                failed = await self._write(rows)
+                break
+            except Exception as error:
+                if attempt == CHAT_FLUSH_RETRIES:
+                    for _, _, persisted in batch:
+                        if not persisted.done():
+                            persisted.set_exception(error)
+                    raise
+                await asyncio.sleep(0.1 * 2**attempt)
+
+        for model, row, persisted in batch:
+            if persisted.done():
+                continue
+            if id(row) in failed:
+                persisted.set_exception(failed[id(row)])
+            else:
+                persisted.set_result(row['id'])
+
+    async def _write(self, rows: Dict[type, list]) -> Dict[int, Exception]:
+        """Insert the batch in one transaction, rows breaking a constraint are retried one by one and reported"""
+        async with AsyncSessionLocal() as db:
+            try:
+                for model, model_rows in rows.items():
+                    await db.execute(insert(model), model_rows)
+                await db.commit()
+                return {}
+            except IntegrityError:
+                await db.rollback()
+
+            failed = {}
+            for model, model_rows in rows.items():
+                for row in model_rows:
+                    try:
+                        async with db.begin_nested():
+                            await db.execute(insert(model), [row])
+                    except IntegrityError as error:   #unknown recipient, group, room or parent
+                        failed[id(row)] = error
+            await db.commit()
+            return failed
+
+
+pipeline = MessagePipeline()
@@ -0,0 +1,113 @@
+from datetime import datetime
+from sqlalchemy import select,literal,exists,tuple_
+from sqlalchemy.orm import Session,aliased
+from app.models.posts import Comment
+from app.pagination import MAX_PAGE_SIZE,encode_cursor,decode_cursor,keyset_filter
+import os
+import dotenv
+
+dotenv.load_dotenv()
+
+
+COMMENT_TREE_MAX_DEPTH = int(os.getenv('COMMENT_TREE_MAX_DEPTH',6))
+COMMENT_TREE_MAX_REPLIES = int(os.getenv('COMMENT_TREE_MAX_REPLIES',20))   #replies shown per comment, per request
+
+#cursor of a reply list read from its start (the comments below the depth limit)
+FIRST_REPLIES_CURSOR = encode_cursor(datetime.min,0)
+
+
+def comment_tree(post_id:int, db:Session, parent_id:int|None = None, cursor:str|None = None,
+                 page_size:int = 10, depth:int = 3, replies:int = 3):
+    """
+    One page of a post's comment tree, read with a single recursive query
+
+    Args:
+        parent_id: None for the top level comments (newest first), a comment id for its replies (oldest first)
+        cursor: next_cursor of the previous page, or a more_replies cursor when parent_id is given
+        depth: levels returned, the page itself is level 1
+        replies: replies kept under each comment, the rest is behind the comment's more_replies cursor
+
+    The query walks down level by level and only follows the first `replies`+1 children of each
+    comment (index seek on parent_id), so a page costs at most page_size * (replies+1)^(depth-1) rows
+    whatever the size of the thread.
+
+    Returns:
+        (nodes, next_cursor)
+    """
+    page_size = max(1,min(page_size,MAX_PAGE_SIZE))
+    depth = max(1,min(depth,COMMENT_TREE_MAX_DEPTH))
+    replies = max(0,min(replies,COMMENT_TREE_MAX_REPLIES))
+
+    #level 1: the requested page, plus one row to know if there is a next page
+    first = select(Comment.id,Comment.created_at).where(Comment.post_id == post_id)
+    if parent_id is None:
+        first = first.where(Comment.parent_id.is_(None)).order_by(Comment.created_at.desc(),Comment.id.desc())
+        if cursor:
+            first = first.where(keyset_filter(Comment.created_at,Comment.id,cursor))
+    else:
+        first = first.where(Comment.parent_id == parent_id).order_by(Comment.created_at,Comment.id)
+        if cursor:
+            first = first.where(tuple_(Comment.created_at,Comment.id) > tuple_(*decode_cursor(cursor)))
+    first = first.limit(page_size+1).subquery()
+    tree = select(first.c.id,literal(1).label('depth')).cte('comment_tree',recursive=True)
+
+    #next levels: the first replies+1 children of every comment already in the tree
+    child = aliased(Comment)
+    sibling = aliased(Comment)
+    first_children = select(sibling.id).where(sibling.parent_id == tree.c.id).order_by(sibling.created_at,sibling.id).limit(replies+1)
+    tree = tree.union_all(
+        select(child.id,tree.c.depth+1).join(tree,child.parent_id == tree.c.id).where(
+            tree.c.depth < depth,
+            child.id.in_(first_children),
+        )
+    )
+
+    reply = aliased(Comment)
+    has_replies = exists().where(reply.parent_id == Comment.id)
+    rows = db.execute(
+        select(Comment,tree.c.depth,has_replies).join(tree,Comment.id == tree.c.id)
+    ).all()
+    return _build(rows,parent_id,page_size,depth,replies)
+
+
+def _build(rows, parent_id:int|None, page_size:int, depth:int, replies:int):
+    nodes = {}
+    children = {}
+    top = []
+    for comment,level,has_replies in rows:
+        nodes[comment.id] = {
+            'id': comment.id,
+            'content': comment.content,
+            'user_id': comment.user_id,
+            'post_id': comment.post_id,
+            'likes_nbr': comment.likes_nbr,
+            'parent_id': comment.parent_id,
+            'created_at': comment.created_at,
+            'replies': [],
+            #below the depth limit the replies were not read, they start at the beginning
+            'more_replies': FIRST_REPLIES_CURSOR if has_replies and level == depth else None,
+        }
+        if level == 1:
+            top.append(nodes[comment.id])
+        else:
+            children.setdefault(comment.parent_id,[]).append(comment)
+
+    for comment_id,comment_children in children.items():
+        comment_children.sort(key=lambda c: (c.created_at,c.id))
+        node = nodes[comment_id]
+        if len(comment_children) > replies:
+            last = comment_children[replies-1] if replies else None
+            node['more_replies'] = encode_cursor(last.created_at,last.id) if last else FIRST_REPLIES_CURSOR
+            comment_children = comment_children[:replies]
+        node['replies'] = [nodes[c.id] for c in comment_children]
+
+    if parent_id is None:
+        top.sort(key=lambda n: (n['created_at'],n['id']),reverse=True)
+    else:
+        top.sort(key=lambda n: (n['created_at'],n['id']))
+    next_cursor = None
+    if len(top) > page_size:
+        last = top[page_size-1]
+        next_cursor = encode_cursor(last['created_at'],last['id'])
+        top = top[:page_size]
+    return top,next_cursor
@@ -23,6 +23,95 @@ class ConnectionManager:
 
 from fastapi import WebSocket
 from typing import Dict, Set, List, Optional
+from app.manage.backplane import Backplane, InProcessBackplane
+from app.manage.membership import space_members, group_members
+from app.manage.autocomplete import autocomplete
+from app.manage.presence import PresenceRegistry, LastSeenBuffer, PRESENCE_PING_SECONDS, PRESENCE_TIMEOUT_SECONDS, LAST_SEEN_FLUSH_SECONDS
+import asyncio
+import json
+import time
+import logging
+import os
+import dotenv
+
+dotenv.load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+
+WS_SEND_QUEUE_SIZE = int(os.getenv('WS_SEND_QUEUE_SIZE',256))   #frames buffered per connection
+WS_SEND_TIMEOUT = float(os.getenv('WS_SEND_TIMEOUT',10))        #seconds a single send may take
+#what happens when a connection's queue is full:
+#  drop: the new frame is dropped
+#  disconnect: the connection is closed, the client reconnects and resyncs with since_id
+#  coalesce: the oldest queued frame is dropped so the client stays on the latest messages
+WS_BACKPRESSURE = os.getenv('WS_BACKPRESSURE','disconnect')
+
+
+class ConnectionWriter:
+    """
+    Outbound side of one websocket: a bounded queue drained by its own task,
+    so a slow client only delays itself
+    """
+    def __init__(self, user_id: int, websocket: WebSocket, on_close, max_size: int = WS_SEND_QUEUE_SIZE, policy: str = WS_BACKPRESSURE) -> None:
+        self.user_id = user_id
+        self.websocket = websocket
+        self.policy = policy
+        self.dropped = 0
+        self.closed = False
+        self.last_activity = time.monotonic()   #last frame received, the heartbeat closes the connection when too old
+        self._on_close = on_close   #called once the connection is given up
+        self._queue: asyncio.Queue[str] = asyncio.Queue(maxsize=max_size)
+        self._task = asyncio.create_task(self._run())
+
+    def send(self, data: str):
+        """Queue an already serialized frame, never waits"""
+        if self.closed:
+            return
+        try:
+            self._queue.put_nowait(data)
+            return
+        except asyncio.QueueFull:
+            pass
+        if self.policy == 'coalesce':
+            self._queue.get_nowait()
+            self._queue.put_nowait(data)
+            self.dropped += 1
+        elif self.policy == 'disconnect':
+            logger.warning('closing slow websocket of user %s', self.user_id)
+            self.give_up()
+        else:
+            self.dropped += 1
+
+    def close(self):
+        self.closed = True
+        if self._task is not asyncio.current_task():
+            self._task.cancel()
+
+    async def _run(self):
+        try:
+            while True:
+                data = await self._queue.get()
+                await asyncio.wait_for(self.websocket.send_text(data), WS_SEND_TIMEOUT)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # Connection broken or stuck, clean up
+            self.give_up()
+
+    def give_up(self, code: int = 1013):
+        """Close the connection and free its registry entries, 1013: try again later"""
+        if self.closed:
+            return
+        self.close()
+        asyncio.create_task(self._close_socket(code))
+        asyncio.create_task(self._on_close(self.user_id, self.websocket))
+
+    async def _close_socket(self, code: int):
+        try:
+            await self.websocket.close(code=code)
+        except Exception:
+            pass
 
 class AdvancedConnectionManager:
     def __init__(self) -> None:
@@ -41,6 +130,17 @@ class AdvancedConnectionManager:
         # Store user's spaces: user_id -> set of server_ids 
         self.user_spaces: Dict[int, Set[int]] = {}
 
+        # Store outbound queues: user_id -> ConnectionWriter
+        self.writers: Dict[int, ConnectionWriter] = {}
+
+        # Routes events to the worker holding the recipient's connection
+        self.backplane: Backplane = InProcessBackplane()
+        self.backplane.handler = self.handle_event
+
+        # Who is connected to any worker, and when the users of this one were last active
+        self.presence = PresenceRegistry()
+        self.last_seen = LastSeenBuffer()
+        self._heartbeat: Optional[asyncio.Task] = None
 
     
     async def connect(self, user_id: int, websocket: WebSocket, user_groups: List[int] = None, user_spaces: List[int] = None):
@@ -53,7 +153,12 @@ class AdvancedConnectionManager:
             user_groups: List of group IDs the user belongs to (fetch from database)
         """
         await websocket.accept()
+        if user_id in self.writers:   #a newer connection replaces the old one
+            self.writers.pop(user_id).close()
         self.active_connections[user_id] = websocket
+        self.writers[user_id] = ConnectionWriter(user_id, websocket, self.disconnect)
+        self.last_seen.touch(user_id)
+        await self._publish_presence('online', user_id)
         
         # Register user to their groups
         if user_groups:
@@ -72,10 +177,17 @@ class AdvancedConnectionManager:
 
 
     
-    async def disconnect(self, user_id: int):
-        """Disconnect user and remove from all groups"""
+    async def disconnect(self, user_id: int, websocket: Optional[WebSocket] = None):
+        """Disconnect user and remove from all groups (only if `websocket` is still the user's connection, when given)"""
+        if websocket is not None and self.active_connections.get(user_id) is not websocket:
+            return
         # Remove from active connections
         self.active_connections.pop(user_id, None)
+        writer = self.writers.pop(user_id, None)
+        if writer:
+            writer.close()
+            self.last_seen.touch(user_id)
+            await self._publish_presence('offline', user_id)
         
         # Remove from all groups
         if user_id in self.user_groups:
@@ -97,18 +209,96 @@ class AdvancedConnectionManager:
                         del self.space_members[space_id]
             del self.user_spaces[user_id]
     
-    async def send_direct_message(self, message: str,sender_id:int, receiver_id: int, msg: None):
-        """Send a direct message to a specific user"""
-        if receiver_id in self.active_connections:
-            websocket = self.active_connections[receiver_id]
+    async def use_backplane(self, backplane: Backplane):
+        """Route events through another backplane (called once at startup)"""
+        await self.backplane.stop()
+        self.backplane = backplane
+        await backplane.start(self.handle_event)
+
+    def start(self):
+        """Start the heartbeats (called once at startup)"""
+        if self._heartbeat is None:
+            self._heartbeat = asyncio.create_task(self._run_heartbeats())
+
+    async def stop(self):
+        if self._heartbeat:
+            self._heartbeat.cancel()
             try:
-                msg = msg.model_dump()
-                msg['timestamp'] = msg['timestamp'].isoformat()
-                await websocket.send_json(msg)
-            except:
-                # Connection might be broken, clean up
-                await self.disconnect(receiver_id)
-                
+                await self._heartbeat
+            except asyncio.CancelledError:
+                pass
+            self._heartbeat = None
+        await self.backplane.stop()
+        for user_id, writer in self.writers.items():
+            writer.close()
+            self.last_seen.touch(user_id)
+        await self.last_seen.flush()
+
+    def touch(self, user_id: int, websocket: WebSocket):
+        """A frame was received on the connection (a pong or anything else), it is alive"""
+        writer = self.writers.get(user_id)
+        if writer and writer.websocket is websocket:
+            writer.last_activity = time.monotonic()
+            self.last_seen.touch(user_id)
+
+    async def _run_heartbeats(self):
+        flushed = time.monotonic()
+        while True:
+            await asyncio.sleep(PRESENCE_PING_SECONDS)
+            try:
+                await self.heartbeat()
+                if time.monotonic() - flushed >= LAST_SEEN_FLUSH_SECONDS:
+                    flushed = time.monotonic()
+                    await self.last_seen.flush()
+            except Exception:
+                logger.exception('heartbeat failed')   #the next one runs anyway
+
+    async def heartbeat(self):
+        """
+        Ping every connection, close the ones silent for PRESENCE_TIMEOUT_SECONDS
+
+        A dead client (closed laptop, lost network) never raises on our side until a send times out,
+        the missing pongs find it. Closing goes through disconnect(), which frees its registry entries.
+        """
+        cutoff = time.monotonic() - PRESENCE_TIMEOUT_SECONDS
+        ping = json.dumps({'type': 'ping'})
+        for writer in list(self.writers.values()):
+            if writer.last_activity < cutoff:
+                logger.info('closing silent websocket of user %s', writer.user_id)
+                writer.give_up(code=1001)   #going away
+            else:
+                writer.send(ping)
+        self.presence.expire()
+        await self.backplane.publish({'type': 'presence', 'action': 'snapshot', 'worker': self.presence.worker_id, 'user_ids': list(self.writers)})
+
+    async def _publish_presence(self, action: str, user_id: int):
+        await self.backplane.publish({'type': 'presence', 'action': action, 'worker': self.presence.worker_id, 'user_id': user_id})
+
+    def is_online(self, user_id: int) -> bool:
+        """Connected to any worker"""
+        return user_id in self.active_connections or self.presence.is_online(user_id)
+
+    async def handle_event(self, event: dict):
+        """Deliver an event published by any worker to the connections held by this one"""
+        kind = event['type']
+        if kind == 'dm':
+            self.deliver_direct_message(event['receiver_id'], event['data'])
+        elif kind == 'group':
+            self.deliver_group_message(event['group_id'], event['sender_id'], event['data'])
+        elif kind == 'room':
+            self.deliver_room_message(event['space_id'], event['sender_id'], event['data'])
+        elif kind == 'membership':
+            self._apply_membership(event)
+        elif kind == 'presence':
+            self.presence.apply(event)
+
+    async def send_direct_message(self, message: str,sender_id:int, receiver_id: int, msg: None):
+        """Send a direct message to a specific user, wherever they are connected"""
+        await self.backplane.publish({'type': 'dm', 'sender_id': sender_id, 'receiver_id': receiver_id, 'data': msg.model_dump_json()})
+
+    async def send_user_event(self, receiver_id: int, event: dict):
+        """Send a frame that is not a message (read watermarks...) to a user, wherever they are connected"""
+        await self.backplane.publish({'type': 'dm', 'sender_id': None, 'receiver_id': receiver_id, 'data': json.dumps(event)})
 
     async def send_group_message(self, message: str, group_id: int, sender_id: Optional[int] = None,msg=None):
         """
@@ -119,25 +309,7 @@ class AdvancedConnectionManager:
             group_id: The group ID
             sender_id: ID of the sender (optional, to exclude from receiving the message)
         """
-        if group_id not in self.group_members:
-            return 
-        
-        msg = msg.model_dump()
-        msg['timestamp'] = msg['timestamp'].isoformat()
-        for user_id in self.group_members[group_id].copy():  # Copy to avoid modification during iteration
-            # Skip sender if specified
-            if sender_id and user_id == sender_id:
-                continue
-                
-            if user_id in self.active_connections:
-                
-                try:
-    
-                    websocket = self.active_connections[user_id]
-                    await websocket.send_json(data=msg)
-                except:
-                    # Connection broken, clean up
-                    await self.disconnect(user_id)
+        await self.backplane.publish({'type': 'group', 'group_id': group_id, 'sender_id': sender_id, 'data': msg.model_dump_json()})
 
     async def send_room_message(self, message: str, space_id: int, sender_id: Optional[int] = None,msg=None):
         """
@@ -145,52 +317,86 @@ class AdvancedConnectionManager:
         
         Args:
             message: The message to send
-            group_id: The group ID
+            space_id: The space ID
             sender_id: ID of the sender (optional, to exclude from receiving the message)
         """
-        if space_id not in self.space_members:
-            return 
-        
-        msg = msg.model_dump()
-        msg['timestamp'] = msg['timestamp'].isoformat()
-        for user_id in self.space_members[space_id].copy():  # Copy to avoid modification during iteration
+        await self.backplane.publish({'type': 'room', 'space_id': space_id, 'sender_id': sender_id, 'data': msg.model_dump_json()})
+
+    #delivery only queues the frame on each connection, the writers send concurrently
+    def deliver_direct_message(self, receiver_id: int, data: str):
+        writer = self.writers.get(receiver_id)
+        if writer:
+            writer.send(data)
+
+    def deliver_group_message(self, group_id: int, sender_id: Optional[int], data: str):
+        self._broadcast(self.group_members.get(group_id), sender_id, data)
+
+    def deliver_room_message(self, space_id: int, sender_id: Optional[int], data: str):
+        self._broadcast(self.space_members.get(space_id), sender_id, data)
+
+    def _broadcast(self, members: Optional[Set[int]], sender_id: Optional[int], data: str):
+        if not members:
+            return
+        for user_id in members:
             # Skip sender if specified
             if sender_id and user_id == sender_id:
                 continue
-                
-            if user_id in self.active_connections:
-                
-                try:
-                    websocket = self.active_connections[user_id]
-                    await websocket.send_json(data=msg)
-                except:
-                    # Connection broken, clean up
-                    await self.disconnect(user_id)
-
-       
-    
-    def add_user_to_group(self, user_id: int, group_id: int):
+            writer = self.writers.get(user_id)
+            if writer:
+                writer.send(data)
+
+    async def add_user_to_group(self, user_id: int, group_id: int):
         """Add a user to a group (call this when user joins a new group)"""
-        if group_id not in self.group_members:
-            self.group_members[group_id] = set()
-        
-        if user_id not in self.user_groups:
-            self.user_groups[user_id] = set()
-        
-        self.group_members[group_id].add(user_id)
-        self.user_groups[user_id].add(group_id)
+        await self._publish_membership('add', 'group', user_id, group_id)
     
-    def remove_user_from_group(self, user_id: int, group_id: int):
+    async def remove_user_from_group(self, user_id: int, group_id: int):
         """Remove a user from a group"""
-        if group_id in self.group_members:
-            self.group_members[group_id].discard(user_id)
-            if not self.group_members[group_id]:   #clear if empty
-                del self.group_members[group_id]
+        await self._publish_membership('remove', 'group', user_id, group_id)
+
+    async def add_user_to_space(self, user_id: int, space_id: int):
+        """Add a user to a space (call this when user joins a new space)"""
+        await self._publish_membership('add', 'space', user_id, space_id)
+
+    async def remove_user_from_space(self, user_id: int, space_id: int):
+        """Remove a user from a space"""
+        await self._publish_membership('remove', 'space', user_id, space_id)
+
+    async def _publish_membership(self, action: str, scope: str, user_id: int, target_id: int):
+        event = {'type': 'membership', 'action': action, 'scope': scope, 'user_id': user_id, 'target_id': target_id}
+        self._apply_membership(event)   #this worker right away, applying it twice is harmless
+        #the worker holding the user's connection may be another one
+        await self.backplane.publish(event)
+
+    def _apply_membership(self, event: dict):
+        if event['scope'] == 'group':
+            members, user_targets, service = self.group_members, self.user_groups, group_members
+        else:
+            members, user_targets, service = self.space_members, self.user_spaces, space_members
+        if event['action'] == 'add':
+            self._add_member(members, user_targets, event['user_id'], event['target_id'])
+            service.added(event['target_id'], event['user_id'])
+        else:
+            self._remove_member(members, user_targets, event['user_id'], event['target_id'])
+            service.removed(event['target_id'], event['user_id'])
+        if event['scope'] == 'space':
+            autocomplete.scopes.forget(event['user_id'])   #their spaces come first in autocomplete
+
+    @staticmethod
+    def _add_member(members: Dict[int, Set[int]], user_targets: Dict[int, Set[int]], user_id: int, target_id: int):
+        members.setdefault(target_id, set()).add(user_id)
+        user_targets.setdefault(user_id, set()).add(target_id)
+
+    @staticmethod
+    def _remove_member(members: Dict[int, Set[int]], user_targets: Dict[int, Set[int]], user_id: int, target_id: int):
+        if target_id in members:
+            members[target_id].discard(user_id)
+            if not members[target_id]:   #clear if empty
+                del members[target_id]
         
-        if user_id in self.user_groups:
-            self.user_groups[user_id].discard(group_id)
-            if not self.user_groups[user_id]:     #clear if empty
-                del self.user_groups[user_id]
+        if user_id in user_targets:
+            user_targets[user_id].discard(target_id)
+            if not user_targets[user_id]:     #clear if empty
+                del user_targets[user_id]
     
     def get_group_members(self, group_id: int) -> List[int]:
         """Get all members of a group"""
@@ -208,30 +414,6 @@ class AdvancedConnectionManager:
         return [user_id for user_id in self.group_members[group_id] 
                 if user_id in self.active_connections]
 
-    def add_user_to_space(self, user_id: int, space_id: int):
-        """Add a user to a space (call this when user joins a new space)"""
-        if space_id not in self.space_members:
-            self.space_members[space_id] = set()
-        
-        if user_id not in self.user_spaces:
-            self.user_spaces[user_id] = set()
-        
-        self.space_members[space_id].add(user_id)
-        self.user_spaces[user_id].add(space_id)
-
-    def remove_user_from_space(self, user_id: int, space_id: int):
-        """Remove a user from a space"""
-        if space_id in self.space_members:
-            self.space_members[space_id].discard(user_id)
-            if not self.space_members[space_id]:   #clear if empty
-                del self.space_members[space_id]
-        
-        if user_id in self.user_spaces:
-            self.user_spaces[user_id].discard(space_id)
-            if not self.user_spaces[user_id]:     #clear if empty
-                del self.user_spaces[user_id]
-
-    
     def get_space_members(self, space_id: int) -> List[int]:
         """Get all members of a space"""
         return list(self.space_members.get(space_id, set()))
@@ -1,18 +1,32 @@
 from fastapi import WebSocket,APIRouter,WebSocketDisconnect
+from starlette.websockets import WebSocketState
 from app.manage.connection_manager import AdvancedConnectionManager
-from app.authentication import current_user
-from app.dependencies import get_db,SessionLocal,SessionDep
-from typing import Dict,List
-from app.models.messages import DmMessage,GroupChat,GroupChatMessage,RoomMessage
+from app.authentication import current_user_async
+from app.dependencies import AsyncSessionDep
+from app.database import AsyncSessionLocal
+from typing import Dict,List,Set
+from app.models.messages import DmMessage,GroupChat,GroupChatMessage,RoomMessage,group_chat_members
+from app.models.spaces import Space,Room,membership
 from fastapi import Depends
 from app.authentication import oauth2_scheme
 from typing import Annotated
-from app.schemas.dm_messages_schemas import DmMessageDisplay,GroupMesssageDisplay,RoomMessageDisplay
-from app.manage.groups_manage import fetch_group
-from app.manage.spaces_manage import fetch_room,fetch_space
+from app.schemas.dm_messages_schemas import DmMessageDisplay,GroupMesssageDisplay,RoomMessageDisplay,ReadMark,ReadWatermarkDisplay,UnreadDisplay
 from fastapi.exceptions import HTTPException
-from app.models.messages import RoomMessage
 from app.manage.connection_manager import manager
+from sqlalchemy import select
+from sqlalchemy.orm import selectinload
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.manage.groups_manage import is_group_member
+from app.manage.spaces_manage import is_space_member
+from app.manage.chat_pipeline import pipeline
+from app.manage.presence import presence_ids,latest
+from app.manage.read_state import mark_read,watermarks,unread_counts
+from app.models.messages import ReadWatermark
+from pydantic import ValidationError
+from app.models.users import User
+from app.schemas.presence_schemas import PresenceDisplay
+from fastapi import Query
+import json
 
 
 
@@ -21,114 +35,281 @@ from app.manage.connection_manager import manager
 messages_router = APIRouter(prefix='/messages',tags=['messages'])
 
 
+#rooms never move to another space, so the room -> space lookup is cached
+room_spaces: Dict[int,int] = {}
+
+async def fetch_room_space(room_id:int, db:AsyncSession) -> int:
+    if room_id not in room_spaces:
+        space_id = await db.scalar(select(Room.space_id).where(Room.id == room_id))
+        if space_id is None:
+            raise ValueError(f'room {room_id} does not exist')
+        room_spaces[room_id] = space_id
+    return room_spaces[room_id]
+
+
+#users are never deleted, an id seen once stays valid
+known_users: Set[int] = set()
+
+async def user_exists(user_id:int, db:AsyncSession) -> bool:
+    if user_id not in known_users:
+        if await db.scalar(select(User.id).where(User.id == user_id)) is None:
+            return False
+        known_users.add(user_id)
+    return True
+
+
+def acknowledge(user_id:int, kind:str, message_id:int, client_id, persisted):
+    """Tell the sender once the message is durable (or failed), client_id is echoed back to match it"""
+    def on_done(future):
+        failed = future.cancelled() or future.exception() is not None
+        ack = {'type':'ack','kind':kind,'id':message_id,'client_id':client_id,'status':'failed' if failed else 'persisted'}
+        manager.deliver_direct_message(user_id,json.dumps(ack))
+    persisted.add_done_callback(on_done)
+
+
+def reject(user_id:int, kind:str, client_id):
+    """Tell the sender a message was refused (not a member, unknown room), it is neither stored nor delivered"""
+    manager.deliver_direct_message(user_id,json.dumps({'type':'ack','kind':kind,'id':None,'client_id':client_id,'status':'failed'}))
+
+
+async def fetch_presence(user_ids:List[int], db:AsyncSession) -> List[PresenceDisplay]:
+    """online status and last seen of the users, the unknown ids are left out"""
+    user_ids = presence_ids(user_ids)
+    stored = dict((await db.execute(select(User.id,User.last_seen).where(User.id.in_(user_ids)))).all())
+    return [
+        #the last activity on this worker may not be written yet
+        PresenceDisplay(user_id=user_id,online=manager.is_online(user_id),last_seen=latest(stored[user_id],manager.last_seen.get(user_id)))
+        for user_id in user_ids if user_id in stored
+    ]
+
+
 @messages_router.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket,token:str):
-    db = SessionLocal()
-    user = current_user(token,next(get_db()))
-    #we fetch all user's groups
-    groups = db.query(GroupChat).filter(GroupChat.members.any(id=user.id)).all()
-    groups = [g.id for g in groups]
-    print(user.id)
-    await manager.connect(user.id,websocket,groups)
+    #messages are written by the pipeline, the connection only opens a short session per lookup
+    #so that an idle socket never holds a pooled connection
+    async with AsyncSessionLocal() as db:
+        user = await current_user_async(token,db)
+        #we fetch all user's groups and spaces
+        groups = (await db.scalars(select(group_chat_members.c.group_chat_id).where(group_chat_members.c.user_id == user.id))).all()
+        spaces = (await db.scalars(select(membership.c.space_id).where(membership.c.user_id == user.id))).all()
+        user_id = user.id
+    await manager.connect(user_id,websocket,list(groups),list(spaces))
 
     try:
 
         while True:
             data = await websocket.receive_json()
+            manager.touch(user_id,websocket)   #any frame, the pongs included, shows the connection is alive
+            #messages are delivered as soon as they have an id, the insert is batched (see chat_pipeline)
             if data.get('type') and data['type'] == 'dm':
                 message = data["message"]
         
                 receiver_id = int(data["receiver_id"])
-                db = SessionLocal()
-        
-                msg = DmMessage(  #create the message instance
+                #the insert is deferred, an unknown receiver must be refused before the message is delivered
+                async with AsyncSessionLocal() as db:
+                    allowed = await user_exists(receiver_id,db)
+                if not allowed:
+                    reject(user_id,'dm',data.get('client_id'))
+                    continue
+
+                row,persisted = await pipeline.submit(DmMessage,
                     content = message,
-                    sender_id = user.id,
-                    recipient_id = receiver_id
+                    sender_id = user_id,
+                    recipient_id = receiver_id,
+                    parent_message_id = None
                 )
-                db.add(msg)
-                db.commit()
-
-                msg = DmMessageDisplay.model_validate(msg)
-                await manager.send_direct_message(message,user.id,receiver_id,msg)
+                msg = DmMessageDisplay.model_validate(row)
+                await manager.send_direct_message(message,user_id,receiver_id,msg)
+                acknowledge(user_id,'dm',row['id'],data.get('client_id'),persisted)
             elif data.get('type') and data['type'] == 'group':
                 message = data["message"]
 
                 group_id = int(data["group_id"])
                 parent_id = data.get('parent_id',None) 
                 parent_id = int(parent_id) if parent_id else None
-                db = SessionLocal()
+                async with AsyncSessionLocal() as db:
+                    allowed = await is_group_member(group_id,user_id,db)
+                if not allowed:
+                    reject(user_id,'group',data.get('client_id'))
+                    continue
 
-                msg = GroupChatMessage(
+                row,persisted = await pipeline.submit(GroupChatMessage,
                     content = message,
-                    sender_id = user.id,
+                    sender_id = user_id,
                     group_chat_id = group_id,
                     parent_message_id = parent_id
                 )
-                db.add(msg)
-                db.commit()
-            
-                msg = GroupMesssageDisplay.model_validate(msg)
-                
-                await manager.send_group_message(message,group_id,user.id,msg)
+                msg = GroupMesssageDisplay.model_validate(row)
+                await manager.send_group_message(message,group_id,user_id,msg)
+                acknowledge(user_id,'group',row['id'],data.get('client_id'),persisted)
 
             elif data.get('type') and data['type'] == 'space':
                 message = data["message"]
 
-                space_id = int(data["space_id"])
                 room_id = int(data["room_id"])
                 parent_id = data.get('parent_id',None) 
                 parent_id = int(parent_id) if parent_id else None
-                db = SessionLocal()
-               
 
-                msg = RoomMessage(
+                #routed to the room's own space, the space_id sent by the client is not trusted
+                async with AsyncSessionLocal() as db:
+                    try:
+                        room_space_id = await fetch_room_space(room_id,db)
+                    except ValueError:
+                        room_space_id = None
+                    allowed = room_space_id is not None and await is_space_member(room_space_id,user_id,db)
+                if not allowed:
+                    reject(user_id,'space',data.get('client_id'))
+                    continue
+                row,persisted = await pipeline.submit(RoomMessage,
                     content = message,
-                    sender_id = user.id,
+                    sender_id = user_id,
                     room_id = room_id,
                     parent_message_id = parent_id
                 )
-                db.add(msg)
-                db.commit()
-            
-                msg = RoomMessageDisplay.model_validate(msg)
-                
-                await manager.send_room_message(message,space_id,user.id,msg)
-
-            
+                msg = RoomMessageDisplay.model_validate({**row,'space_id':room_space_id})
+                await manager.send_room_message(message,room_space_id,user_id,msg)
+                acknowledge(user_id,'space',row['id'],data.get('client_id'),persisted)
+
+            elif data.get('type') and data['type'] == 'read':
+                try:
+                    async with AsyncSessionLocal() as db:
+                        await apply_read(user_id,ReadMark.model_validate(data),db)
+                    status = 'persisted'
+                except (HTTPException,ValidationError):
+                    status = 'failed'
+                manager.deliver_direct_message(user_id,json.dumps({'type':'ack','kind':'read','client_id':data.get('client_id'),'status':status}))
+
+            elif data.get('type') and data['type'] == 'ping':   #client side heartbeat
+                manager.deliver_direct_message(user_id,json.dumps({'type':'pong'}))
+
+            elif data.get('type') and data['type'] == 'presence':
+                async with AsyncSessionLocal() as db:
+                    users = await fetch_presence(data.get('user_ids') or [],db)
+                reply = {'type':'presence','client_id':data.get('client_id'),'users':[user.model_dump(mode='json') for user in users]}
+                manager.deliver_direct_message(user_id,json.dumps(reply))
+
     except WebSocketDisconnect:
-        manager.disconnect(user.id)
+        pass
+    except Exception:
+        if websocket.application_state != WebSocketState.DISCONNECTED:   #closed by the server (slow or silent client) is a normal end
+            raise
+    finally:
+        await manager.disconnect(user_id,websocket)
+
+
+async def apply_read(user_id:int, mark:ReadMark, db:AsyncSession) -> ReadWatermarkDisplay:
+    """
+    Move the user's read watermark and push it to their connection, and to the other user of a dm (read receipts)
+
+    Returns:
+        the watermark, which may be ahead of the one given
+    """
+    if mark.kind == 'group':
+        if not await is_group_member(mark.conversation_id,user_id,db):
+            raise HTTPException(status_code=403,detail='you are not a member of this group chat')
+    elif mark.kind == 'room':
+        try:
+            space_id = await fetch_room_space(mark.conversation_id,db)
+        except ValueError:
+            raise HTTPException(status_code=404,detail='Room not found')
+        if not await is_space_member(space_id,user_id,db):
+            raise HTTPException(status_code=403,detail='you are not a member of this space')
+
+    moved = await mark_read(user_id,mark.kind,mark.conversation_id,mark.last_read_id,db)
+    last_read_id = mark.last_read_id if moved else (await watermarks(user_id,mark.kind,[mark.conversation_id],db))[mark.conversation_id]
+    await db.commit()
+    watermark = ReadWatermarkDisplay(user_id=user_id,kind=mark.kind,conversation_id=mark.conversation_id,last_read_id=last_read_id)
+    if moved:
+        event = {'type':'read',**watermark.model_dump()}
+        await manager.send_user_event(user_id,event)   #the user's other devices
+        if mark.kind == 'dm':
+            await manager.send_user_event(mark.conversation_id,event)
+    return watermark
+
+
+@messages_router.post('/read/',response_model=ReadWatermarkDisplay)
+async def read_conversation(mark:ReadMark,db:AsyncSessionDep,token:Annotated[str,Depends(oauth2_scheme)]):
+    """mark a conversation read up to a message, whatever the number of messages it is one write"""
+    user = await current_user_async(token,db)
+    return await apply_read(user.id,mark,db)
+
+
+@messages_router.get('/unread/',response_model=List[UnreadDisplay])
+async def get_unread_counts(db:AsyncSessionDep,token:Annotated[str,Depends(oauth2_scheme)]):
+    """the conversations with unread messages, the others are left out"""
+    user = await current_user_async(token,db)
+    return [UnreadDisplay.model_validate(row,from_attributes=True) for row in await unread_counts(user.id,db)]
+
+
+@messages_router.get('/presence/',response_model=List[PresenceDisplay])
+async def get_presence(db:AsyncSessionDep,token:Annotated[str,Depends(oauth2_scheme)],ids:List[int] = Query(...)):
+    """?ids=1&ids=2, at most PRESENCE_MAX_IDS users"""
+    await current_user_async(token,db)
+    return await fetch_presence(ids,db)
+
+
+#history endpoints return at most `limit` messages, oldest first
+#  - latest page: no parameters
+#  - older pages: before_id = the smallest id already loaded
+#  - reconnect sync: since_id = the biggest id already loaded, only the missed messages are returned
+HISTORY_DEFAULT_LIMIT = 50
+HISTORY_MAX_LIMIT = 200
+
+async def page_history(db:AsyncSession, query, id_col, before_id:int|None, since_id:int|None, limit:int):
+    limit = max(1,min(limit,HISTORY_MAX_LIMIT))
+    if before_id is not None:
+        query = query.where(id_col < before_id)
+    if since_id is not None:   #delta mode, read forward from the last message the client has
+        return (await db.scalars(query.where(id_col > since_id).order_by(id_col).limit(limit))).all()
+    messages = (await db.scalars(query.order_by(id_col.desc()).limit(limit))).all()   #backward mode, newest page first
+    return list(reversed(messages))
 
 
 @messages_router.get("/history/dm/{receiver_id}/",response_model=List[DmMessageDisplay])
-def get_chat_history(receiver_id: int, db: SessionDep,token:Annotated[str,Depends(oauth2_scheme)]):
-    user = current_user(token,next(get_db()))
-    messages = db.query(DmMessage).filter(
+async def get_chat_history(receiver_id: int, db: AsyncSessionDep,token:Annotated[str,Depends(oauth2_scheme)],before_id:int|None = None,since_id:int|None = None,limit:int = HISTORY_DEFAULT_LIMIT):
+    user = await current_user_async(token,db)
+    query = select(DmMessage).where(
         ((DmMessage.sender_id == user.id) & (DmMessage.recipient_id == receiver_id)) |
         ((DmMessage.sender_id == receiver_id) & (DmMessage.recipient_id == user.id))
-    ).order_by(DmMessage.timestamp).all()
+    )
+    messages = await page_history(db,query,DmMessage.id,before_id,since_id,limit)
 
-    return messages
+    #a message is read once the watermark of its recipient is past it
+    read_up_to = dict((await db.execute(select(ReadWatermark.user_id,ReadWatermark.last_read_id).where(
+        ReadWatermark.kind == 'dm',
+        ((ReadWatermark.user_id == user.id) & (ReadWatermark.conversation_id == receiver_id)) |
+        ((ReadWatermark.user_id == receiver_id) & (ReadWatermark.conversation_id == user.id))
+    ))).all())
+    return [
+        DmMessageDisplay.model_validate(message).model_copy(update={'is_read':message.id <= read_up_to.get(message.recipient_id,0)})
+        for message in messages
+    ]
 
 @messages_router.get('/history/group/{group_id}/',response_model=List[GroupMesssageDisplay])
-def get_group_chat_history(group_id:int,db: SessionDep,token:Annotated[str,Depends(oauth2_scheme)]):
-    user = current_user(token,next(get_db()))
-    group = fetch_group(group_id,db)
-    if not user.id in group.members_ids:
+async def get_group_chat_history(group_id:int,db: AsyncSessionDep,token:Annotated[str,Depends(oauth2_scheme)],before_id:int|None = None,since_id:int|None = None,limit:int = HISTORY_DEFAULT_LIMIT):
+    user = await current_user_async(token,db)
+    if not await db.get(GroupChat,group_id):
+        raise HTTPException(404,'the group you are looking for does not exist')
+    if not await is_group_member(group_id,user.id,db):
         raise HTTPException(status_code=403,detail='you are not a member of this group chat')
-    messages = db.query(GroupChatMessage).filter(GroupChatMessage.group_chat_id == group_id).order_by(GroupChatMessage.timestamp).all()
+    query = select(GroupChatMessage).where(GroupChatMessage.group_chat_id == group_id)
+    messages = await page_history(db,query,GroupChatMessage.id,before_id,since_id,limit)
     
     return messages
 
 
 @messages_router.get('/history/space/{space_id}/room/{room_id}/',response_model=List[RoomMessageDisplay])
-def get_room_chat_history(space_id:int,room_id:int,db: SessionDep,token:Annotated[str,Depends(oauth2_scheme)]):
-    user = current_user(token,next(get_db()))
-    space = fetch_space(space_id,db)
-    room = fetch_room(room_id,space_id,db)
-    if not user.id in space.members_ids:
+async def get_room_chat_history(space_id:int,room_id:int,db: AsyncSessionDep,token:Annotated[str,Depends(oauth2_scheme)],before_id:int|None = None,since_id:int|None = None,limit:int = HISTORY_DEFAULT_LIMIT):
+    user = await current_user_async(token,db)
+    if not await db.get(Space,space_id):
+        raise HTTPException(status_code=404,detail="Space not found")
+    room = await db.get(Room,room_id)
+    if not room or room.space_id != space_id:
+        raise HTTPException(status_code=404, detail="Room not found")
+    if not await is_space_member(space_id,user.id,db):
         raise HTTPException(status_code=403,detail='you are not a member of this space')
-    messages = db.query(RoomMessage).filter(RoomMessage.room_id == room_id).order_by(RoomMessage.timestamp).all()
+    query = select(RoomMessage).where(RoomMessage.room_id == room_id).options(selectinload(RoomMessage.room))   #for space_id
+    messages = await page_history(db,query,RoomMessage.id,before_id,since_id,limit)
     
     return messages
 
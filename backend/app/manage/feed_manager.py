@@ -0,0 +1,193 @@
+from sqlalchemy import select,insert,union,literal,exists,or_,true,func,DateTime
+from sqlalchemy.orm import Session,selectinload
+from app.models.feeds import FeedEntry
+from app.models.posts import Post
+from app.models.follows import Follow
+from app.models.spaces import Space,membership
+from app.models.users import User
+from app.pagination import MAX_PAGE_SIZE,keyset_filter,next_cursor
+import heapq
+import os
+import dotenv
+
+dotenv.load_dotenv()
+
+
+#authors (or spaces) at or above this size are not fanned out on write, their posts are pulled at read time
+FEED_FANOUT_THRESHOLD = int(os.getenv('FEED_FANOUT_THRESHOLD',5000))
+#how many recent posts are pushed into a timeline when a follow is accepted or a space is joined
+FEED_BACKFILL_SIZE = int(os.getenv('FEED_BACKFILL_SIZE',50))
+#timelines are trimmed to this length by the scheduler, like any home feed it does not go back forever
+FEED_MAX_LENGTH = int(os.getenv('FEED_MAX_LENGTH',1000))
+
+
+def _insert_entries(recipients, posts, db:Session):
+    """
+    Insert (recipient, post) pairs into the timelines, skipping the pairs that already exist
+
+    Args:
+        recipients: a select returning a single user_id column
+        posts: a select returning (post_id, created_at)
+    """
+    recipients = recipients.subquery()
+    posts = posts.subquery()
+    rows = select(recipients.c.user_id,posts.c.post_id,posts.c.created_at).select_from(
+        recipients.join(posts,true())    #every recipient gets every post
+    ).where(
+        ~exists().where(
+            FeedEntry.user_id == recipients.c.user_id,
+            FeedEntry.post_id == posts.c.post_id,
+        )
+    )
+    db.execute(insert(FeedEntry).from_select(['user_id','post_id','created_at'],rows))
+
+
+def fan_out_post(post:Post, db:Session):
+    """Push a freshly created post into the timelines of the author's followers and the space members"""
+    audience = []
+    if post.user.followers_nbr < FEED_FANOUT_THRESHOLD:
+        audience.append(
+            select(Follow.follower_id.label('user_id')).where(Follow.followed_id == post.user_id, Follow.is_pending == False)
+        )
+    if post.space_id and post.space.members_nbr < FEED_FANOUT_THRESHOLD:
+        audience.append(
+            select(membership.c.user_id.label('user_id')).where(membership.c.space_id == post.space_id, membership.c.user_id != post.user_id)
+        )
+    if not audience:   #big accounts and spaces are served by the read path
+        return
+
+    recipients = audience[0] if len(audience) == 1 else union(*audience)
+    posts = select(literal(post.id).label('post_id'),literal(post.created_at,DateTime).label('created_at'))
+    _insert_entries(recipients,posts,db)
+
+
+def remove_post_from_feeds(post_id:int, db:Session):
+    db.query(FeedEntry).filter(FeedEntry.post_id == post_id).delete(synchronize_session=False)
+
+
+def backfill_follow(follower_id:int, followed:User, db:Session):
+    """Seed the follower's timeline with the recent posts of the user they just started following"""
+    if followed.followers_nbr >= FEED_FANOUT_THRESHOLD:
+        return
+    recipients = select(literal(follower_id).label('user_id'))
+    posts = select(Post.id.label('post_id'),Post.created_at.label('created_at')).where(
+        Post.user_id == followed.id
+    ).order_by(Post.created_at.desc()).limit(FEED_BACKFILL_SIZE)
+    _insert_entries(recipients,posts,db)
+
+
+def backfill_space(user_id:int, space:Space, db:Session):
+    """Seed the new member's timeline with the recent posts of the space they just joined"""
+    if space.members_nbr >= FEED_FANOUT_THRESHOLD:
+        return
+    recipients = select(literal(user_id).label('user_id'))
+    posts = select(Post.id.label('post_id'),Post.created_at.label('created_at')).where(
+        Post.space_id == space.id,
+        Post.user_id != user_id,
+    ).order_by(Post.created_at.desc()).limit(FEED_BACKFILL_SIZE)
+    _insert_entries(recipients,posts,db)
+
+
+def _followed_ids(user_id:int):
+    return select(Follow.followed_id).where(Follow.follower_id == user_id, Follow.is_pending == False)
+
+def _space_ids(user_id:int):
+    return select(membership.c.space_id).where(membership.c.user_id == user_id)
+
+
+def prune_follow(follower_id:int, followed_id:int, db:Session):
+    """Remove the unfollowed user's posts from the timeline, except the ones still visible through a shared space"""
+    post_ids = select(Post.id).where(
+        Post.user_id == followed_id,
+        or_(Post.space_id == None, Post.space_id.not_in(_space_ids(follower_id))),
+    )
+    db.query(FeedEntry).filter(FeedEntry.user_id == follower_id, FeedEntry.post_id.in_(post_ids)).delete(synchronize_session=False)
+
+
+def prune_space(user_id:int, space_id:int, db:Session):
+    """Remove the posts of a space the user left, except the ones from authors they still follow"""
+    post_ids = select(Post.id).where(
+        Post.space_id == space_id,
+        Post.user_id.not_in(_followed_ids(user_id)),
+    )
+    db.query(FeedEntry).filter(FeedEntry.user_id == user_id, FeedEntry.post_id.in_(post_ids)).delete(synchronize_session=False)
+
+
+def _pulled_posts_query(user_id:int, db:Session):
+    """Posts from big accounts and big spaces, which are never fanned out on write"""
+    big_accounts = select(User.id).where(
+        User.id.in_(_followed_ids(user_id)),
+        User.followers_nbr >= FEED_FANOUT_THRESHOLD,
+    )
+    big_spaces = select(Space.id).where(
+        Space.id.in_(_space_ids(user_id)),
+        Space.members_nbr >= FEED_FANOUT_THRESHOLD,
+    )
+    return db.query(Post).filter(
+        or_(
+            Post.user_id.in_(big_accounts),
+            Post.space_id.in_(big_spaces),
+        )
+    )
+
+
+def read_feed(user_id:int, db:Session, cursor:str|None = None, page:int = 1, page_size:int = 10):
+    """
+    Read a page of the user's home feed
+
+    The materialized timeline is merged with the posts pulled from big accounts and spaces,
+    each source returns the rows needed for the requested page, and more only if the posts found
+    in both sources left the page short.
+
+    Returns:
+        (posts, next_cursor)
+    """
+    page_size = max(1,min(page_size,MAX_PAGE_SIZE))
+    if cursor:   #keyset mode, every page costs the same
+        skip = 0
+    else:        #legacy page mode, both sources have to be read up to the requested page
+        skip = (max(page,1)-1)*page_size
+    needed = skip+page_size+1   #one extra row tells us if there is a next page
+
+    pushed = db.query(Post).join(FeedEntry,FeedEntry.post_id == Post.id).filter(FeedEntry.user_id == user_id).options(selectinload(Post.attachments))
+    pulled = _pulled_posts_query(user_id,db).options(selectinload(Post.attachments))
+    if cursor:
+        pushed = pushed.filter(keyset_filter(FeedEntry.created_at,FeedEntry.post_id,cursor))
+        pulled = pulled.filter(keyset_filter(Post.created_at,Post.id,cursor))
+    pushed = pushed.order_by(FeedEntry.created_at.desc(),FeedEntry.post_id.desc())
+    pulled = pulled.order_by(Post.created_at.desc(),Post.id.desc())
+
+    key = lambda p: (p.created_at,p.id)
+    limit = needed
+    while True:
+        sources = [pushed.limit(limit).all(),pulled.limit(limit).all()]
+        #a source cut by the limit may have older rows than its last one, the merge is only complete down to it
+        frontier = max((key(rows[-1]) for rows in sources if len(rows) == limit),default=None)
+        posts = []
+        seen = set()
+        #both lists are already sorted, newest first
+        for post in heapq.merge(*sources,key=key,reverse=True):
+            if frontier is not None and key(post) < frontier:
+                break
+            if post.id in seen:   #a post can be in both sources if its author crossed the threshold
+                continue
+            seen.add(post.id)
+            posts.append(post)
+        if len(posts) >= needed or frontier is None:
+            break
+        limit *= 2   #the duplicates left the page short, read further
+    posts = posts[skip:]
+    return posts[:page_size],next_cursor(posts,page_size,lambda p: (p.created_at,p.id))
+
+
+def trim_feeds(db:Session):
+    """Keep only the newest FEED_MAX_LENGTH entries of every timeline"""
+    ranked = select(
+        FeedEntry.id.label('id'),
+        func.row_number().over(
+            partition_by=FeedEntry.user_id,
+            order_by=(FeedEntry.created_at.desc(),FeedEntry.post_id.desc()),
+        ).label('rank')
+    ).subquery()
+    stale = select(ranked.c.id).where(ranked.c.rank > FEED_MAX_LENGTH)
+    return db.query(FeedEntry).filter(FeedEntry.id.in_(stale)).delete(synchronize_session=False)
@@ -1,27 +1,33 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status, Request, Response
 from typing import Annotated, List
-from app.dependencies import SessionDep
-from app.authentication import oauth2_scheme, current_user
+from sqlalchemy import select, update, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.dependencies import AsyncSessionDep, UserLoaderDep
+from app.authentication import oauth2_scheme, current_user_async
 from app.models.users import User
 from app.models.follows import Follow
 from app.schemas.users_schemas import UserDisplay
+from app.pagination import MAX_PAGE_SIZE, decode_id_cursor, encode_id_cursor, next_cursor, set_next_cursor
+from app.manage.feed_manager import backfill_follow,prune_follow
+from app.manage.autocomplete import autocomplete
 
 follow_router = APIRouter(prefix='/follows', tags=['follows'])
 
-def fetch_user(user_id: int, db: SessionDep):
-    user = db.query(User).filter(User.id == user_id).first()
-    if not user:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
-    return user
+async def fetch_follow(db: AsyncSession, *criteria):
+    result = await db.execute(select(Follow).where(*criteria))
+    return result.scalars().first()
+
+def update_followers_nbr(user_id: int, delta: int):
+    return update(User).where(User.id == user_id).values(followers_nbr=User.followers_nbr + delta)
 
 # Send a follow request
 @follow_router.post('/request/{user_id}/')
-async def request_follow(user_id: int, token: Annotated[str, Depends(oauth2_scheme)], db: SessionDep):
-    user = current_user(token, db)
-    followed_user = db.query(User).filter(User.id == user_id).first()
+async def request_follow(user_id: int, token: Annotated[str, Depends(oauth2_scheme)], db: AsyncSessionDep, loader: UserLoaderDep):
+    user = await current_user_async(token, db)
+    followed_user = await loader.load(user_id)
     if not followed_user:
         raise HTTPException(404, 'This user does not exist')
-    follow = db.query(Follow).filter(Follow.follower_id == user.id, Follow.followed_id == user_id).first()
+    follow = await fetch_follow(db, Follow.follower_id == user.id, Follow.followed_id == user_id)
     if follow:
         if follow.is_pending:
             raise HTTPException(400, 'Follow request already sent and pending')
@@ -29,83 +35,111 @@ async def request_follow(user_id: int, token: Annotated[str, Depends(oauth2_sche
             raise HTTPException(400, 'You are already following this user')
     follow = Follow(follower_id=user.id, followed_id=user_id)
     db.add(follow)
-    db.commit()
+    await db.commit()
     return {'detail': 'The follow request has been sent successfully'}
 
+async def list_follow_users(db: AsyncSession, request: Request, response: Response, user_col, criteria: list, cursor: str | None, page_size: int, count_only: bool):
+    """
+    One page of the users on the `user_col` side of the follows matching `criteria`, latest follows first
+
+    The body stays a plain list, the next cursor is set in the X-Next-Cursor/Link headers.
+
+    Args:
+        user_col: Follow.follower_id or Follow.followed_id, the side that is listed
+        count_only: only count the follows (X-Total-Count header, empty body), no user is loaded
+    """
+    if count_only:
+        count = await db.scalar(select(func.count()).select_from(Follow).where(*criteria))
+        response.headers['X-Total-Count'] = str(count)
+        return []
+    page_size = max(1, min(page_size, MAX_PAGE_SIZE))
+    query = select(User, Follow.id).join(Follow, user_col == User.id).where(*criteria)
+    if cursor:
+        query = query.where(Follow.id < decode_id_cursor(cursor))
+    rows = (await db.execute(query.order_by(Follow.id.desc()).limit(page_size+1))).all()
+    set_next_cursor(request, response, next_cursor(rows, page_size, lambda row: (row[1],), encode=encode_id_cursor))
+    return [user for user, _ in rows[:page_size]]
+
 # View all my follow requests (pending requests to me)
 @follow_router.get('/requests/', response_model=List[UserDisplay])
-async def view_my_follow_requests(token: Annotated[str, Depends(oauth2_scheme)], db: SessionDep):
-    user = current_user(token, db)
-    requests = db.query(Follow).filter(Follow.followed_id == user.id, Follow.is_pending == True).all()
-    return [fetch_user(f.follower_id, db) for f in requests]
+async def view_my_follow_requests(token: Annotated[str, Depends(oauth2_scheme)], db: AsyncSessionDep, request: Request, response: Response, cursor: str | None = None, page_size: int = 10, count_only: bool = False):
+    user = await current_user_async(token, db)
+    return await list_follow_users(db, request, response, Follow.follower_id, [Follow.followed_id == user.id, Follow.is_pending == True], cursor, page_size, count_only)
 
 # View all my followers (accepted)
 @follow_router.get('/followers/', response_model=List[UserDisplay])
-async def view_my_followers(token: Annotated[str, Depends(oauth2_scheme)], db: SessionDep):
-    user = current_user(token, db)
-    followers = db.query(Follow).filter(Follow.followed_id == user.id, Follow.is_pending == False).all()
-    return [fetch_user(f.follower_id, db) for f in followers]
+async def view_my_followers(token: Annotated[str, Depends(oauth2_scheme)], db: AsyncSessionDep, request: Request, response: Response, cursor: str | None = None, page_size: int = 10, count_only: bool = False):
+    user = await current_user_async(token, db)
+    return await list_follow_users(db, request, response, Follow.follower_id, [Follow.followed_id == user.id, Follow.is_pending == False], cursor, page_size, count_only)
 
 # View all the users I follow (accepted)
 @follow_router.get('/following/', response_model=List[UserDisplay])
-async def view_my_following(token: Annotated[str, Depends(oauth2_scheme)], db: SessionDep):
-    user = current_user(token, db)
-    following = db.query(Follow).filter(Follow.follower_id == user.id, Follow.is_pending == False).all()
-    return [fetch_user(f.followed_id, db) for f in following]
+async def view_my_following(token: Annotated[str, Depends(oauth2_scheme)], db: AsyncSessionDep, request: Request, response: Response, cursor: str | None = None, page_size: int = 10, count_only: bool = False):
+    user = await current_user_async(token, db)
+    return await list_follow_users(db, request, response, Follow.followed_id, [Follow.follower_id == user.id, Follow.is_pending == False], cursor, page_size, count_only)
 
 # Cancel follow request (sent by me, still pending)
 @follow_router.delete('/request/{follow_id}/cancel/', status_code=200)
-async def cancel_follow_request(follow_id: int, token: Annotated[str, Depends(oauth2_scheme)], db: SessionDep):
-    user = current_user(token, db)
-    follow = db.query(Follow).filter(Follow.follower_id == user.id, Follow.id == follow_id, Follow.is_pending == True).first()
+async def cancel_follow_request(follow_id: int, token: Annotated[str, Depends(oauth2_scheme)], db: AsyncSessionDep):
+    user = await current_user_async(token, db)
+    follow = await fetch_follow(db, Follow.follower_id == user.id, Follow.id == follow_id, Follow.is_pending == True)
     if not follow:
         raise HTTPException(404, 'No pending follow request found')
-    db.delete(follow)
-    db.commit()
+    await db.delete(follow)
+    await db.commit()
     return {'detail': 'Follow request cancelled'}
 
 # Accept follow request (to me)
 @follow_router.put('/request/{follow_id}/accept/', status_code=200)
-async def accept_follow_request(follow_id: int, token: Annotated[str, Depends(oauth2_scheme)], db: SessionDep):
-    user = current_user(token, db)
-    follow = db.query(Follow).filter(Follow.id == follow_id, Follow.followed_id == user.id).first()
+async def accept_follow_request(follow_id: int, token: Annotated[str, Depends(oauth2_scheme)], db: AsyncSessionDep):
+    user = await current_user_async(token, db)
+    follow = await fetch_follow(db, Follow.id == follow_id, Follow.followed_id == user.id)
     if not follow:
         raise HTTPException(404, 'No follow request found')
     if not follow.is_pending:
         raise HTTPException(status_code=400, detail='This follow request has already been accepted')
     follow.is_pending = False
-    db.commit()
+    await db.execute(update_followers_nbr(user.id, 1))
+    await db.run_sync(lambda s: backfill_follow(follow.follower_id, s.get(User, user.id), s))   #seed the follower's timeline with my recent posts
+    await db.commit()
+    autocomplete.scopes.forget(follow.follower_id)
     return {'detail': 'Follow request accepted'}
 
 # Reject follow request (to me)
 @follow_router.delete('/request/{follow_id}/reject/', status_code=200)
-async def reject_follow_request(follow_id: int, token: Annotated[str, Depends(oauth2_scheme)], db: SessionDep):
-    user = current_user(token, db)
-    follow = db.query(Follow).filter(Follow.id == follow_id, Follow.followed_id == user.id, Follow.is_pending == True).first()
+async def reject_follow_request(follow_id: int, token: Annotated[str, Depends(oauth2_scheme)], db: AsyncSessionDep):
+    user = await current_user_async(token, db)
+    follow = await fetch_follow(db, Follow.id == follow_id, Follow.followed_id == user.id, Follow.is_pending == True)
     if not follow:
         raise HTTPException(404, 'No pending follow request found')
-    db.delete(follow)
-    db.commit()
+    await db.delete(follow)
+    await db.commit()
     return {'detail': 'Follow request rejected'}
 
 # Unfollow endpoint (accepted follow only)
 @follow_router.delete('/unfollow/{user_id}/', status_code=200)
-async def unfollow_user(user_id: int, token: Annotated[str, Depends(oauth2_scheme)], db: SessionDep):
-    user = current_user(token, db)
-    follow = db.query(Follow).filter(Follow.follower_id == user.id, Follow.followed_id == user_id, Follow.is_pending == False).first()
+async def unfollow_user(user_id: int, token: Annotated[str, Depends(oauth2_scheme)], db: AsyncSessionDep):
+    user = await current_user_async(token, db)
+    follow = await fetch_follow(db, Follow.follower_id == user.id, Follow.followed_id == user_id, Follow.is_pending == False)
     if not follow:
         raise HTTPException(404, 'You are not following this user')
-    db.delete(follow)
-    db.commit()
+    await db.delete(follow)
+    await db.execute(update_followers_nbr(user_id, -1))
+    await db.run_sync(lambda s: prune_follow(user.id, user_id, s))
+    await db.commit()
+    autocomplete.scopes.forget(user.id)
     return {'detail': 'Unfollowed successfully'}
 
 # Remove a follower (current user removes someone who follows them)
 @follow_router.delete('/remove_follower/{user_id}/', status_code=200)
-async def remove_follower(user_id: int, token: Annotated[str, Depends(oauth2_scheme)], db: SessionDep):
-    user = current_user(token, db)
-    follow = db.query(Follow).filter(Follow.id == user_id, Follow.followed_id == user.id, Follow.is_pending == False).first()
+async def remove_follower(user_id: int, token: Annotated[str, Depends(oauth2_scheme)], db: AsyncSessionDep):
+    user = await current_user_async(token, db)
+    follow = await fetch_follow(db, Follow.follower_id == user_id, Follow.followed_id == user.id, Follow.is_pending == False)
     if not follow:
         raise HTTPException(404, 'This user is not your follower')
-    db.delete(follow)
-    db.commit()
+    await db.delete(follow)
+    await db.execute(update_followers_nbr(user.id, -1))
+    await db.run_sync(lambda s: prune_follow(user_id, user.id, s))
+    await db.commit()
+    autocomplete.scopes.forget(user_id)
     return {'detail': 'Follower removed successfully'}
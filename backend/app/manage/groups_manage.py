@@ -10,6 +10,8 @@ from fastapi import status
 from app.models.users import User
 from app.schemas.users_schemas import UserDisplay
 from app.manage.connection_manager import manager
+from app.manage.membership import group_members
+from sqlalchemy.ext.asyncio import AsyncSession
 
 
 groups_router = APIRouter(prefix='/groups',tags=['groups'])
@@ -35,7 +37,8 @@ async def create_group(group:GroupChatCreate,token:Annotated[str,Depends(oauth2_
     db.commit()
     db.refresh(group_db)
 
-    manager.add_user_to_group(user.id,group_db.id)   #add the user to the group in websockets
+    for member in group_db.members:
+        await manager.add_user_to_group(member.id,group_db.id)   #add the members to the group in websockets
     
     return group_db
 
@@ -45,6 +48,8 @@ def fetch_group(group_id:int,db:Session):
         raise HTTPException(404,'the group you are looking for does not exist')
     return group
 
+async def is_group_member(group_id:int,user_id:int,db:AsyncSession) -> bool:
+    return await group_members.is_member_async(group_id,user_id,db)
 
 
 
@@ -53,7 +58,7 @@ async def display_group(group_id:int,db:SessionDep,token:Annotated[str,Depends(o
     user = current_user(token,db)
     group = fetch_group(group_id,db)
     #verify permission (must be a members)
-    if not user.id in [member.id for member in group.members]:
+    if not group_members.is_member(group.id,user.id,db):
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,detail='you can not view this group')
     return group
 
@@ -64,7 +69,7 @@ async def display_group(group_id:int,db:SessionDep,token:Annotated[str,Depends(o
 async def get_group_members(group_id:int,db:SessionDep,token:Annotated[str,Depends(oauth2_scheme)]):
     user = current_user(token,db)
     group = fetch_group(group_id,db)
-    if not user.id in group.members_ids:
+    if not group_members.is_member(group.id,user.id,db):
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,detail='you can not view this group')
     return group.members
 
@@ -79,12 +84,12 @@ async def add_member(group_id:int,user_id:int,db:SessionDep,token:Annotated[str,
     member = db.query(User).filter(User.id==user_id).first()
     if not member:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,detail='the user you are looking for does not exist')
-    if member.id not in group.members_ids:
+    if not group_members.is_member(group.id,member.id,db):
         group.members.append(member)
     db.commit()
     db.refresh(group)
 
-    manager.add_user_to_group(member.id,group.id)   #add the user to the group in websockets
+    await manager.add_user_to_group(member.id,group.id)   #add the user to the group in websockets
 
     return group.members
 
@@ -102,13 +107,13 @@ async def remove_member(group_id:int,user_id:int,db:SessionDep,token:Annotated[s
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,detail='the user you are looking for does not exist')
     if member.id == user.id:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,detail='you can not remove yourself from the group')
-    if member.id in group.members_ids:
+    if group_members.is_member(group.id,member.id,db):
         group.members.remove(member)
     
     db.commit()
     db.refresh(group)
 
-    manager.remove_user_from_group(member.id, group.id)    #remove the user from the group membersin webscokets
+    await manager.remove_user_from_group(member.id, group.id)    #remove the user from the group membersin webscokets
     return group.members
 
 
@@ -117,14 +122,14 @@ async def remove_member(group_id:int,user_id:int,db:SessionDep,token:Annotated[s
 async def leave_group(group_id:int,db:SessionDep,token:Annotated[str,Depends(oauth2_scheme)]):
     user = current_user(token,db)
     group = fetch_group(group_id,db)
-    if not user.id in group.members_ids:
+    if not group_members.is_member(group.id,user.id,db):
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,detail='you can not leave this group')
     if user.id == group.owner_id:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,detail='you can not leave the group you own')
     group.members.remove(user)
     db.commit()
     db.refresh(group)
-    manager.remove_user_from_group(user.id, group.id)    #remove the user from the group membersin webscokets
+    await manager.remove_user_from_group(user.id, group.id)    #remove the user from the group membersin webscokets
     return group.members
 
 
@@ -138,7 +143,7 @@ async def pass_ownership(group_id:int,user_id:int,db:SessionDep,token:Annotated[
     member = db.query(User).filter(User.id==user_id).first()
     if not member:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,detail='the user you are looking for does not exist')
-    if not member.id in group.members_ids:
+    if not group_members.is_member(group.id,member.id,db):
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,detail='this user is not a member of this group')
     group.owner_id = member.id
     db.commit()
@@ -0,0 +1,84 @@
+from sqlalchemy import select,delete,update,func,bindparam
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import upsert_insert
+from app.models.posts import Post,Like,LikeCounterShard
+import random
+import os
+import dotenv
+
+dotenv.load_dotenv()
+
+
+#rows a post's pending count is spread over, more shards = less waiting on one row for viral posts
+LIKE_COUNTER_SHARDS = int(os.getenv('LIKE_COUNTER_SHARDS',16))
+#how often the pending counts are folded into posts.likes_nbr
+LIKE_ROLLUP_SECONDS = int(os.getenv('LIKE_ROLLUP_SECONDS',5))
+
+
+async def add_like(post_id:int, user_id:int, db:AsyncSession) -> bool:
+    """Like a post, returns False if it was already liked (the unique key makes it idempotent)"""
+    result = await db.execute(
+        upsert_insert(Like).values(post_id=post_id,user_id=user_id).on_conflict_do_nothing(index_elements=['post_id','user_id'])
+    )
+    if not result.rowcount:
+        return False
+    await _bump(post_id,1,db)
+    return True
+
+
+async def remove_like(post_id:int, user_id:int, db:AsyncSession) -> bool:
+    """Unlike a post, returns False if it was not liked"""
+    result = await db.execute(delete(Like).where(Like.post_id == post_id,Like.user_id == user_id))
+    if not result.rowcount:
+        return False
+    await _bump(post_id,-1,db)
+    return True
+
+
+async def _bump(post_id:int, delta:int, db:AsyncSession):
+    stmt = upsert_insert(LikeCounterShard).values(post_id=post_id,shard=random.randrange(LIKE_COUNTER_SHARDS),delta=delta)
+    await db.execute(stmt.on_conflict_do_update(
+        index_elements=['post_id','shard'],
+        set_={'delta': LikeCounterShard.delta + stmt.excluded.delta},
+    ))
+
+
+async def like_count(post_id:int, db:AsyncSession) -> int:
+    """Exact like count: the rolled up value plus what is still pending (read your own like)"""
+    rolled_up = select(Post.likes_nbr).where(Post.id == post_id).scalar_subquery()
+    pending = select(func.coalesce(func.sum(LikeCounterShard.delta),0)).where(LikeCounterShard.post_id == post_id).scalar_subquery()
+    return await db.scalar(select(func.coalesce(rolled_up,0) + pending))
+
+
+def roll_up_like_counters(db:Session) -> int:
+    """
+    Fold the pending shards into posts.likes_nbr
+
+    Only what was read is subtracted from each shard, so likes landing during the roll up stay pending.
+
+    Returns:
+        the number of posts updated
+    """
+    shards = db.execute(select(LikeCounterShard.post_id,LikeCounterShard.shard,LikeCounterShard.delta).where(LikeCounterShard.delta != 0)).all()
+    if not shards:
+        return 0
+    totals = {}
+    for post_id,_,delta in shards:
+        totals[post_id] = totals.get(post_id,0) + delta
+
+    #core tables: executemany of one UPDATE per row (the ORM would treat a list of dicts as an update by primary key)
+    posts = Post.__table__
+    db.execute(
+        update(posts).where(posts.c.id == bindparam('post_id')).values(likes_nbr=func.coalesce(posts.c.likes_nbr,0) + bindparam('total')),
+        [{'post_id':post_id,'total':total} for post_id,total in totals.items()],
+    )
+    counter_shards = LikeCounterShard.__table__
+    db.execute(
+        update(counter_shards).where(
+            counter_shards.c.post_id == bindparam('shard_post_id'),counter_shards.c.shard == bindparam('shard_nbr')
+        ).values(delta=counter_shards.c.delta - bindparam('read')),
+        [{'shard_post_id':post_id,'shard_nbr':shard,'read':delta} for post_id,shard,delta in shards],
+    )
+    db.execute(delete(LikeCounterShard).where(LikeCounterShard.delta == 0))
+    return len(totals)
@@ -0,0 +1,122 @@
+from collections import Counter
+from typing import Dict, List, NamedTuple
+from sqlalchemy import select, update, delete
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from fastapi.concurrency import run_in_threadpool
+from app.database import upsert_insert
+from app.models.media import MediaBlob
+from app.storage import media_store, variant_public_ids
+
+
+_COLUMNS = (MediaBlob.id, MediaBlob.file, MediaBlob.file_public_id, MediaBlob.variants)
+
+
+class BlobRef(NamedTuple):
+    id: int
+    file: str
+    file_public_id: str
+    variants: dict | None
+
+
+class ClaimedBlobs(NamedTuple):
+    blobs: List[BlobRef]     #one per file, in the order given
+    uploaded: List[str]      #public ids stored by this call, to delete if the transaction is rolled back
+
+
+def blob_public_ids(blob) -> List[str]:
+    return [blob.file_public_id, *variant_public_ids(blob.variants)]
+
+
+def _claim_existing(counts: Dict[str, int], profile: str, db: Session) -> Dict[str, BlobRef]:
+    #one more reference per use, a blob deleted in between is simply not returned
+    found = {}
+    for digest, n in counts.items():
+        row = db.execute(update(MediaBlob).where(MediaBlob.sha256 == digest, MediaBlob.profile == profile).values(
+            refcount=MediaBlob.refcount + n
+        ).returning(*_COLUMNS)).first()
+        if row:
+            found[digest] = BlobRef(*row)
+    return found
+
+
+def _add_new(digest: str, n: int, stored, profile: str, db: Session) -> BlobRef:
+    #a concurrent upload of the same content may have won, its blob is then used and ours is a duplicate
+    stmt = upsert_insert(MediaBlob).values(
+        sha256=digest, profile=profile, file=stored.file.url, file_public_id=stored.file.public_id,
+        variants=stored.variants_column(), refcount=n,
+    )
+    row = db.execute(stmt.on_conflict_do_update(
+        index_elements=['sha256', 'profile'],
+        set_={'refcount': MediaBlob.refcount + stmt.excluded.refcount},
+    ).returning(*_COLUMNS)).first()
+    return BlobRef(*row)
+
+
+async def claim_blobs(files: List[bytes | str], digests: List[str], profile: str, folder: str, prefix: str, sizes: Dict[str, int], db: Session | AsyncSession) -> ClaimedBlobs:
+    """
+    Blobs for the uploaded files, only the content not stored yet is processed and uploaded
+
+    The references are taken in the caller's transaction, commit it to keep them. Known contents
+    are looked up first without locking, so no row lock is held during the uploads.
+
+    Args:
+        files, digests: from read_upload, or spooled file paths and their digests
+        profile: 'post' or 'pfp', matching sizes
+    """
+    async def run(fn):
+        return await db.run_sync(fn) if isinstance(db, AsyncSession) else fn(db)
+
+    counts = Counter(digests)
+    known = set(await run(lambda s: s.scalars(select(MediaBlob.sha256).where(
+        MediaBlob.sha256.in_(list(counts)), MediaBlob.profile == profile
+    )).all()))
+
+    blobs = await run(lambda s: _claim_existing({digest: n for digest, n in counts.items() if digest in known}, profile, s))
+    missing = [digest for digest in counts if digest not in blobs]   #new, or deleted since the lookup
+    uploaded, duplicates = [], []
+    if missing:
+        content = dict(zip(digests, files))
+        stored = await media_store.upload_images([content[digest] for digest in missing], folder, prefix, sizes)
+        uploaded = [public_id for image in stored for public_id in image.public_ids()]
+        for digest, image in zip(missing, stored):
+            blob = await run(lambda s: _add_new(digest, counts[digest], image, profile, s))
+            blobs[digest] = blob
+            if blob.file_public_id != image.file.public_id:
+                duplicates += image.public_ids()
+    if duplicates:
+        await run_in_threadpool(media_store.delete, *duplicates)
+        uploaded = [public_id for public_id in uploaded if public_id not in duplicates]
+    return ClaimedBlobs([blobs[digest] for digest in digests], uploaded)
+
+
+def release_blob(blob_id: int | None, db: Session) -> List[str]:
+    """
+    Drop one reference, in the caller's transaction
+
+    Returns:
+        the public ids to delete from the storage once committed, when it was the last reference
+    """
+    if blob_id is None:
+        return []
+    db.execute(update(MediaBlob).where(MediaBlob.id == blob_id).values(refcount=MediaBlob.refcount - 1))
+    #conditional: a reference taken meanwhile keeps the blob
+    row = db.execute(delete(MediaBlob).where(MediaBlob.id == blob_id, MediaBlob.refcount <= 0).returning(
+        MediaBlob.file_public_id, MediaBlob.variants
+    )).first()
+    return blob_public_ids(row) if row else []
+
+
+def release_stored(blob_id: int | None, public_id: str | None, variants: dict | None, db: Session) -> List[str]:
+    """
+    release_blob for an attachment or a pfp (flush the row that pointed to the blob first)
+
+    The uploads made before the blobs are not shared, they are deleted directly.
+    """
+    if blob_id is not None:
+        return release_blob(blob_id, db)
+    return [public_id, *variant_public_ids(variants)] if public_id else []
+
+
+def release_attachment(attachment, db: Session) -> List[str]:
+    return release_stored(attachment.blob_id, attachment.file_public_id, attachment.variants, db)
@@ -0,0 +1,119 @@
+from collections import OrderedDict
+from threading import Lock
+from typing import Optional, Set
+from sqlalchemy import select, exists, update, delete, insert, Table
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.models.spaces import Space, membership
+from app.models.messages import group_chat_members
+import time
+import os
+import dotenv
+
+dotenv.load_dotenv()
+
+
+MEMBERSHIP_CACHE_SIZE = int(os.getenv('MEMBERSHIP_CACHE_SIZE',1000))    #spaces (or groups) whose member set is kept
+MEMBERSHIP_CACHE_TTL = int(os.getenv('MEMBERSHIP_CACHE_TTL',60))        #seconds, bounds staleness across workers
+#bigger spaces are not cached, their checks stay on the (space_id, user_id) index
+MEMBERSHIP_SET_MAX = int(os.getenv('MEMBERSHIP_SET_MAX',200000))
+
+_TOO_BIG = frozenset()   #marker for the targets answered with EXISTS
+
+
+class MembershipService:
+    """
+    Is-member checks for spaces or group chats
+
+    The member ids of a space are read once (one index range scan) and kept in a bounded LRU,
+    every check is then a set lookup. added()/removed() are called by the connection manager for
+    every membership event, so the sets follow the membership endpoints on all the workers.
+    """
+    def __init__(self, table: Table, target_col: str, max_size: int = MEMBERSHIP_CACHE_SIZE, ttl: int = MEMBERSHIP_CACHE_TTL) -> None:
+        self.table = table
+        self.target_col = table.c[target_col]
+        self.user_col = table.c.user_id
+        self.max_size = max_size
+        self.ttl = ttl
+        # target_id -> (expires_at, member ids)
+        self._sets: OrderedDict[int, tuple[float, Set[int]]] = OrderedDict()
+        self._lock = Lock()   #sync endpoints run in the threadpool
+
+    def is_member(self, target_id: int, user_id: int, db: Session) -> bool:
+        members = self._get(target_id)
+        if members is None:
+            members = self._store(target_id, db.scalars(self._members_query(target_id)).all())
+        if members is _TOO_BIG:
+            return db.scalar(self._exists_query(target_id, user_id))
+        return user_id in members
+
+    async def is_member_async(self, target_id: int, user_id: int, db: AsyncSession) -> bool:
+        members = self._get(target_id)
+        if members is None:
+            members = self._store(target_id, (await db.scalars(self._members_query(target_id))).all())
+        if members is _TOO_BIG:
+            return await db.scalar(self._exists_query(target_id, user_id))
+        return user_id in members
+
+    def added(self, target_id: int, user_id: int):
+        with self._lock:
+            entry = self._sets.get(target_id)
+            if entry and entry[1] is not _TOO_BIG:
+                entry[1].add(user_id)
+
+    def removed(self, target_id: int, user_id: int):
+        with self._lock:
+            entry = self._sets.get(target_id)
+            if entry and entry[1] is not _TOO_BIG:
+                entry[1].discard(user_id)
+
+    def forget(self, target_id: int):
+        with self._lock:
+            self._sets.pop(target_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._sets.clear()
+
+    def _members_query(self, target_id: int):
+        return select(self.user_col).where(self.target_col == target_id).limit(MEMBERSHIP_SET_MAX + 1)
+
+    def _exists_query(self, target_id: int, user_id: int):
+        return select(exists().where(self.target_col == target_id, self.user_col == user_id))
+
+    def _get(self, target_id: int) -> Optional[Set[int]]:
+        with self._lock:
+            entry = self._sets.get(target_id)
+            if not entry:
+                return None
+            expires_at, members = entry
+            if expires_at <= time.time():
+                del self._sets[target_id]
+                return None
+            self._sets.move_to_end(target_id)
+            return members
+
+    def _store(self, target_id: int, user_ids) -> Set[int]:
+        members = _TOO_BIG if len(user_ids) > MEMBERSHIP_SET_MAX else set(user_ids)
+        with self._lock:
+            self._sets[target_id] = (time.time() + self.ttl, members)
+            self._sets.move_to_end(target_id)
+            while len(self._sets) > self.max_size:   #evict the least recently used
+                self._sets.popitem(last=False)
+        return members
+
+
+space_members = MembershipService(membership, 'space_id')
+group_members = MembershipService(group_chat_members, 'group_chat_id')
+
+
+#the caches are updated once committed, by manager.add_user_to_space / remove_user_from_space
+def add_space_member(space_id: int, user_id: int, db: Session):
+    """Insert the membership row without loading space.members"""
+    db.execute(insert(membership).values(space_id=space_id, user_id=user_id))
+    db.execute(update(Space).where(Space.id == space_id).values(members_nbr=Space.members_nbr + 1))
+
+
+def remove_space_member(space_id: int, user_id: int, db: Session):
+    db.execute(delete(membership).where(membership.c.space_id == space_id, membership.c.user_id == user_id))
+    db.execute(update(Space).where(Space.id == space_id).values(members_nbr=Space.members_nbr - 1))
@@ -3,25 +3,25 @@ from app.dependencies import SessionDep
 from app.models.notes import Note
 from app.models.users import User
 from typing import Annotated
-from fastapi import Depends
+from fastapi import Depends,Request
 from app.authentication import oauth2_scheme,current_user
 from .users_manage import fetch_user
 from datetime import datetime,timedelta
 from fastapi.responses import JSONResponse
+from app.schemas.notes_schemas import NoteDisplay
+from app.response_cache import response_cache
 
 notes_router = APIRouter(prefix='/note',tags=['notes'])
 
 
-@notes_router.get('/{user_id}')
-async def get_note(user_id:int,db:SessionDep,token:Annotated[str,Depends(oauth2_scheme)]):
-    user = fetch_user(user_id,db)
-    print(user.note)
-
-    note = user.note if (user.note) and (user.note.created_at + timedelta(hours=24,minutes=0))> datetime.now() else None
-    return {
-        "exists" : True if note else False,
-        "note": note.content if note else ""
-        }
+@notes_router.get('/{user_id}',response_model=NoteDisplay)
+async def get_note(user_id:int,db:SessionDep,request:Request,token:Annotated[str,Depends(oauth2_scheme)]):
+    async def build():
+        user = fetch_user(user_id,db)
+        #an expired note can still be served for up to RESPONSE_CACHE_TTL seconds
+        note = user.note if (user.note) and (user.note.created_at + timedelta(hours=24,minutes=0))> datetime.now() else None
+        return NoteDisplay(exists=True if note else False,note=note.content if note else "")
+    return await response_cache.respond(request,response_cache.key('note',user_id),build)
 
 
 
@@ -44,6 +44,7 @@ async def create_note(new_note:str,db:SessionDep,token:Annotated[str,Depends(oau
         db.add(note)
     
     db.commit()
+    await response_cache.invalidate('note',user.id)
     db.refresh(note)
     print(note)
     print(user.note)
@@ -60,6 +61,7 @@ async def delete_note(db:SessionDep,token:Annotated[str,Depends(oauth2_scheme)])
         note = user.note
         db.delete(note)
         db.commit()
+        await response_cache.invalidate('note',user.id)
 
     return JSONResponse({
         "message":"the note has been deleted successfully"
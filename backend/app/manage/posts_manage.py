@@ -1,20 +1,35 @@
-from fastapi import Depends,APIRouter, Body, Request
-from app.dependencies import SessionDep,Session
+from fastapi import Depends,APIRouter, Body, Request, Query, BackgroundTasks
+from app.dependencies import SessionDep,Session,AsyncSessionDep
 from app.models.posts import Post,Like,Comment,Reaction,PostAttachment
-from app.schemas.comments_schemas import CommentDisplay
+from app.schemas.comments_schemas import CommentDisplay,CommentTree,ReactionSummary
 from app.models.users import User
-from app.schemas.posts_schemas import PostCreate,PostDisplay,PostUpdate
-from app.authentication import oauth2_scheme,current_user
+from app.schemas.posts_schemas import PostCreate,PostDisplay,PostUpdate,PostPage,TrendingTag
+from app.authentication import oauth2_scheme,current_user,current_user_async,current_user2
 from typing import Annotated
 from fastapi.exceptions import HTTPException
 from fastapi import status,Response, UploadFile
-from app.manage.spaces_manage import fetch_space
-import cloudinary.uploader
+from fastapi.concurrency import run_in_threadpool
+from app.manage.spaces_manage import fetch_space,fetch_space_async,is_space_member
 from typing import List
 from fastapi import Request
 from app.models.posts import Post
-from sqlalchemy import or_
+from sqlalchemy import or_,select
+from sqlalchemy.orm import selectinload
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.manage.users_manage import fetch_user
+from app.manage.feed_manager import fan_out_post,remove_post_from_feeds,read_feed
+from app.pagination import paginate,set_next_cursor,MAX_PAGE_SIZE
+from app.manage.like_counter import add_like,remove_like,like_count
+from app.manage.comment_tree import comment_tree
+from app.manage.reactions import toggle_reaction,reaction_summaries
+from app.manage.membership import space_members
+from app.manage.search import search_index
+from app.manage.trending import trending
+from app.manage.tags import set_post_tags,remove_post_tags,read_tag_posts,trending_tags,TAG_TRENDING_WINDOW_HOURS
+from app.response_cache import response_cache
+from app.storage import media_store,is_image,read_upload,POSTS_FOLDER
+from app.manage.media_blobs import claim_blobs,release_attachment
+from app.images import InvalidImage,POST_IMAGE_SIZES
 
 
 posts_router = APIRouter(prefix='/posts',tags=['posts'])
@@ -22,33 +37,41 @@ posts_router = APIRouter(prefix='/posts',tags=['posts'])
 
 
 @posts_router.post('/create/',response_model=PostDisplay)
-async def create_post_account(post:PostUpdate,token:Annotated[str,Depends(oauth2_scheme)],db:SessionDep):
-    user = current_user(token,db)
+async def create_post_account(post:PostUpdate,token:Annotated[str,Depends(oauth2_scheme)],db:AsyncSessionDep):
+    user = await current_user_async(token,db)
     post_data = post.model_dump()
     post_data['user_id'] = user.id
+    tags = post_data.pop('tags',None)
     post_db = Post(**post_data)
     db.add(post_db)
-    db.commit()
-    db.refresh(post_db)
-    return post_db
+    await db.flush()
+    await db.run_sync(lambda s: set_post_tags(post_db,tags,s))
+    await db.run_sync(lambda s: fan_out_post(post_db,s))   #push the post into the followers' timelines
+    await db.commit()
+    search_index.post_saved(post_db)
+    return await fetch_post_async(post_db.id,db)
 
 
 @posts_router.post('/space/{space_id}/create/',response_model=PostDisplay)
-async def create_post_space(space_id:int,post:PostUpdate,token:Annotated[str,Depends(oauth2_scheme)],db:SessionDep):
-    user = current_user(token,db)
-    space = fetch_space(space_id,db)
+async def create_post_space(space_id:int,post:PostUpdate,token:Annotated[str,Depends(oauth2_scheme)],db:AsyncSessionDep):
+    user = await current_user_async(token,db)
+    space = await fetch_space_async(space_id,db)
     #check if the user is a member of the space
-    if user not in space.members:
+    if not await is_space_member(space.id,user.id,db):
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,detail="You are not a member of this space")
     post_data = post.model_dump()
     post_data['user_id'] = user.id
     post_data['space_id'] = space.id
     post_data['for_space'] = True
+    tags = post_data.pop('tags',None)
     post_db = Post(**post_data)
     db.add(post_db)
-    db.commit()
-    db.refresh(post_db)
-    return post_db
+    await db.flush()
+    await db.run_sync(lambda s: set_post_tags(post_db,tags,s))
+    await db.run_sync(lambda s: fan_out_post(post_db,s))   #push the post into the followers' and members' timelines
+    await db.commit()
+    search_index.post_saved(post_db)
+    return await fetch_post_async(post_db.id,db)
 
 
 def fetch_post(post_id:int,db:Session):
@@ -57,76 +80,125 @@ def fetch_post(post_id:int,db:Session):
         raise HTTPException(status_code=404,detail='the post you are looking for does not exist')
     return post
 
+async def fetch_post_async(post_id:int,db:AsyncSession):
+    #attachments are part of PostDisplay, they can not be lazy loaded on the async session
+    post = await db.scalar(select(Post).where(Post.id==post_id).options(selectinload(Post.attachments)))
+    if not post:
+        raise HTTPException(status_code=404,detail='the post you are looking for does not exist')
+    return post
+
 def has_post_permission(post:Post,user:User):
     return post.user_id == user.id
 
+def check_post_access(post:Post,user_id:int|None,db:Session):
+    #space posts (and their comments) are only open to the members
+    if not post.for_space:
+        return
+    if user_id is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,detail='Invalid token')
+    if not space_members.is_member(post.space_id,user_id,db):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,detail="You are not a member of this space")
+
 
 @posts_router.get('/{post_id}/view/',response_model=PostDisplay)
-async def view_post(post_id:int,db:SessionDep,request:Request):
-    post = fetch_post(post_id,db)
-    return post
+async def view_post(post_id:int,db:AsyncSessionDep,request:Request):
+    async def build():
+        post = await fetch_post_async(post_id,db)
+        #the stored count lags by up to one roll up, a single post shows the exact one
+        return PostDisplay.model_validate(post,from_attributes=True).model_copy(update={'likes_nbr':await like_count(post_id,db)})
+    return await response_cache.respond(request,response_cache.key('post',post_id),build)
 
 
 
 @posts_router.put('/{post_id}/edit/',response_model=PostDisplay)
-async def edit_post(post_id:int,post:PostUpdate,token:Annotated[str,Depends(oauth2_scheme)],db:SessionDep):
-    post_db = fetch_post(post_id,db)
-    user = current_user(token,db)
+async def edit_post(post_id:int,post:PostUpdate,token:Annotated[str,Depends(oauth2_scheme)],db:AsyncSessionDep):
+    post_db = await fetch_post_async(post_id,db)
+    user = await current_user_async(token,db)
     if not has_post_permission(post_db,user):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,detail='you do not have permission to edit this post')
     
     post_data = post.model_dump(exclude_unset=True)
+    if 'tags' in post_data:
+        tags = post_data.pop('tags')
+        await db.run_sync(lambda s: set_post_tags(post_db,tags,s))
     for key,val in post_data.items():
         setattr(post_db,key,val)
 
-    db.commit()
-    db.refresh(post_db)
+    await db.commit()
+    search_index.post_saved(post_db)
+    await response_cache.invalidate('post',post_id)
     return post_db
 
 
 @posts_router.delete('/{post_id}/delete/',status_code=status.HTTP_200_OK)
-async def delete_post(post_id:int,token:Annotated[str,Depends(oauth2_scheme)],db:SessionDep):
-    post_db = fetch_post(post_id,db)
-    user = current_user(token,db)
+async def delete_post(post_id:int,token:Annotated[str,Depends(oauth2_scheme)],db:AsyncSessionDep,background_tasks:BackgroundTasks):
+    post_db = await fetch_post_async(post_id,db)
+    user = await current_user_async(token,db)
     if not has_post_permission(post_db,user):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,detail='you do not have permission to edit this post')
     
-    db.delete(post_db)
-    db.commit()
+    await db.run_sync(lambda s: remove_post_from_feeds(post_db.id,s))
+    await db.run_sync(lambda s: remove_post_tags(post_db,s))
+    attachments = list(post_db.attachments)
+    await db.delete(post_db)
+    await db.flush()   #the attachment rows go first, their blobs may go with them
+    public_ids = await db.run_sync(lambda s: [public_id for attachment in attachments for public_id in release_attachment(attachment,s)])
+    await db.commit()
+    search_index.post_deleted(post_db.id)
+    await response_cache.invalidate('post',post_id)
+    background_tasks.add_task(media_store.delete,*public_ids)   #the blobs no other post or user uses
     return {'detail':'the post has been deleted successfully'}
 
 
 
 @posts_router.post('/{post_id}/like/')
-async def like_post(post_id:int,token:Annotated[str,Depends(oauth2_scheme)],db:SessionDep):
-    post_db = fetch_post(post_id,db)
-    user = current_user(token,db)
-
-    
-    
-    #check if the user already likes this post
-    old_like =  db.query(Like).filter(Like.post_id == post_id,Like.user_id == user.id).first()
-    if old_like:  #unlike
-        db.delete(old_like)
-        post_db.likes_nbr-=1 
-        liked = False
-    else:  #like
-        like = Like(post_id=post_id,user_id=user.id)
-        db.add(like)
-        post_db.likes_nbr+=1
-        liked = True
-    db.commit()
-    like_count = post_db.likes_nbr
+async def like_post(post_id:int,token:Annotated[str,Depends(oauth2_scheme)],db:AsyncSessionDep):
+    """toggle the like, prefer the idempotent PUT/DELETE when the client knows the state it wants"""
+    await fetch_post_async(post_id,db)
+    user = await current_user_async(token,db)
+
+    #unlike if the user already likes this post, like otherwise
+    liked = not await remove_like(post_id,user.id,db)
+    if liked:
+        await add_like(post_id,user.id,db)
+    await db.commit()
+    await response_cache.invalidate('post',post_id)
     return {
         'liked' : liked,
-        'like_count' : like_count
+        'like_count' : await like_count(post_id,db)
+    }
+
+
+@posts_router.put('/{post_id}/like/')
+async def set_like(post_id:int,token:Annotated[str,Depends(oauth2_scheme)],db:AsyncSessionDep):
+    await fetch_post_async(post_id,db)
+    user = await current_user_async(token,db)
+    await add_like(post_id,user.id,db)   #liking twice is a no-op
+    await db.commit()
+    await response_cache.invalidate('post',post_id)
+    return {
+        'liked' : True,
+        'like_count' : await like_count(post_id,db)
+    }
+
+
+@posts_router.delete('/{post_id}/like/')
+async def unset_like(post_id:int,token:Annotated[str,Depends(oauth2_scheme)],db:AsyncSessionDep):
+    await fetch_post_async(post_id,db)
+    user = await current_user_async(token,db)
+    await remove_like(post_id,user.id,db)
+    await db.commit()
+    await response_cache.invalidate('post',post_id)
+    return {
+        'liked' : False,
+        'like_count' : await like_count(post_id,db)
     }
     
 
 
 #add an end point to add a comment to a post
 @posts_router.post('/{post_id}/comment/add/',response_model=CommentDisplay)
-async def add_comment(post_id:int,comment:str,token:Annotated[str,Depends(oauth2_scheme)],db:SessionDep):
+def add_comment(post_id:int,comment:str,token:Annotated[str,Depends(oauth2_scheme)],db:SessionDep):
     post_db = fetch_post(post_id,db)
     user = current_user(token,db)
     comment_db = Comment(content=comment,user_id=user.id,post_id=post_db.id)
@@ -137,7 +209,7 @@ async def add_comment(post_id:int,comment:str,token:Annotated[str,Depends(oauth2
 
 #add an end point to add a comment to a post
 @posts_router.post('/{post_id}/comment/add_reply/{comment_id}/',response_model=CommentDisplay)
-async def add_reply(post_id:int,comment_id:int,reply:str,token:Annotated[str,Depends(oauth2_scheme)],db:SessionDep):
+def add_reply(post_id:int,comment_id:int,reply:str,token:Annotated[str,Depends(oauth2_scheme)],db:SessionDep):
     post_db = fetch_post(post_id,db)
     user = current_user(token,db)
     comment_old = db.query(Comment).filter(Comment.id==comment_id).first()
@@ -153,7 +225,7 @@ async def add_reply(post_id:int,comment_id:int,reply:str,token:Annotated[str,Dep
 
 
 @posts_router.put('/{post_id}/comment/{comment_id}/edit/',response_model=CommentDisplay)
-async def edit_comment(post_id:int,comment_id:int,new_comment:str,token:Annotated[str,Depends(oauth2_scheme)],db:SessionDep):
+def edit_comment(post_id:int,comment_id:int,new_comment:str,token:Annotated[str,Depends(oauth2_scheme)],db:SessionDep):
     user = current_user(token,db)
     comment = db.query(Comment).filter(Comment.id==comment_id,Comment.post_id==post_id).first()
     if not comment:
@@ -167,7 +239,7 @@ async def edit_comment(post_id:int,comment_id:int,new_comment:str,token:Annotate
 
 
 @posts_router.delete('/{post_id}/comment/{comment_id}/delete/',status_code=status.HTTP_200_OK)
-async def delete_comment(post_id:int, comment_id:int, token:Annotated[str,Depends(oauth2_scheme)], db:SessionDep):
+def delete_comment(post_id:int, comment_id:int, token:Annotated[str,Depends(oauth2_scheme)], db:SessionDep):
     user = current_user(token,db)
     comment = db.query(Comment).filter(Comment.id==comment_id,Comment.post_id==post_id).first()
     if not comment:
@@ -181,141 +253,210 @@ async def delete_comment(post_id:int, comment_id:int, token:Annotated[str,Depend
 
     
         
-@posts_router.get('/{post_id}/comment/all',response_model=list[CommentDisplay])
-async def get_post_comments(post_id:int,page:int = 1, page_size:int = 10,db:SessionDep,request:Request):
+@posts_router.get('/{post_id}/comment/all',response_model=List[CommentDisplay])
+def get_post_comments(post_id:int,db:SessionDep,request:Request,response:Response,cursor:str|None = None,page:int = 1, page_size:int = 10):
     post = fetch_post(post_id,db)
-    
-    user = current_user(request.state.cur_user,db)
-    comments = db.query(Comment).filter(Comment.post_id == post_id).order_by(Comment.created_at.desc()).limit(page_size).offset((page-1)*page_size).all()
+    check_post_access(post,request.state.cur_user,db)
+    query = db.query(Comment).filter(Comment.post_id == post_id)
+    comments,next_cursor = paginate(query,Comment.created_at,Comment.id,cursor,page,page_size)
+    set_next_cursor(request,response,next_cursor)
     return comments
 
 
+@posts_router.get('/{post_id}/comment/tree',response_model=CommentTree)
+def get_comment_tree(post_id:int,db:SessionDep,request:Request,cursor:str|None = None,page_size:int = 10,depth:int = 3,replies:int = 3):
+    """
+    Top level comments (newest first) with their replies nested `depth` levels deep, in one query
+
+    Args:
+        replies: replies shown under each comment, a comment with more has a `more_replies` cursor
+    """
+    check_post_access(fetch_post(post_id,db),request.state.cur_user,db)
+    comments,next_cursor = comment_tree(post_id,db,cursor=cursor,page_size=page_size,depth=depth,replies=replies)
+    return {'items':comments,'next_cursor':next_cursor}
+
+
+@posts_router.get('/{post_id}/comment/{comment_id}/replies/',response_model=CommentTree)
+def get_comment_replies(post_id:int,comment_id:int,db:SessionDep,request:Request,cursor:str|None = None,page_size:int = 10,depth:int = 3,replies:int = 3):
+    """Replies of a comment (oldest first), pass a `more_replies` value as cursor to continue a truncated list"""
+    comment = db.query(Comment).filter(Comment.id==comment_id,Comment.post_id==post_id).first()
+    if not comment:
+        raise HTTPException(status_code=404, detail='Comment not found')
+    check_post_access(comment.post,request.state.cur_user,db)
+    comments,next_cursor = comment_tree(post_id,db,parent_id=comment_id,cursor=cursor,page_size=page_size,depth=depth,replies=replies)
+    return {'items':comments,'next_cursor':next_cursor}
+
+
 
 
 @posts_router.post('/{post_id}/comment/{comment_id}/react/')
 def react_to_comment(post_id:int,comment_id:int, token:Annotated[str,Depends(oauth2_scheme)], db:SessionDep,reaction_type : str = Body(...)):
-    comment = db.query(Comment).filter(Comment.post_id == post_id,Comment.id == comment_id).first()
-    #check if the post is private
-    if comment.post.private:
-        if comment.post.for_space:
-            space = fetch_space(comment.post.space_id,db)
-            if user not in space.members:
-                raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,detail="You are not a member of this space")
-        else:   #a notmal user post
-            if user not in comment.post.user.followers:
-                raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,detail="You are not a follower of this user")
     user = current_user(token,db)
+    comment = db.query(Comment).filter(Comment.post_id == post_id,Comment.id == comment_id).first()
     if not comment:
         raise HTTPException(404,'this comment does not exist')
-    
-    reaction = db.query(Reaction).filter(Reaction.comment_id == comment_id, Reaction.user_id == user.id, Reaction.reaction_type == reaction_type).first()
-    if reaction:   #unreact
-        db.delete(reaction)
-        db.commit()
-        return {"message": "Reaction removed", "reacted": False}
-    else:
-        reaction = Reaction(user_id = user.id, comment_id = comment_id,reaction_type=reaction_type)
-        db.add(reaction)
-        db.commit()
+    if not reaction_type or len(reaction_type) > 20:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,detail='invalid reaction type')
+    check_post_access(comment.post,user.id,db)
+
+    reacted = toggle_reaction(comment_id,user.id,reaction_type,db)
+    db.commit()
+    if reacted:
         return {"message": "Reaction added", "reacted": True}
+    return {"message": "Reaction removed", "reacted": False}
+
+
+@posts_router.get('/{post_id}/comment/reactions/',response_model=List[ReactionSummary])
+def get_comment_reactions(post_id:int, db:SessionDep, user:Annotated[User|None,Depends(current_user2)], ids:List[int] = Query(...)):
+    """
+    Reaction counts per type of a page of comments, with the caller's own reactions (`mine`) when authenticated
+
+    Args:
+        ids: the comment ids, repeated (?ids=1&ids=2), at most MAX_PAGE_SIZE
+    """
+    if len(ids) > MAX_PAGE_SIZE:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,detail=f'at most {MAX_PAGE_SIZE} comments per request')
+    summaries = reaction_summaries(post_id,ids,user.id if user else None,db)
+    return list(summaries.values())
 
         
 
     
+def posts_query(db:Session):
+    #sync query run through db.run_sync, attachments are loaded upfront for the response
+    return db.query(Post).options(selectinload(Post.attachments))
+
+
 # Get posts of a user (not for space)
-@posts_router.get('/user/{user_id}/all/', response_model=list[PostDisplay])
-async def get_user_posts(user_id: int, page:int = 1, page_size:int = 10, db: SessionDep):
-    posts = db.query(Post).filter(Post.user_id == user_id, Post.for_space == False).order_by(Post.created_at.desc()).limit(page_size).offset((page-1)*page_size).all()
+@posts_router.get('/user/{user_id}/all/', response_model=List[PostDisplay])
+async def get_user_posts(user_id: int, db: AsyncSessionDep, request: Request, response: Response, cursor:str|None = None, page:int = 1, page_size:int = 10):
+    posts,next_cursor = await db.run_sync(lambda s: paginate(
+        posts_query(s).filter(Post.user_id == user_id, Post.for_space == False),
+        Post.created_at,Post.id,cursor,page,page_size
+    ))
+    set_next_cursor(request,response,next_cursor)
     return posts
 
 # Get posts of a space (restrict access to members)
-@posts_router.get('/space/{space_id}/all/', response_model=list[PostDisplay])
-async def get_space_posts(space_id: int, page:int = 1, page_size:int = 10, token: Annotated[str, Depends(oauth2_scheme)], db: SessionDep):
-    user = current_user(token, db)
-    space = fetch_space(space_id, db)
-    if user not in space.members:
+@posts_router.get('/space/{space_id}/all/', response_model=List[PostDisplay])
+async def get_space_posts(space_id: int, token: Annotated[str, Depends(oauth2_scheme)], db: AsyncSessionDep, request: Request, response: Response, cursor:str|None = None, page:int = 1, page_size:int = 10):
+    user = await current_user_async(token, db)
+    space = await fetch_space_async(space_id, db)
+    if not await is_space_member(space.id, user.id, db):
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="You are not a member of this space")
-    posts = db.query(Post).filter(Post.space_id == space_id, Post.for_space == True).order_by(Post.created_at.desc()).limit(page_size).offset((page-1)*page_size).all()
+    posts,next_cursor = await db.run_sync(lambda s: paginate(
+        posts_query(s).filter(Post.space_id == space_id, Post.for_space == True),
+        Post.created_at,Post.id,cursor,page,page_size
+    ))
+    set_next_cursor(request,response,next_cursor)
     return posts
 
 # Get posts of a user in a space (restrict access to members)
-@posts_router.get('/space/{space_id}/user/{user_id}/all/', response_model=list[PostDisplay])
-async def get_user_posts_in_space(space_id: int, user_id:int, page:int = 1, page_size:int = 10, token: Annotated[str, Depends(oauth2_scheme)], db: SessionDep):
-    user = current_user(token, db)
-    space = fetch_space(space_id, db)
-    if user not in space.members:
+@posts_router.get('/space/{space_id}/user/{user_id}/all/', response_model=List[PostDisplay])
+async def get_user_posts_in_space(space_id: int, user_id:int, token: Annotated[str, Depends(oauth2_scheme)], db: AsyncSessionDep, request: Request, response: Response, cursor:str|None = None, page:int = 1, page_size:int = 10):
+    user = await current_user_async(token, db)
+    space = await fetch_space_async(space_id, db)
+    if not await is_space_member(space.id, user.id, db):
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="You are not a member of this space")
     # Check if the owner exists
-    owner = db.query(User).filter(User.id == user_id).first()
+    owner = await db.get(User, user_id)
     if not owner:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
-    posts = db.query(Post).filter(Post.space_id == space_id, Post.user_id == user_id, Post.for_space == True).order_by(Post.created_at.desc()).limit(page_size).offset((page-1)*page_size).all()
+    posts,next_cursor = await db.run_sync(lambda s: paginate(
+        posts_query(s).filter(Post.space_id == space_id, Post.user_id == user_id, Post.for_space == True),
+        Post.created_at,Post.id,cursor,page,page_size
+    ))
+    set_next_cursor(request,response,next_cursor)
     return posts
 
 
 
 @posts_router.post('/{post_id}/img/',response_model=PostDisplay)
-async def upload_images(images:list[UploadFile],post_id:int, token: Annotated[str, Depends(oauth2_scheme)], db: SessionDep):
-    user = current_user(token,db)
-    post = fetch_post(post_id,db)
+async def upload_images(images:list[UploadFile],post_id:int, token: Annotated[str, Depends(oauth2_scheme)], db: AsyncSessionDep):
+    user = await current_user_async(token,db)
+    post = await fetch_post_async(post_id,db)
     if user.id != post.user_id:
         raise HTTPException(status.HTTP_401_UNAUTHORIZED,'you are not allowed to upload an image to a post you do not own')
-    
-
-    for f in images:
-        
-        upload_result = cloudinary.uploader.upload(
-            f.file,
-            folder="socmel/posts_attacments",
-            public_id=f"post_{post.id}_attachment",
-            overwrite=True
-        )
-
-        attachment = PostAttachment(
-            post_id = post_id,
-            file = upload_result.get("secure_url"),
-            file_public_id = upload_result.get("public_id")
-        )
-   
-    db.commit()
-    db.refresh(post)
+    if not images:
+        raise HTTPException(status_code=400, detail="No image was sent")
+    if not all(is_image(f) for f in images):
+        raise HTTPException(status_code=400, detail="File must be an image")
+
+    #files already stored (same content hash) are reused, the others are resized in the image processes
+    #and uploaded concurrently, off the event loop
+    try:
+        files,digests = zip(*[await read_upload(f) for f in images])
+        claimed = await claim_blobs(list(files),list(digests),'post',POSTS_FOLDER,f'post_{post.id}',POST_IMAGE_SIZES,db)
+    except InvalidImage as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
+
+    db.add_all([
+        PostAttachment(post_id=post.id,file=blob.file,file_public_id=blob.file_public_id,variants=blob.variants,blob_id=blob.id)
+        for blob in claimed.blobs
+    ])
+    try:
+        await db.commit()
+    except Exception:
+        await run_in_threadpool(media_store.delete,*claimed.uploaded)   #no row points to them
+        raise
+    await response_cache.invalidate('post',post_id)
+    await db.refresh(post,['attachments'])
     return post
 
 
 
 @posts_router.delete('/{post_id}/img/{attachment_id}/',status_code=status.HTTP_200_OK)
-async def delete_image(post_id:int,attachment_id:int,token:Annotated[str,Depends(oauth2_scheme)],db:SessionDep):
-    user = current_user(token,db)
-    post = fetch_post(post_id,db)
+async def delete_image(post_id:int,attachment_id:int,token:Annotated[str,Depends(oauth2_scheme)],db:AsyncSessionDep,background_tasks:BackgroundTasks):
+    user = await current_user_async(token,db)
+    post = await fetch_post_async(post_id,db)
     #check ownership
     if user.id != post.user_id:
         raise HTTPException(status_code=401,detail='you are not allowed to delete this attachment')
-    attachment = db.query(PostAttachment).filter(PostAttachment.id==attachment_id,PostAttachment.post_id==post_id).first()
+    attachment = await db.scalar(select(PostAttachment).where(PostAttachment.id==attachment_id,PostAttachment.post_id==post_id))
     if not attachment:
         raise HTTPException(status_code=404,detail='this attachment does not exist')
-    cloudinary.uploader.destroy(attachment.file_public_id)
-    db.delete(attachment)
-    db.commit()
+    await db.delete(attachment)
+    await db.flush()
+    public_ids = await db.run_sync(lambda s: release_attachment(attachment,s))   #empty while other posts/users use the same file
+    await db.commit()
+    await response_cache.invalidate('post',post_id)
+    background_tasks.add_task(media_store.delete,*public_ids)   #the client does not wait for the provider
     return {'detail':'the attachment has been deleted successfully'}
     
     
 
+# Get the hot public posts, ranked by time-decayed likes, comments and reactions
+@posts_router.get('/trending/', response_model=PostPage)
+async def get_trending_posts(cursor:str|None = None, page_size:int = 10):
+    #served from the snapshot of the trending engine, refreshed by the scheduler
+    posts,next_cursor = trending.page(cursor,page_size)
+    return {'items':posts,'next_cursor':next_cursor}
+
+
+# Get the public posts with a tag, newest first
+@posts_router.get('/tag/{tag}', response_model=PostPage)
+async def get_tag_posts(tag:str, db:AsyncSessionDep, cursor:str|None = None, page:int = 1, page_size:int = 10):
+    posts,next_cursor = await db.run_sync(lambda s: read_tag_posts(tag,s,cursor,page,page_size))
+    return {'items':posts,'next_cursor':next_cursor}
+
+
+@posts_router.get('/tags/trending/', response_model=List[TrendingTag])
+async def get_trending_tags(db:AsyncSessionDep, hours:int = TAG_TRENDING_WINDOW_HOURS, limit:int = 10):
+    """the tags of the most public posts created over the last `hours` hours"""
+    return await db.run_sync(lambda s: trending_tags(s,hours,min(limit,MAX_PAGE_SIZE)))
+
+
     #the user's feed
 @posts_router.get('/feed/',response_model=List[PostDisplay],status_code=status.HTTP_200_OK)
-async def get_feed(request:Request,db:SessionDep,page:int = 1,page_size:int = 10):
+async def get_feed(request:Request,response:Response,db:AsyncSessionDep,cursor:str|None = None,page:int = 1,page_size:int = 10):
     #we offer different feeds for auth or not auth users
     if not request.state.is_authenticated and not request.state.cur_user:
         #for not auth users, we offer a feed of posts from all users
-        posts = db.query(Post).order_by(Post.created_at.desc()).limit(page_size).offset((page-1)*page_size).all()
-        return posts
+        posts,next_cursor = await db.run_sync(lambda s: paginate(posts_query(s),Post.created_at,Post.id,cursor,page,page_size))
     else:
-        #we get posts from the users they follow and spaces they are in
-        user = fetch_user(request.state.cur_user,db)
-        posts = db.query(Post).filter(
-            or_(
-                Post.user_id.in_(user.following), #posts from the users they follow
-                Post.space_id.in_(user.spaces) #posts from the spaces they are in
-            )
-        ).order_by(Post.created_at.desc()).limit(page_size).offset((page-1)*page_size).all()
-        return posts
-
+        #we read the user's precomputed timeline (posts from the users they follow and spaces they are in)
+        posts,next_cursor = await db.run_sync(lambda s: read_feed(request.state.cur_user,s,cursor,page,page_size))
+    set_next_cursor(request,response,next_cursor)
+    return posts
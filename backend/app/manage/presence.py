@@ -0,0 +1,102 @@
+import logging
+import time
+import uuid
+from datetime import datetime
+from typing import Dict, Iterable, Optional, Set, Tuple
+from sqlalchemy import update, bindparam, or_
+from app.database import AsyncSessionLocal
+from app.models.users import User
+import os
+import dotenv
+
+dotenv.load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+
+PRESENCE_PING_SECONDS = float(os.getenv('PRESENCE_PING_SECONDS',25))          #the server pings every connection this often
+PRESENCE_TIMEOUT_SECONDS = float(os.getenv('PRESENCE_TIMEOUT_SECONDS',60))    #a connection silent for this long is closed
+LAST_SEEN_FLUSH_SECONDS = float(os.getenv('LAST_SEEN_FLUSH_SECONDS',30))      #how often users.last_seen is written
+PRESENCE_MAX_IDS = 200   #users per presence query
+
+
+class PresenceRegistry:
+    """
+    The users connected to any worker
+
+    Every worker publishes its connects and disconnects, and a snapshot of its connections at every
+    heartbeat. A worker whose snapshot is older than PRESENCE_TIMEOUT_SECONDS (stopped or crashed)
+    no longer counts.
+    """
+    def __init__(self) -> None:
+        self.worker_id = uuid.uuid4().hex
+        # worker id -> (last heard of, connected user ids)
+        self._workers: Dict[str, Tuple[float, Set[int]]] = {}
+
+    def apply(self, event: dict):
+        _, users = self._workers.get(event['worker'], (0.0, set()))
+        if event['action'] == 'snapshot':
+            users = set(event['user_ids'])
+        elif event['action'] == 'online':
+            users.add(event['user_id'])
+        else:
+            users.discard(event['user_id'])
+        self._workers[event['worker']] = (time.monotonic(), users)   #any event shows the worker is alive
+
+    def expire(self):
+        cutoff = time.monotonic() - PRESENCE_TIMEOUT_SECONDS
+        for worker, (seen, _) in list(self._workers.items()):
+            if worker != self.worker_id and seen < cutoff:
+                del self._workers[worker]
+
+    def is_online(self, user_id: int) -> bool:
+        return any(user_id in users for _, users in self._workers.values())
+
+
+class LastSeenBuffer:
+    """
+    Last activity of the users connected to this worker, written to users.last_seen in batches
+
+    Every inbound frame touches the user in memory only, flush() writes them all in one statement.
+    """
+    def __init__(self) -> None:
+        self._pending: Dict[int, datetime] = {}
+
+    def touch(self, user_id: int):
+        self._pending[user_id] = datetime.now()
+
+    def get(self, user_id: int) -> Optional[datetime]:
+        return self._pending.get(user_id)
+
+    async def flush(self) -> int:
+        if not self._pending:
+            return 0
+        pending, self._pending = self._pending, {}
+        #core table: executemany of one UPDATE per user, never moves last_seen back (another worker may be ahead)
+        users = User.__table__
+        try:
+            async with AsyncSessionLocal() as db:
+                await db.execute(
+                    update(users).where(
+                        users.c.id == bindparam('user_id'),
+                        or_(users.c.last_seen == None, users.c.last_seen < bindparam('seen')),
+                    ).values(last_seen=bindparam('seen')),
+                    [{'user_id': user_id, 'seen': seen} for user_id, seen in pending.items()],
+                )
+                await db.commit()
+        except Exception:
+            logger.exception('failed to write last_seen, retrying at the next flush')
+            for user_id, seen in pending.items():   #keep the newer value touched meanwhile
+                self._pending[user_id] = max(seen, self._pending.get(user_id, seen))
+            return 0
+        return len(pending)
+
+
+def latest(*times: Optional[datetime]) -> Optional[datetime]:
+    known = [at for at in times if at is not None]
+    return max(known) if known else None
+
+
+def presence_ids(user_ids: Iterable[int]) -> list:
+    """the distinct ids of a presence query, in the order given"""
+    return list(dict.fromkeys(int(user_id) for user_id in user_ids))[:PRESENCE_MAX_IDS]
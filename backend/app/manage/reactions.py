@@ -0,0 +1,63 @@
+from typing import Dict, List
+from sqlalchemy import select,delete,and_
+from sqlalchemy.orm import Session
+from app.database import upsert_insert
+from app.models.posts import Comment,Reaction,ReactionCount
+
+
+def toggle_reaction(comment_id:int, user_id:int, reaction_type:str, db:Session) -> bool:
+    """
+    Add the reaction, or remove it if the user already reacted with this type
+
+    The comment's count for the type is changed in the same transaction, with an upsert
+    so concurrent reactions never read-modify-write it.
+
+    Returns:
+        True if the reaction was added
+    """
+    added = db.execute(
+        upsert_insert(Reaction).values(comment_id=comment_id,user_id=user_id,reaction_type=reaction_type)
+        .on_conflict_do_nothing(index_elements=['comment_id','user_id','reaction_type'])
+    ).rowcount
+    if not added:
+        removed = db.execute(delete(Reaction).where(
+            Reaction.comment_id == comment_id,Reaction.user_id == user_id,Reaction.reaction_type == reaction_type
+        )).rowcount
+        if not removed:   #a concurrent toggle already removed it, and counted it
+            return False
+    stmt = upsert_insert(ReactionCount).values(comment_id=comment_id,reaction_type=reaction_type,count=1 if added else 0)
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=['comment_id','reaction_type'],
+        set_={'count': ReactionCount.count + (1 if added else -1)},
+    ))
+    return bool(added)
+
+
+def reaction_summaries(post_id:int, comment_ids:List[int], user_id:int|None, db:Session) -> Dict[int,dict]:
+    """
+    Reaction counts of a page of comments and the types the user reacted with, in one query
+
+    The counts drive the query, a user's own reaction always has a count so it is joined on them.
+
+    Returns:
+        {comment_id: {'comment_id', 'counts': {type: n}, 'mine': [types]}} for every requested comment
+    """
+    summaries = {comment_id: {'comment_id':comment_id,'counts':{},'mine':[]} for comment_id in comment_ids}
+    if not summaries:
+        return summaries
+    mine = and_(
+        Reaction.comment_id == ReactionCount.comment_id,
+        Reaction.reaction_type == ReactionCount.reaction_type,
+        Reaction.user_id == user_id,
+    )
+    rows = db.execute(
+        select(ReactionCount.comment_id,ReactionCount.reaction_type,ReactionCount.count,Reaction.id)
+        .join(Comment,Comment.id == ReactionCount.comment_id)
+        .outerjoin(Reaction,mine)
+        .where(ReactionCount.comment_id.in_(summaries),Comment.post_id == post_id,ReactionCount.count > 0)
+    ).all()
+    for comment_id,reaction_type,count,own in rows:
+        summaries[comment_id]['counts'][reaction_type] = count
+        if own is not None:
+            summaries[comment_id]['mine'].append(reaction_type)
+    return summaries
@@ -0,0 +1,77 @@
+from typing import Dict, List
+from sqlalchemy import select, func, literal, null, cast, union_all, and_, Integer, String
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import upsert_insert
+from app.models.messages import DmMessage, GroupChatMessage, RoomMessage, ReadWatermark, group_chat_members
+from app.models.spaces import Room, membership
+
+
+async def mark_read(user_id: int, kind: str, conversation_id: int, last_read_id: int, db: AsyncSession) -> bool:
+    """
+    Move the user's watermark in a conversation up to last_read_id, one upsert whatever the number of messages
+
+    The watermark never moves back, a stale client reporting an older id changes nothing.
+
+    Returns:
+        False if the watermark was already at or after last_read_id
+    """
+    stmt = upsert_insert(ReadWatermark).values(user_id=user_id, kind=kind, conversation_id=conversation_id, last_read_id=last_read_id)
+    result = await db.execute(stmt.on_conflict_do_update(
+        index_elements=['user_id', 'kind', 'conversation_id'],
+        set_={'last_read_id': stmt.excluded.last_read_id},
+        where=ReadWatermark.last_read_id < stmt.excluded.last_read_id,
+    ))
+    return bool(result.rowcount)
+
+
+async def watermarks(user_id: int, kind: str, conversation_ids: List[int], db: AsyncSession) -> Dict[int, int]:
+    """conversation_id -> last_read_id, the conversations never read are left out"""
+    rows = await db.execute(select(ReadWatermark.conversation_id, ReadWatermark.last_read_id).where(
+        ReadWatermark.user_id == user_id, ReadWatermark.kind == kind, ReadWatermark.conversation_id.in_(conversation_ids)
+    ))
+    return dict(rows.all())
+
+
+def _watermark(kind: str, user_id: int, conversation_col):
+    return and_(ReadWatermark.user_id == user_id, ReadWatermark.kind == kind, ReadWatermark.conversation_id == conversation_col)
+
+
+async def unread_counts(user_id: int, db: AsyncSession) -> list:
+    """
+    Unread messages of every conversation of the user, in one query
+
+    Each conversation is a range scan of its history index after the watermark, the user's own
+    messages are not counted. The conversations without unread messages are left out.
+
+    Returns:
+        rows of (kind, conversation_id, space_id, last_read_id, unread), space_id is only set for rooms
+    """
+    last_read = func.coalesce(ReadWatermark.last_read_id, 0)
+    no_space = cast(null(), Integer)
+    dms = select(
+        literal('dm', String).label('kind'), DmMessage.sender_id.label('conversation_id'), no_space.label('space_id'),
+        func.max(last_read).label('last_read_id'), func.count().label('unread'),
+    ).select_from(DmMessage).outerjoin(ReadWatermark, _watermark('dm', user_id, DmMessage.sender_id)).where(
+        DmMessage.recipient_id == user_id, DmMessage.id > last_read,
+    ).group_by(DmMessage.sender_id)
+
+    groups = select(
+        literal('group', String), GroupChatMessage.group_chat_id, no_space,
+        func.max(last_read), func.count(),
+    ).select_from(GroupChatMessage).outerjoin(ReadWatermark, _watermark('group', user_id, GroupChatMessage.group_chat_id)).where(
+        GroupChatMessage.group_chat_id.in_(select(group_chat_members.c.group_chat_id).where(group_chat_members.c.user_id == user_id)),
+        GroupChatMessage.id > last_read, GroupChatMessage.sender_id != user_id,
+    ).group_by(GroupChatMessage.group_chat_id)
+
+    #IN rather than a join: a duplicated membership row must not count the messages twice
+    rooms = select(
+        literal('room', String), RoomMessage.room_id, Room.space_id,
+        func.max(last_read), func.count(),
+    ).select_from(RoomMessage).join(Room, Room.id == RoomMessage.room_id).outerjoin(
+        ReadWatermark, _watermark('room', user_id, RoomMessage.room_id)
+    ).where(
+        Room.space_id.in_(select(membership.c.space_id).where(membership.c.user_id == user_id)),
+        RoomMessage.id > last_read, RoomMessage.sender_id != user_id,
+    ).group_by(RoomMessage.room_id, Room.space_id)
+
+    return (await db.execute(union_all(dms, groups, rooms))).all()
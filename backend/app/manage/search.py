@@ -0,0 +1,207 @@
+import heapq
+import math
+import re
+from collections import Counter
+from threading import Lock
+from typing import Dict, List, Tuple
+from sqlalchemy import select, func, literal_column, tuple_, or_, cast, Float
+from sqlalchemy.orm import Session, selectinload
+from app.database import engine
+from app.models.posts import Post
+from app.models.users import User
+from app.models.spaces import Space
+from app.pagination import MAX_PAGE_SIZE, encode_score_cursor, decode_score_cursor
+import os
+import dotenv
+
+dotenv.load_dotenv()
+
+
+#postgres: full-text and trigram indexes, memory: in-process inverted index (sqlite, tests, single worker)
+SEARCH_BACKEND = os.getenv('SEARCH_BACKEND') or ('postgres' if engine.dialect.name == 'postgresql' else 'memory')
+SEARCH_TEXT_CONFIG = os.getenv('SEARCH_TEXT_CONFIG','simple')   #postgres text search configuration, must match the migration
+
+#field weights, the same order as the postgres setweight A/B/C
+POST_FIELDS = (('title',3.0),('tags',2.0),('content',1.0))
+
+_TOKEN = re.compile(r'[^\W_]+')   #words, alice_smith is alice + smith
+
+
+def tokenize(text:str|None) -> List[str]:
+    return _TOKEN.findall(text.lower()) if text else []
+
+
+class InvertedIndex:
+    """
+    term -> {doc id: weight} postings with tf-idf ranking
+
+    A query matches the documents holding all of its terms, the rarest term's postings drive the scan.
+    """
+    def __init__(self) -> None:
+        self.postings: Dict[str, Dict[int, float]] = {}
+        self.docs: Dict[int, Dict[str, float]] = {}   #doc id -> its term weights, to remove it
+
+    def add(self, doc_id:int, fields:List[Tuple[str|None, float]]):
+        self.remove(doc_id)
+        weights = Counter()
+        for text,weight in fields:
+            for term in tokenize(text):
+                weights[term] += weight
+        if not weights:
+            return
+        self.docs[doc_id] = dict(weights)
+        for term,weight in weights.items():
+            self.postings.setdefault(term,{})[doc_id] = weight
+
+    def remove(self, doc_id:int):
+        for term in self.docs.pop(doc_id,{}):
+            postings = self.postings[term]
+            del postings[doc_id]
+            if not postings:
+                del self.postings[term]
+
+    def search(self, query:str, after:Tuple[float,int]|None, limit:int) -> List[Tuple[float,int]]:
+        """the `limit` best (score, id) strictly after the cursor, best first"""
+        terms = set(tokenize(query))
+        if not terms or any(term not in self.postings for term in terms):
+            return []
+        lists = sorted((self.postings[term] for term in terms),key=len)
+        n = len(self.docs)
+        idf = [math.log(1 + n/len(postings)) for postings in lists]
+        scored = []
+        for doc_id,weight in lists[0].items():
+            score = weight*idf[0]
+            for postings,term_idf in zip(lists[1:],idf[1:]):
+                other = postings.get(doc_id)
+                if other is None:
+                    break
+                score += other*term_idf
+            else:
+                score = round(score/math.sqrt(len(self.docs[doc_id])),6)   #longer documents do not win by size
+                if after is None or (score,doc_id) < after:
+                    scored.append((score,doc_id))
+        return heapq.nlargest(limit,scored)
+
+
+class MemorySearch:
+    """
+    Pure Python backend, the indexes are built from the database on first use and then follow
+    the post, user and space endpoints. Each worker has its own copy: development and tests only.
+    """
+    def __init__(self) -> None:
+        self.indexes = {'posts': InvertedIndex(), 'users': InvertedIndex(), 'spaces': InvertedIndex()}
+        self._loaded = False
+        self._lock = Lock()   #sync endpoints run in the threadpool
+
+    def _load(self, db:Session):
+        if self._loaded:
+            return
+        posts = db.execute(select(Post.id,Post.title,Post.tags,Post.content).where(Post.for_space == False)).all()
+        users = db.execute(select(User.id,User.username)).all()
+        spaces = db.execute(select(Space.id,Space.name)).all()
+        for post_id,title,tags,content in posts:
+            self.indexes['posts'].add(post_id,list(zip((title,tags,content),(weight for _,weight in POST_FIELDS))))
+        for user_id,username in users:
+            self.indexes['users'].add(user_id,[(username,1.0)])
+        for space_id,name in spaces:
+            self.indexes['spaces'].add(space_id,[(name,1.0)])
+        self._loaded = True
+
+    def _update(self, kind:str, doc_id:int, fields=None):
+        with self._lock:
+            if not self._loaded:   #the first search reads the current rows anyway
+                return
+            if fields is None:
+                self.indexes[kind].remove(doc_id)
+            else:
+                self.indexes[kind].add(doc_id,fields)
+
+    def post_saved(self, post:Post):
+        if post.for_space:   #space posts are only shown to the members
+            return self._update('posts',post.id)
+        self._update('posts',post.id,[(getattr(post,field),weight) for field,weight in POST_FIELDS])
+
+    def post_deleted(self, post_id:int):
+        self._update('posts',post_id)
+
+    def user_saved(self, user:User):
+        self._update('users',user.id,[(user.username,1.0)])
+
+    def space_saved(self, space:Space):
+        self._update('spaces',space.id,[(space.name,1.0)])
+
+    def space_deleted(self, space_id:int):
+        self._update('spaces',space_id)
+
+    def search(self, kind:str, query:str, db:Session, after:Tuple[float,int]|None, limit:int) -> List[Tuple[float,int]]:
+        with self._lock:
+            self._load(db)
+            return self.indexes[kind].search(query,after,limit)
+
+
+class PostgresSearch:
+    """
+    Posts: the generated `posts.search_vector` column (weighted title, tags, content) with a GIN index, ranked by ts_rank.
+    Users and spaces: pg_trgm similarity on the trigram indexes, so partial and misspelled names match.
+    The indexes are maintained by postgres, the write hooks have nothing to do.
+    """
+    def post_saved(self, post:Post): pass
+    def post_deleted(self, post_id:int): pass
+    def user_saved(self, user:User): pass
+    def space_saved(self, space:Space): pass
+    def space_deleted(self, space_id:int): pass
+
+    def search(self, kind:str, query:str, db:Session, after:Tuple[float,int]|None, limit:int) -> List[Tuple[float,int]]:
+        if kind == 'posts':
+            tsquery = func.websearch_to_tsquery(SEARCH_TEXT_CONFIG,query)
+            vector = literal_column('posts.search_vector')
+            score = cast(func.ts_rank(vector,tsquery),Float(precision=53))   #real: the cursor holds the float8 value, exactly what it is compared to
+            stmt = select(score,Post.id).where(vector.op('@@')(tsquery),Post.for_space == False)
+            id_col = Post.id
+        else:
+            name_col = User.username if kind == 'users' else Space.name
+            id_col = User.id if kind == 'users' else Space.id
+            score = cast(func.similarity(name_col,query),Float(precision=53))
+            #% uses the trigram index, the prefix match keeps very short queries working
+            stmt = select(score,id_col).where(or_(name_col.op('%')(query),name_col.ilike(escape_like(query) + '%')))
+        if after:
+            stmt = stmt.where(tuple_(score,id_col) < tuple_(cast(after[0],Float(precision=53)),after[1]))
+        rows = db.execute(stmt.order_by(score.desc(),id_col.desc()).limit(limit)).all()
+        return [(float(row[0]),row[1]) for row in rows]
+
+
+def escape_like(text:str) -> str:
+    return text.replace('\\','\\\\').replace('%','\\%').replace('_','\\_')
+
+
+search_index = MemorySearch() if SEARCH_BACKEND == 'memory' else PostgresSearch()
+
+
+_MODELS = {'posts': Post, 'users': User, 'spaces': Space}
+
+
+def search(kind:str, query:str, db:Session, cursor:str|None = None, page_size:int = 10):
+    """
+    Ranked search over posts (title, tags, content), users (username) or spaces (name)
+
+    Args:
+        kind: 'posts', 'users' or 'spaces'
+        cursor: next_cursor of the previous page, (score, id) of its last result
+
+    Returns:
+        (rows in rank order, next_cursor)
+    """
+    page_size = max(1,min(page_size,MAX_PAGE_SIZE))
+    after = decode_score_cursor(cursor) if cursor else None
+    hits = search_index.search(kind,query,db,after,page_size+1)   #one extra hit tells us if there is a next page
+    next_cursor = encode_score_cursor(*hits[page_size-1]) if len(hits) > page_size else None
+    hits = hits[:page_size]
+    if not hits:
+        return [],None
+
+    model = _MODELS[kind]
+    stmt = select(model).where(model.id.in_([doc_id for _,doc_id in hits]))
+    if model is Post:
+        stmt = stmt.options(selectinload(Post.attachments))
+    rows = {row.id: row for row in db.scalars(stmt)}
+    return [rows[doc_id] for _,doc_id in hits if doc_id in rows],next_cursor
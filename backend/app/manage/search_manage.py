@@ -0,0 +1,42 @@
+from fastapi.routing import APIRouter
+from fastapi import Query,Depends
+from typing import Annotated,List,Literal
+from app.dependencies import SessionDep
+from app.schemas.posts_schemas import PostPage
+from app.schemas.spaces_schemas import SpacePage
+from app.schemas.search_schemas import AutocompleteItem,UserSearchPage
+from app.models.users import User
+from app.authentication import oauth2_scheme,current_user,current_user2
+from app.manage.search import search
+from app.manage.autocomplete import autocomplete
+
+search_router = APIRouter(prefix='/search',tags=['search'])
+
+SearchQuery = Annotated[str,Query(min_length=1,max_length=200)]
+
+
+#ranked best first, pass next_cursor back as ?cursor= for the next results
+@search_router.get('/posts/',response_model=PostPage)
+def search_posts(q:SearchQuery,db:SessionDep,cursor:str|None = None,page_size:int = 10):
+    posts,next_cursor = search('posts',q,db,cursor,page_size)
+    return {'items':posts,'next_cursor':next_cursor}
+
+
+@search_router.get('/users/',response_model=UserSearchPage)
+def search_users(q:SearchQuery,db:SessionDep,token:Annotated[str,Depends(oauth2_scheme)],cursor:str|None = None,page_size:int = 10):
+    current_user(token,db)
+    users,next_cursor = search('users',q,db,cursor,page_size)
+    return {'items':users,'next_cursor':next_cursor}
+
+
+@search_router.get('/spaces/',response_model=SpacePage)
+def search_spaces(q:SearchQuery,db:SessionDep,cursor:str|None = None,page_size:int = 10):
+    spaces,next_cursor = search('spaces',q,db,cursor,page_size)
+    return {'items':spaces,'next_cursor':next_cursor}
+
+
+@search_router.get('/autocomplete/',response_model=List[AutocompleteItem])
+def autocomplete_names(q:Annotated[str,Query(min_length=1,max_length=50)],db:SessionDep,user:Annotated[User|None,Depends(current_user2)],
+                       kind:Literal['users','spaces'] = 'users',limit:int = 8):
+    """usernames or space names starting with q, the people the caller follows (their spaces) first"""
+    return autocomplete.lookup(kind,q,db,user.id if user else None,max(1,min(limit,20)))
@@ -11,6 +11,8 @@ from fastapi.exceptions import HTTPException
 from fastapi import status
 from datetime import datetime,timedelta
 from app.authentication import current_user
+from app.identity_cache import identity_cache
+from app.response_cache import response_cache
 
 sec_auth = APIRouter(prefix='/security',tags=['security'])
 def generate_random_code():
@@ -68,6 +70,8 @@ async def change_email(change_email_schema:ChangeEmail,token:Annotated[str,Depen
     user.email = change_email_schema.new_email
     db.delete(verf_code)  #delete the reset key (can only be used once)
     db.commit()
+    identity_cache.invalidate_user(user.id)   #tokens issued for the old email must be resolved again
+    await response_cache.invalidate('user',user.id)
     return {'detail':'the email has been changed successfully'}
 
 
@@ -102,6 +106,7 @@ async def change_password(change_password_schema:ChangePassword,token:Annotated[
     user.password = pwd_context.hash(change_password_schema.new_password)
     db.delete(verf_code)   #delete the reset key (can only be used once)
     db.commit()
+    identity_cache.invalidate_user(user.id)
     return {'detail':'the password has been changed successfully'}
 
 
@@ -135,6 +140,7 @@ async def reset_password(change_password_schema:ChangePassword,db:SessionDep):
     user.password = pwd_context.hash(change_password_schema.new_password)
     db.delete(verf_code)   #delete the reset key (can only be used once)
     db.commit()
+    identity_cache.invalidate_user(user.id)
     return {'detail':'the password has been changed successfully'}
 
 
@@ -7,10 +7,16 @@ from app.schemas.invitations_schemas import InvitationCreate, InvitationDisplay
 from app.authentication import oauth2_scheme,current_user
 from app.dependencies import SessionDep
 from typing import Annotated
-from fastapi import Depends,HTTPException,status,Body
+from fastapi import Depends,HTTPException,status,Body,Request
 from datetime import datetime
 from app.schemas.users_schemas import UserDisplay
 from app.manage.connection_manager import manager
+from app.manage.feed_manager import backfill_space,prune_space
+from app.manage.membership import space_members,add_space_member,remove_space_member
+from app.manage.search import search_index
+from app.manage.autocomplete import autocomplete
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.response_cache import response_cache
 
 spaces_router = APIRouter(prefix='/spaces',tags=['spaces'])
 
@@ -29,7 +35,7 @@ async def create_space(space:SpaceCreate,token:Annotated[str,Depends(oauth2_sche
     space_data['owner_id'] = user.id
     space = Space(**space_data)
     #we create a main room for the space
-    room = Room(name="main",space_id=space.id)
+    room = Room(name="main",space=space)
     db.add(space)
     db.add(room)
     db.commit()
@@ -38,7 +44,9 @@ async def create_space(space:SpaceCreate,token:Annotated[str,Depends(oauth2_sche
     #add the owner to the space
     space.members.append(user)
     db.commit()
-    manager.add_user_to_space(user.id,space.id)
+    search_index.space_saved(space)
+    autocomplete.space_saved(space)
+    await manager.add_user_to_space(user.id,space.id)
     return space
 
 
@@ -49,6 +57,17 @@ def fetch_space(space_id:int,db:SessionDep):
     return space
 
 
+async def fetch_space_async(space_id:int,db:AsyncSession):
+    space = await db.get(Space,space_id)
+    if not space:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,detail="Space not found")
+    return space
+
+
+async def is_space_member(space_id:int,user_id:int,db:AsyncSession) -> bool:
+    return await space_members.is_member_async(space_id,user_id,db)
+
+
 def has_space_permission(space:Space,user:User):
     return space.owner_id == user.id
 
@@ -66,6 +85,9 @@ async def edit_space(space_id:int,space:SpaceUpdate,token:Annotated[str,Depends(
         setattr(space_db,key,value)
     db.commit()
     db.refresh(space_db)
+    search_index.space_saved(space_db)
+    autocomplete.space_saved(space_db)
+    await response_cache.invalidate('space',space_id)
     return space
 
 
@@ -75,8 +97,14 @@ async def delete_space(space_id:int,token:Annotated[str,Depends(oauth2_scheme)],
     space = fetch_space(space_id,db)
     if not has_space_permission(space,user):
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,detail="You are not the owner of this space")
+    room_ids = [room.id for room in space.rooms]
     db.delete(space)
     db.commit()
+    space_members.forget(space_id)
+    search_index.space_deleted(space_id)
+    autocomplete.space_deleted(space_id)
+    await response_cache.invalidate('space',space_id)
+    await response_cache.invalidate_many('room',[(space_id,room_id) for room_id in room_ids])
 
     
     return {"message": "Space deleted"}
@@ -84,9 +112,10 @@ async def delete_space(space_id:int,token:Annotated[str,Depends(oauth2_scheme)],
 
 
 @spaces_router.get('/{space_id}/view/',response_model=SpaceDisplay)
-async def view_space(space_id:int,db:SessionDep):
-    space = fetch_space(space_id,db)
-    return space
+async def view_space(space_id:int,db:SessionDep,request:Request):
+    async def build():
+        return SpaceDisplay.model_validate(fetch_space(space_id,db),from_attributes=True)
+    return await response_cache.respond(request,response_cache.key('space',space_id),build)
 
 
 
@@ -129,6 +158,7 @@ async def edit_room(space_id: int, room_id: int, room: RoomUpdate, token: Annota
     for key, value in room_data.items():
         setattr(room_db, key, value)
     db.commit()
+    await response_cache.invalidate('room', space_id, room_id)
     db.refresh(room_db)
     return room_db
 
@@ -142,14 +172,16 @@ async def delete_room(space_id: int, room_id: int, token: Annotated[str, Depends
     room_db = fetch_room(room_id,space_id, db)
     db.delete(room_db)
     db.commit()
+    await response_cache.invalidate('room', space_id, room_id)
     return {"message": "Room deleted"}
 
 
 
 @spaces_router.get('/{space_id}/rooms/{room_id}/view/', response_model=RoomDisplay)
-async def view_room(space_id: int, room_id: int, db: SessionDep):
-    room_db = fetch_room(room_id,space_id, db)
-    return room_db
+async def view_room(space_id: int, room_id: int, db: SessionDep, request: Request):
+    async def build():
+        return RoomDisplay.model_validate(fetch_room(room_id,space_id, db), from_attributes=True)
+    return await response_cache.respond(request, response_cache.key('room', space_id, room_id), build)
 
 
 import uuid
@@ -158,7 +190,7 @@ async def create_invitation(space_id:int,invitation:InvitationCreate,token:Annot
     user = current_user(token,db)
     space = fetch_space(space_id,db)
     #the user needs to be a member of the space
-    if user not in space.members:
+    if not space_members.is_member(space.id,user.id,db):
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,detail="You are not a member of this space")
     
     invitation = SpaceInvitation(
@@ -184,13 +216,16 @@ async def join_space(space_id:int,invitation_token:str,token:Annotated[str,Depen
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,detail="Invitation has expired")
     if invitation.max_uses <= invitation.current_uses:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,detail="Invitation has reached the maximum number of uses")
-    if user in space.members:
+    if space_members.is_member(space.id,user.id,db):
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,detail="You are already a member of this space")
     
     #add the user to the space
-    space.add_member(user)
+    add_space_member(space.id,user.id,db)
+    db.refresh(space)   #members_nbr was updated in sql
+    backfill_space(user.id,space,db)   #seed the new member's timeline with the recent posts of the space
     db.commit()
-    manager.add_user_to_space(user.id, space.id)
+    await response_cache.invalidate('space',space.id)   #members_nbr changed
+    await manager.add_user_to_space(user.id, space.id)
     return {"message": "You have joined the space"}
 
 
@@ -198,7 +233,7 @@ async def join_space(space_id:int,invitation_token:str,token:Annotated[str,Depen
 async def get_space_members(space_id:int,token:Annotated[str,Depends(oauth2_scheme)],db:SessionDep):
     user = current_user(token,db)
     space = fetch_space(space_id,db)
-    if not user in space.members:
+    if not space_members.is_member(space.id,user.id,db):
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,detail="You are not a member of this space")
     return space.members
 
@@ -210,11 +245,13 @@ async def remove_member(space_id:int,user_id:int,token:Annotated[str,Depends(oau
     if not has_space_permission(space,user):
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,detail="You are not the owner of this space")
     member = db.query(User).filter(User.id == user_id).first()
-    if not member or not member in space.members :
+    if not member or not space_members.is_member(space.id,member.id,db):
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,detail="Member not found")
-    space.remove_member(member)
+    remove_space_member(space.id,member.id,db)
+    prune_space(member.id,space.id,db)
     db.commit()
-    manager.remove_user_from_space(member.id, space.id)
+    await response_cache.invalidate('space',space.id)
+    await manager.remove_user_from_space(member.id, space.id)
     return {"message": "Member removed"}
 
 
@@ -0,0 +1,130 @@
+from datetime import datetime,timedelta
+from typing import List
+from fastapi.exceptions import HTTPException
+from fastapi import status
+from sqlalchemy import select,delete,insert,func
+from sqlalchemy.orm import Session,selectinload
+from app.database import upsert_insert
+from app.models.posts import Post
+from app.models.tags import Tag,PostTag,TagCount
+from app.pagination import MAX_PAGE_SIZE,keyset_filter,next_cursor
+import os
+import dotenv
+
+dotenv.load_dotenv()
+
+
+TAG_MAX_LENGTH = 50
+TAGS_PER_POST = int(os.getenv('TAGS_PER_POST',10))
+TAG_TRENDING_WINDOW_HOURS = int(os.getenv('TAG_TRENDING_WINDOW_HOURS',24))   #longest window, older hourly counts are pruned
+
+
+def normalize_tag(tag:str) -> str:
+    return tag.strip().lstrip('#').strip().lower()
+
+
+def normalize_tags(tags:List[str]|None) -> List[str]:
+    """lowercase, without '#' and duplicates, in the order given"""
+    names = []
+    for tag in tags or []:
+        name = normalize_tag(tag)
+        if not name or name in names:
+            continue
+        if len(name) > TAG_MAX_LENGTH or ',' in name:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,detail=f'invalid tag: {tag}')
+        names.append(name)
+    if len(names) > TAGS_PER_POST:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,detail=f'a post has at most {TAGS_PER_POST} tags')
+    return names
+
+
+def _bucket(created_at:datetime) -> datetime:
+    return created_at.replace(minute=0,second=0,microsecond=0)
+
+
+def _tag_ids(names:List[str], db:Session) -> dict:
+    """ids of the tags, created when missing (concurrent creations are absorbed by the unique name)"""
+    db.execute(upsert_insert(Tag).values([{'name':name} for name in names]).on_conflict_do_nothing(index_elements=['name']))
+    return dict(db.execute(select(Tag.name,Tag.id).where(Tag.name.in_(names))).all())
+
+
+def _count(post:Post, tag_ids, delta:int, db:Session):
+    """move the post's hourly bucket of each tag, only public posts trend"""
+    bucket = _bucket(post.created_at)
+    if post.for_space or not tag_ids or bucket < _bucket(datetime.now() - timedelta(hours=TAG_TRENDING_WINDOW_HOURS)):
+        return
+    stmt = upsert_insert(TagCount).values([{'tag_id':tag_id,'bucket':bucket,'count':delta} for tag_id in tag_ids])
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=['tag_id','bucket'],
+        set_={'count': TagCount.count + stmt.excluded.count},
+    ))
+
+
+def set_post_tags(post:Post, tags:List[str]|None, db:Session):
+    """
+    Replace the tags of a (flushed) post, only the difference is written
+
+    Args:
+        tags: the tags as sent by the client, normalized here
+    """
+    names = normalize_tags(tags)
+    current = dict(db.execute(select(Tag.name,Tag.id).join(PostTag,PostTag.tag_id == Tag.id).where(PostTag.post_id == post.id)).all())
+    added = [name for name in names if name not in current]
+    removed = [tag_id for name,tag_id in current.items() if name not in names]
+
+    if added:
+        tag_ids = _tag_ids(added,db)
+        db.execute(insert(PostTag),[{'post_id':post.id,'tag_id':tag_ids[name],'created_at':post.created_at} for name in added])
+        _count(post,list(tag_ids.values()),1,db)
+    if removed:
+        db.execute(delete(PostTag).where(PostTag.post_id == post.id,PostTag.tag_id.in_(removed)))
+        _count(post,removed,-1,db)
+    post.tags = ','.join(names) or None
+
+
+def remove_post_tags(post:Post, db:Session):
+    """called before deleting a post"""
+    tag_ids = db.scalars(select(PostTag.tag_id).where(PostTag.post_id == post.id)).all()
+    db.execute(delete(PostTag).where(PostTag.post_id == post.id))
+    _count(post,tag_ids,-1,db)
+
+
+def read_tag_posts(tag:str, db:Session, cursor:str|None = None, page:int = 1, page_size:int = 10):
+    """
+    Page the public posts with a tag, newest first, through the (tag_id, created_at, post_id) index
+
+    Returns:
+        (posts, next_cursor)
+    """
+    page_size = max(1,min(page_size,MAX_PAGE_SIZE))
+    query = db.query(Post).join(PostTag,PostTag.post_id == Post.id).join(Tag,Tag.id == PostTag.tag_id).filter(
+        Tag.name == normalize_tag(tag),Post.for_space == False
+    ).options(selectinload(Post.attachments)).order_by(PostTag.created_at.desc(),PostTag.post_id.desc())
+    if cursor:
+        query = query.filter(keyset_filter(PostTag.created_at,PostTag.post_id,cursor))
+    else:
+        query = query.offset((max(page,1)-1)*page_size)
+    posts = query.limit(page_size+1).all()   #one extra row tells us if there is a next page
+    return posts[:page_size],next_cursor(posts,page_size,lambda p: (p.created_at,p.id))
+
+
+def trending_tags(db:Session, hours:int = TAG_TRENDING_WINDOW_HOURS, limit:int = 10):
+    """
+    Tags used by the most public posts over the last `hours` hours
+
+    Reads at most hours * (tags used per hour) count rows, never the posts.
+    """
+    hours = max(1,min(hours,TAG_TRENDING_WINDOW_HOURS))
+    since = _bucket(datetime.now() - timedelta(hours=hours-1))
+    total = func.sum(TagCount.count).label('posts_nbr')
+    rows = db.execute(
+        select(Tag.name,total).join(Tag,Tag.id == TagCount.tag_id).where(TagCount.bucket >= since)
+        .group_by(Tag.name).having(total > 0).order_by(total.desc(),Tag.name).limit(limit)
+    ).all()
+    return [{'tag':name,'posts_nbr':posts_nbr} for name,posts_nbr in rows]
+
+
+def prune_tag_counts(db:Session) -> int:
+    """drop the hourly counts that fell out of the longest window"""
+    cutoff = _bucket(datetime.now() - timedelta(hours=TAG_TRENDING_WINDOW_HOURS))
+    return db.execute(delete(TagCount).where(TagCount.bucket < cutoff)).rowcount
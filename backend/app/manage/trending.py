@@ -0,0 +1,122 @@
+import math
+from bisect import bisect_right
+from datetime import datetime, timedelta
+from threading import Lock
+from typing import List, Tuple
+import numpy as np
+from sqlalchemy import select, func
+from sqlalchemy.orm import Session, selectinload
+from app.models.posts import Post, Comment, ReactionCount
+from app.schemas.posts_schemas import PostDisplay
+from app.pagination import MAX_PAGE_SIZE, encode_score_cursor, decode_score_cursor
+import os
+import dotenv
+
+dotenv.load_dotenv()
+
+
+TRENDING_WINDOW_HOURS = int(os.getenv('TRENDING_WINDOW_HOURS',48))          #posts older than this can not trend
+TRENDING_HALF_LIFE_HOURS = float(os.getenv('TRENDING_HALF_LIFE_HOURS',6))   #the weight of an engagement halves every half-life
+TRENDING_SIZE = int(os.getenv('TRENDING_SIZE',500))                         #posts kept in the ranked snapshot
+TRENDING_REFRESH_SECONDS = int(os.getenv('TRENDING_REFRESH_SECONDS',60))
+
+#engagement weights
+LIKE_WEIGHT = 1.0
+COMMENT_WEIGHT = 3.0
+REACTION_WEIGHT = 0.5
+
+_DECAY = math.log(2) / (TRENDING_HALF_LIFE_HOURS * 3600)
+
+
+class TrendingEngine:
+    """
+    Time-decayed ranking of the recent public posts
+
+    Each refresh reads the public posts created in the window (on the created_at index) with their
+    engagement from the counters: the rolled up likes_nbr, the comments and the reaction counts.
+    Counting the current state rather than adding up the new rows since the previous refresh means an
+    unlike takes the like back (toggling can not pump a score), and a row committed late is never missed.
+    The counts are loaded into NumPy arrays (id, creation time, likes, comments, reactions).
+    Scores use forward decay, log(1 + engagement) + age * ln2/half-life measured from a fixed epoch:
+    the order is the same as decaying every score to now, but a score only changes with its engagement,
+    so the cursors stay valid across refreshes.
+
+    The ranked snapshot (post displays included) is swapped in at once and served from memory.
+    """
+    def __init__(self) -> None:
+        self.ids = np.empty(0, dtype=np.int64)
+        self.created = np.empty(0, dtype=np.float64)
+        self.likes = np.empty(0, dtype=np.float64)
+        self.comments = np.empty(0, dtype=np.float64)
+        self.reactions = np.empty(0, dtype=np.float64)
+        # keys (-score, -id) ascending for bisect and the matching (score, post display), swapped as one
+        self.snapshot: Tuple[List[Tuple[float, int]], List[Tuple[float, dict]]] = ([], [])
+        self._lock = Lock()   #one refresh at a time
+
+    def refresh(self, db: Session):
+        with self._lock:
+            since = datetime.now() - timedelta(hours=TRENDING_WINDOW_HOURS)
+            #per post, on the (post_id, ...) indexes of comments
+            comments = select(func.count()).where(Comment.post_id == Post.id).correlate(Post).scalar_subquery()
+            reactions = select(func.coalesce(func.sum(ReactionCount.count), 0)).select_from(ReactionCount).join(
+                Comment, Comment.id == ReactionCount.comment_id
+            ).where(Comment.post_id == Post.id).correlate(Post).scalar_subquery()
+            rows = db.execute(select(Post.id, Post.created_at, func.coalesce(Post.likes_nbr, 0), comments, reactions).where(
+                Post.created_at >= since, Post.for_space == False
+            )).all()
+            self._load(rows)
+            self._snapshot(db)
+
+    def _load(self, rows):
+        n = len(rows)
+        self.ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=n)
+        self.created = np.fromiter((row[1].timestamp() for row in rows), dtype=np.float64, count=n)
+        self.likes = np.fromiter((max(row[2], 0) for row in rows), dtype=np.float64, count=n)
+        self.comments = np.fromiter((row[3] for row in rows), dtype=np.float64, count=n)
+        self.reactions = np.fromiter((row[4] for row in rows), dtype=np.float64, count=n)
+
+    def scores(self) -> np.ndarray:
+        engagement = LIKE_WEIGHT*self.likes + COMMENT_WEIGHT*self.comments + REACTION_WEIGHT*self.reactions
+        return np.log1p(engagement) + self.created*_DECAY
+
+    def _snapshot(self, db: Session):
+        engaged = np.flatnonzero(self.likes + self.comments + self.reactions > 0)
+        scores = self.scores()[engaged]
+        if engaged.size > TRENDING_SIZE:   #only the top ones get sorted
+            best = np.argpartition(-scores, TRENDING_SIZE)[:TRENDING_SIZE]
+            engaged, scores = engaged[best], scores[best]
+        order = np.lexsort((-self.ids[engaged], -scores))   #score desc, id desc
+        top, scores = self.ids[engaged[order]].tolist(), scores[order].tolist()
+
+        posts = {post.id: post for post in db.scalars(
+            select(Post).where(Post.id.in_(top)).options(selectinload(Post.attachments))
+        )} if top else {}
+        keys, items = [], []
+        for score, post_id in zip(scores, top):
+            post = posts.get(post_id)
+            if post is None:   #deleted since
+                continue
+            keys.append((-score, -post_id))
+            items.append((score, PostDisplay.model_validate(post, from_attributes=True).model_dump()))
+        self.snapshot = (keys, items)
+
+    def page(self, cursor: str | None = None, page_size: int = 10):
+        """
+        Returns:
+            (post displays, next_cursor) from the current snapshot
+        """
+        page_size = max(1, min(page_size, MAX_PAGE_SIZE))
+        keys, items = self.snapshot
+        start = 0
+        if cursor:
+            score, post_id = decode_score_cursor(cursor)
+            start = bisect_right(keys, (-score, -post_id))
+        page = items[start:start + page_size]
+        next_cursor = None
+        if start + page_size < len(items):
+            score, post = page[-1]
+            next_cursor = encode_score_cursor(score, post['id'])
+        return [post for _, post in page], next_cursor
+
+
+trending = TrendingEngine()
@@ -0,0 +1,206 @@
+from fastapi import APIRouter,Depends,Request
+from fastapi.exceptions import HTTPException
+from fastapi import status
+from fastapi.concurrency import run_in_threadpool
+from typing import Annotated
+from datetime import datetime,timedelta
+from sqlalchemy import update,delete
+from sqlalchemy.ext.asyncio import AsyncSession
+import uuid
+from app.dependencies import AsyncSessionDep
+from app.authentication import oauth2_scheme,current_user_async
+from app.models.media import UploadSession
+from app.models.posts import PostAttachment
+from app.models.users import User
+from app.models.messages import DmMessage
+from app.schemas.uploads_schemas import UploadSessionCreate,UploadSessionDisplay,UploadResult
+from app.schemas.post_attachments_schema import PostAttachmentDisplay
+from app.schemas.dm_messages_schemas import DmMessageDisplay
+from app.manage.posts_manage import fetch_post_async
+from app.manage.media_blobs import claim_blobs
+from app.manage.chat_pipeline import pipeline
+from app.manage.connection_manager import manager
+from app.response_cache import response_cache
+from app.storage import media_store,upload_spool,POSTS_FOLDER,DMS_FOLDER
+from app.images import InvalidImage,POST_IMAGE_SIZES,DM_IMAGE_SIZES
+import os
+import dotenv
+
+dotenv.load_dotenv()
+
+
+UPLOAD_CHUNK_SIZE = int(os.getenv('UPLOAD_CHUNK_SIZE',5*1024*1024))       #bytes per chunk, also the most a chunk request holds in memory
+UPLOAD_MAX_BYTES = int(os.getenv('UPLOAD_MAX_BYTES',100*1024*1024))
+UPLOAD_SESSION_TTL_HOURS = int(os.getenv('UPLOAD_SESSION_TTL_HOURS',24))  #unfinished uploads are dropped after this
+
+
+uploads_router = APIRouter(prefix='/uploads',tags=['uploads'])
+
+
+async def fetch_upload(upload_id:str,user_id:int,db:AsyncSession) -> UploadSession:
+    upload = await db.get(UploadSession,upload_id)
+    if not upload or upload.user_id != user_id or upload.expires_at < datetime.now():
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,detail='this upload does not exist or has expired')
+    return upload
+
+
+async def drop_upload(upload_id:str,db:AsyncSession):
+    await db.execute(delete(UploadSession).where(UploadSession.id == upload_id))
+    await db.commit()
+    await run_in_threadpool(upload_spool.delete,upload_id)
+
+
+# Resumable uploads:
+#  1. POST /uploads/ with the size of the file, returns the id and the chunk size
+#  2. PUT /uploads/{id}/?offset= with each chunk as the raw body, in order
+#  3. after a dropped connection, GET /uploads/{id}/ gives the offset to resume from
+#  4. POST /uploads/{id}/complete/ attaches the file to the post, or sends it as a dm
+@uploads_router.post('/',response_model=UploadSessionDisplay,status_code=status.HTTP_201_CREATED)
+async def create_upload(upload:UploadSessionCreate,token:Annotated[str,Depends(oauth2_scheme)],db:AsyncSessionDep):
+    user = await current_user_async(token,db)
+    if not upload.content_type.startswith('image/'):
+        raise HTTPException(status_code=400,detail='File must be an image')
+    if upload.size <= 0 or upload.size > UPLOAD_MAX_BYTES:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,detail=f'uploads are limited to {UPLOAD_MAX_BYTES // (1024*1024)} MB')
+    if upload.target == 'post':
+        post = await fetch_post_async(upload.target_id,db)
+        if post.user_id != user.id:
+            raise HTTPException(status.HTTP_401_UNAUTHORIZED,'you are not allowed to upload an image to a post you do not own')
+    elif not await db.get(User,upload.target_id):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,detail='User not found')
+
+    session = UploadSession(
+        id=uuid.uuid4().hex,
+        user_id=user.id,
+        target=upload.target,
+        target_id=upload.target_id,
+        filename=upload.filename,
+        content=upload.content,
+        size=upload.size,
+        chunk_size=UPLOAD_CHUNK_SIZE,
+        received=0,
+        expires_at=datetime.now() + timedelta(hours=UPLOAD_SESSION_TTL_HOURS),
+    )
+    db.add(session)
+    await run_in_threadpool(upload_spool.create,session.id,session.size)
+    try:
+        await db.commit()
+    except Exception:
+        await run_in_threadpool(upload_spool.delete,session.id)
+        raise
+    return session
+
+
+@uploads_router.get('/{upload_id}/',response_model=UploadSessionDisplay)
+async def view_upload(upload_id:str,token:Annotated[str,Depends(oauth2_scheme)],db:AsyncSessionDep):
+    user = await current_user_async(token,db)
+    return await fetch_upload(upload_id,user.id,db)
+
+
+@uploads_router.put('/{upload_id}/',response_model=UploadSessionDisplay)
+async def upload_chunk(upload_id:str,offset:int,request:Request,token:Annotated[str,Depends(oauth2_scheme)],db:AsyncSessionDep):
+    """the chunk at `offset` as the raw request body, chunk_size bytes except for the last one"""
+    user = await current_user_async(token,db)
+    upload = await fetch_upload(upload_id,user.id,db)
+    if offset < upload.received:   #a retry of a chunk already stored
+        return upload
+    if offset > upload.received:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT,detail=f'expected the chunk at offset {upload.received}')
+
+    expected = min(upload.chunk_size,upload.size - offset)
+    chunk = bytearray()
+    async for part in request.stream():   #never more than one chunk in memory
+        chunk += part
+        if len(chunk) > expected:
+            raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,detail=f'the chunk at offset {offset} has {expected} bytes')
+    if len(chunk) != expected:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,detail=f'the chunk at offset {offset} has {expected} bytes')
+
+    await run_in_threadpool(upload_spool.write,upload.id,offset,bytes(chunk))
+    #only moves from the offset the chunk was written at, a concurrent copy of the same chunk counts once
+    result = await db.execute(update(UploadSession).where(
+        UploadSession.id == upload.id,UploadSession.received == offset
+    ).values(received=offset + len(chunk)))
+    await db.commit()
+    await db.refresh(upload)
+    if result.rowcount == 0 and upload.received < offset + len(chunk):
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT,detail=f'expected the chunk at offset {upload.received}')
+    return upload
+
+
+@uploads_router.delete('/{upload_id}/',status_code=status.HTTP_200_OK)
+async def cancel_upload(upload_id:str,token:Annotated[str,Depends(oauth2_scheme)],db:AsyncSessionDep):
+    user = await current_user_async(token,db)
+    await drop_upload((await fetch_upload(upload_id,user.id,db)).id,db)
+    return {'detail':'the upload has been cancelled'}
+
+
+@uploads_router.post('/{upload_id}/complete/',response_model=UploadResult)
+async def complete_upload(upload_id:str,token:Annotated[str,Depends(oauth2_scheme)],db:AsyncSessionDep):
+    user = await current_user_async(token,db)
+    upload = await fetch_upload(upload_id,user.id,db)
+    if upload.received < upload.size:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT,detail=f'the upload is missing the bytes from offset {upload.received}')
+
+    #the image processes read the spooled file from disk, this worker never holds it whole
+    path = upload_spool.path(upload.id)
+    try:
+        if upload.target == 'post':
+            result = await attach_to_post(upload,path,user.id,db)
+        else:
+            result = await send_as_dm(upload,path,user.id,db)
+    except InvalidImage as e:
+        await db.rollback()
+        await drop_upload(upload_id,db)
+        raise HTTPException(status_code=400,detail=str(e))
+    await run_in_threadpool(upload_spool.delete,upload_id)
+    return result
+
+
+async def attach_to_post(upload:UploadSession,path:str,user_id:int,db:AsyncSession) -> UploadResult:
+    post = await fetch_post_async(upload.target_id,db)   #it may have been deleted meanwhile
+    if post.user_id != user_id:
+        raise HTTPException(status.HTTP_401_UNAUTHORIZED,'you are not allowed to upload an image to a post you do not own')
+    digest = await run_in_threadpool(upload_spool.digest,upload.id)
+    claimed = await claim_blobs([path],[digest],'post',POSTS_FOLDER,f'post_{post.id}',POST_IMAGE_SIZES,db)
+    blob = claimed.blobs[0]
+    attachment = PostAttachment(post_id=post.id,file=blob.file,file_public_id=blob.file_public_id,variants=blob.variants,blob_id=blob.id)
+    db.add(attachment)
+    await db.delete(upload)
+    try:
+        await db.commit()
+    except Exception:
+        await run_in_threadpool(media_store.delete,*claimed.uploaded)   #no row points to them
+        raise
+    await response_cache.invalidate('post',post.id)
+    return UploadResult(attachment=PostAttachmentDisplay.model_validate(attachment,from_attributes=True))
+
+
+async def send_as_dm(upload:UploadSession,path:str,user_id:int,db:AsyncSession) -> UploadResult:
+    stored = await media_store.upload_image(path,DMS_FOLDER,f'dm_{user_id}',DM_IMAGE_SIZES)
+    row,persisted = await pipeline.submit(DmMessage,
+        content = upload.content or '',
+        sender_id = user_id,
+        recipient_id = upload.target_id,
+        parent_message_id = None,
+        attachment = stored.file.url,
+        attachment_public_id = stored.file.public_id,
+    )
+    try:
+        await persisted   #unlike the websocket, the response waits for the message to be stored
+    except Exception:
+        await run_in_threadpool(media_store.delete,*stored.public_ids())
+        raise
+    await db.delete(upload)
+    await db.commit()
+    msg = DmMessageDisplay.model_validate(row)
+    await manager.send_direct_message(msg.content,user_id,upload.target_id,msg)
+    return UploadResult(message=msg)
+
+
+def prune_upload_sessions(db) -> int:
+    """drop the expired uploads and their spooled parts (sync session, scheduler job)"""
+    expired = db.query(UploadSession.id).filter(UploadSession.expires_at < datetime.now()).all()
+    for (upload_id,) in expired:
+        upload_spool.delete(upload_id)
+    return db.query(UploadSession).filter(UploadSession.id.in_([upload_id for upload_id, in expired])).delete(synchronize_session=False)
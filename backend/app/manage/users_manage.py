@@ -1,13 +1,22 @@
 from fastapi import APIRouter
 from app.schemas.users_schemas import UserDisplay,UserUpdate
-from app.authentication import oauth2_scheme,current_user
-from app.dependencies import SessionDep
-from fastapi import Depends,HTTPException,status
+from app.authentication import oauth2_scheme,current_user,current_user_async
+from app.dependencies import SessionDep,AsyncSessionDep
+from fastapi import Depends,HTTPException,status,Request
 from typing import Annotated
 from app.models.users import User,Follow
 from app.dependencies import SessionDep
-from fastapi import UploadFile
-import cloudinary.uploader
+from fastapi import UploadFile,BackgroundTasks
+from fastapi.concurrency import run_in_threadpool
+from app.identity_cache import identity_cache
+from app.manage.search import search_index
+from app.manage.autocomplete import autocomplete
+from app.response_cache import response_cache
+from app.storage import media_store,is_image,read_upload,PFPS_FOLDER
+from app.manage.media_blobs import claim_blobs,release_stored
+from app.images import InvalidImage,PFP_IMAGE_SIZES
+from sqlalchemy import select,update
+from sqlalchemy.ext.asyncio import AsyncSession
 
 
 users_router = APIRouter(prefix='/users',tags=['users'])
@@ -20,9 +29,10 @@ def fetch_user(user_id:int,db:SessionDep):
     return user
 
 @users_router.get('/{user_id}/view/',response_model=UserDisplay)
-async def view_user(user_id:int,token:Annotated[str,Depends(oauth2_scheme)],db:SessionDep):
-    user = fetch_user(user_id,db)
-    return user
+async def view_user(user_id:int,request:Request,token:Annotated[str,Depends(oauth2_scheme)],db:SessionDep):
+    async def build():
+        return UserDisplay.model_validate(fetch_user(user_id,db),from_attributes=True)
+    return await response_cache.respond(request,response_cache.key('user',user_id),build)
 
 
 
@@ -39,60 +49,76 @@ async def edit_me(user:UserUpdate,token:Annotated[str,Depends(oauth2_scheme)],db
     for key,value in user_data.items():
         setattr(user_db,key,value)
     db.commit()
+    identity_cache.invalidate_user(user_db.id)   #the cached snapshot holds the old profile
+    await response_cache.invalidate('user',user_db.id)
     db.refresh(user_db)
-    return user
+    search_index.user_saved(user_db)
+    autocomplete.user_saved(user_db)
+    return user_db
+
+
+async def swap_pfp(user_id:int,values:dict,db:AsyncSession) -> tuple:
+    """
+    Point the user to another picture (or none) and return the pointer it replaced
+
+    The old pointer is read from the row under a lock, not from the cached identity, so two
+    concurrent swaps are serialized and each one releases only the picture it replaced.
+
+    Returns:
+        (pfp_blob_id, pfp_public_id, pfp_variants) before the swap
+    """
+    old = (await db.execute(
+        select(User.pfp_blob_id,User.pfp_public_id,User.pfp_variants).where(User.id == user_id).with_for_update()
+    )).one()
+    await db.execute(update(User).where(User.id == user_id).values(**values))
+    return tuple(old)
 
 
 @users_router.post('/pfp/',response_model=UserDisplay)
-async def upload_pfp(image:UploadFile,token:Annotated[str,Depends(oauth2_scheme)],db:SessionDep):
-    user = current_user(token,db)
+async def upload_pfp(image:UploadFile,token:Annotated[str,Depends(oauth2_scheme)],db:AsyncSessionDep,background_tasks:BackgroundTasks):
+    user = await current_user_async(token,db)
 #check type
-    if not image.content_type.startswith('image/'):
+    if not is_image(image):
         raise HTTPException(status_code=400, detail="File must be an image")
     
+    #a picture already stored (same content hash) is reused without uploading it again
     try:
-        #check if the user already have a pfp
-        if user.pfp and user.pfp_public_id:
-            cloudinary.uploader.destroy(user.pfp_public_id)
-        upload_result = cloudinary.uploader.upload(
-            image.file,
-            folder="socmel/pfps",
-            public_id=f"user_{user.id}_pfp",
-            overwrite=True
-        )
-        
-        # 4. Get the URL and update user
-        profile_picture_url = upload_result.get("secure_url")
-        user.pfp = profile_picture_url
-        user.pfp_public_id = upload_result.get("public_id")
-        db.commit()
-        db.refresh(user)
-        
-        return user
-        
+        data,digest = await read_upload(image)
+        claimed = await claim_blobs([data],[digest],'pfp',PFPS_FOLDER,f'user_{user.id}_pfp',PFP_IMAGE_SIZES,db)
+    except InvalidImage as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
 
+    blob = claimed.blobs[0]
+    old = await swap_pfp(user.id,{'pfp':blob.file,'pfp_public_id':blob.file_public_id,'pfp_variants':blob.variants,'pfp_blob_id':blob.id},db)
+    #the old picture is only removed once nothing points to it
+    old_public_ids = await db.run_sync(lambda s: release_stored(*old,s))
+    try:
+        await db.commit()
+    except Exception:
+        await run_in_threadpool(media_store.delete,*claimed.uploaded)   #no row points to them
+        raise
+    identity_cache.invalidate_user(user.id)
+    await response_cache.invalidate('user',user.id)
+    if old_public_ids:
+        background_tasks.add_task(media_store.delete,*old_public_ids)
+    await db.refresh(user)
+    return user
+
 
 
 @users_router.delete('/pfp/',response_model=UserDisplay)
-async def remove_pfp(token:Annotated[str,Depends(oauth2_scheme)],db:SessionDep):
-    user = current_user(token,db)
-    if user.pfp:
-        destroy_result = cloudinary.uploader.destroy(user.pfp_public_id, invalidate=True  
-        )
-    
-            
-        # Check if Cloudinary deletion was successful
-        if destroy_result.get('result') != 'ok':
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail=f"Failed to delete image from Cloudinary: {destroy_result}"
-            )
-        user.pfp_public_id = None
-        user.pfp = None
-    db.commit()
-    db.refresh(user)
+async def remove_pfp(token:Annotated[str,Depends(oauth2_scheme)],db:AsyncSessionDep,background_tasks:BackgroundTasks):
+    user = await current_user_async(token,db)
+    old = await swap_pfp(user.id,{'pfp':None,'pfp_public_id':None,'pfp_variants':None,'pfp_blob_id':None},db)
+    public_ids = await db.run_sync(lambda s: release_stored(*old,s))   #empty while other posts/users use the same file
+    await db.commit()
+    if public_ids:
+        background_tasks.add_task(media_store.delete,*public_ids)
+    identity_cache.invalidate_user(user.id)
+    await response_cache.invalidate('user',user.id)
+    await db.refresh(user)
     return user
 
 
@@ -1,8 +1,6 @@
 from fastapi import Request
-from app.authentication import SECRET_KEY,ALGORITHM
-from jose import jwt
-from app.database import SessionLocal
-from app.models.users import User
+from app.authentication import resolve_identity_async
+from app.database import AsyncSessionLocal
 
 async def get_auth_details(request: Request, call_next):
     request.state.cur_user = None
@@ -15,20 +13,14 @@ async def get_auth_details(request: Request, call_next):
         
             token = parts[1]
 
-            try:
-                payload = jwt.decode(token, SECRET_KEY, algorithms=ALGORITHM)
-    
-                # Example: attach user info from payload
-                email = payload.get("sub")
-                db = SessionLocal()
-                user = db.query(User).filter(User.email==email).first()
-                print(user)
-                if user:
-                    request.state.is_authenticated = True
-                    request.state.cur_user = user.id
-            except Exception:
-                # invalid/expired → do nothing
-                pass
+            # decoded once and cached, current_user() in the endpoint then hits the cache
+            #a miss loads the user on the async engine, the event loop is never blocked
+            async with AsyncSessionLocal() as db:   #no connection is taken on a hit
+                snapshot = await resolve_identity_async(token,db)
+            if snapshot:
+                request.state.is_authenticated = True
+                request.state.cur_user = snapshot['id']
+            # invalid/expired → do nothing
 
     response = await call_next(request)
     return response
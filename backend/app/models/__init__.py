@@ -3,4 +3,7 @@ from .spaces import *
 from .users import *
 from .follows import *
 from .messages import *
-from .notes import *
\ No newline at end of file
+from .notes import *
+from .feeds import *
+from .tags import *
+from .media import *
\ No newline at end of file
@@ -0,0 +1,23 @@
+from app.database import Base
+from sqlalchemy import Column,Integer,ForeignKey,DateTime,UniqueConstraint,Index
+from sqlalchemy.orm import relationship
+
+
+class FeedEntry(Base):
+    """a post pushed into a user's home timeline (fan-out on write)"""
+    __tablename__ = "feed_entries"
+
+    id = Column(Integer,primary_key=True,index=True)
+    user_id = Column(Integer,ForeignKey('users.id',ondelete='CASCADE'),nullable=False)   #the owner of the timeline
+    post_id = Column(Integer,ForeignKey('posts.id',ondelete='CASCADE'),nullable=False)
+    created_at = Column(DateTime,nullable=False)   #copy of the post's created_at so the timeline is sorted without a join
+
+    post = relationship("Post")
+
+    __table_args__ = (
+        UniqueConstraint('user_id','post_id',name='unique_feed_entry'),
+        Index('ix_feed_entries_user_created','user_id','created_at','post_id'),
+    )
+
+    def __repr__(self):
+        return f'feed entry: post {self.post_id} for user {self.user_id}'
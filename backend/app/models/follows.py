@@ -1,5 +1,5 @@
 from app.database import Base
-from sqlalchemy import Column,Integer,ForeignKey,UniqueConstraint,Boolean
+from sqlalchemy import Column,Integer,ForeignKey,UniqueConstraint,Boolean,Index
 from sqlalchemy.orm import relationship
 
 
@@ -16,6 +16,8 @@ class Follow(Base):
 
     __table_args__ = (
         UniqueConstraint('follower_id', 'followed_id', name='unique_follow_relationship'),
+        Index('ix_follows_followed','followed_id','is_pending','id'),   #followers / requests pages and counts
+        Index('ix_follows_follower','follower_id','is_pending','id'),   #following pages and counts
     )
 
     def __repr__(self):
@@ -0,0 +1,43 @@
+from app.database import Base
+from sqlalchemy import Column,Integer,BigInteger,String,Text,DateTime,JSON,ForeignKey,UniqueConstraint
+from datetime import datetime
+
+
+class MediaBlob(Base):
+    """
+    A stored image, shared by every attachment/pfp uploaded with the same content
+
+    refcount is the number of post_attachments and users pointing to it, the stored files
+    are destroyed when it drops to 0.
+    """
+    __tablename__ = "media_blobs"
+
+    id = Column(Integer,primary_key=True,index=True)
+    sha256 = Column(String(64),nullable=False)   #of the file as uploaded
+    profile = Column(String(20),nullable=False)  #post or pfp, the same file gives different sizes
+    file = Column(Text,nullable=False)
+    file_public_id = Column(Text,nullable=False)
+    variants = Column(JSON,nullable=True)   #{name: {url, public_id}}
+    refcount = Column(Integer,nullable=False,default=0)
+    created_at = Column(DateTime,default=datetime.now)
+
+    __table_args__ = (
+        UniqueConstraint('sha256','profile',name='unique_media_blob'),
+    )
+
+
+class UploadSession(Base):
+    """A resumable upload in progress, its bytes are in the upload spool until it is completed"""
+    __tablename__ = "upload_sessions"
+
+    id = Column(String(32),primary_key=True)   #random, also what the client resumes with
+    user_id = Column(Integer,ForeignKey('users.id',ondelete='CASCADE'),nullable=False)
+    target = Column(String(10),nullable=False)   #post or dm
+    target_id = Column(Integer,nullable=False)   #the post, or the recipient of the dm
+    filename = Column(String(255),nullable=True)
+    content = Column(String(512),nullable=True)   #text of the dm sent with the file
+    size = Column(BigInteger,nullable=False)
+    chunk_size = Column(Integer,nullable=False)
+    received = Column(BigInteger,nullable=False,default=0)   #bytes written so far, the offset of the next chunk
+    created_at = Column(DateTime,default=datetime.now)
+    expires_at = Column(DateTime,nullable=False,index=True)
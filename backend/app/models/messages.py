@@ -1,5 +1,5 @@
 from app.database import Base 
-from sqlalchemy import Column,Integer,text,DateTime,ForeignKey,Table,String,Boolean
+from sqlalchemy import Column,Integer,text,DateTime,ForeignKey,Table,String,Boolean,Index
 from sqlalchemy.orm import relationship
 from datetime import datetime
 
@@ -12,8 +12,7 @@ class DmMessage(Base):
     content = Column(String(512))
     sender_id = Column(Integer, ForeignKey("users.id"))
     recipient_id = Column(Integer, ForeignKey("users.id"))
-    timestamp = Column(DateTime, default=datetime.now())
-    is_read = Column(Boolean, default=False)
+    timestamp = Column(DateTime, default=datetime.now)
     parent_message_id = Column(Integer,ForeignKey("dm_messages.id"),nullable=True)
     attachment = Column(String(255),nullable=True)
     attachment_public_id = Column(String(255),nullable=True)
@@ -23,6 +22,11 @@ class DmMessage(Base):
     parent_message = relationship("DmMessage",remote_side=[id],back_populates="replies")
     replies = relationship("DmMessage",back_populates='parent_message')
 
+    __table_args__ = (
+        Index('ix_dm_messages_conversation','sender_id','recipient_id','id'),   #history paging, one seek per direction
+        Index('ix_dm_messages_inbox','recipient_id','sender_id','id'),          #unread counts, per sender after the watermark
+    )
+
 
     def __repr__(self):
         return f'dm: ({self.sender}) -> ({self.recipient})'
@@ -36,7 +40,7 @@ class RoomMessage(Base):
     content = Column(String(512))
     sender_id = Column(Integer, ForeignKey("users.id"))
     room_id = Column(Integer, ForeignKey("rooms.id"))
-    timestamp = Column(DateTime, default=datetime.now())
+    timestamp = Column(DateTime, default=datetime.now)
     parent_message_id = Column(Integer,ForeignKey("room_messages.id"),nullable=True)
     attachment = Column(String(255),nullable=True)
     attachment_public_id = Column(String(255),nullable=True)
@@ -45,6 +49,10 @@ class RoomMessage(Base):
     replies = relationship("RoomMessage",back_populates='parent_message')
     room = relationship("Room", foreign_keys=[room_id], back_populates="messages")
 
+    __table_args__ = (
+        Index('ix_room_messages_conversation','room_id','id'),   #history paging
+    )
+
     @property
     def space_id(self):
         return self.room.space_id
@@ -67,7 +75,7 @@ class GroupChat(Base):
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String(50),index=True)
     owner_id = Column(Integer,ForeignKey('users.id'))
-    created_at = Column(DateTime,default=datetime.now())
+    created_at = Column(DateTime,default=datetime.now)
 
     owner = relationship("User",back_populates="owned_group_chats")
     members = relationship("User",secondary=group_chat_members,back_populates="group_chats")
@@ -85,7 +93,7 @@ class GroupChatMessage(Base):
     content = Column(String(512))
     sender_id = Column(Integer,ForeignKey('users.id'))
     group_chat_id = Column(Integer,ForeignKey('group_chat.id'))
-    timestamp = Column(DateTime,default=datetime.now())
+    timestamp = Column(DateTime,default=datetime.now)
     parent_message_id = Column(Integer,ForeignKey("group_chat_messages.id"),nullable=True)
     attachment = Column(String(255),nullable=True)
     attachment_public_id = Column(String(255),nullable=True)
@@ -94,5 +102,17 @@ class GroupChatMessage(Base):
     parent_message = relationship("GroupChatMessage",remote_side=[id],back_populates="replies")
     replies = relationship("GroupChatMessage",back_populates='parent_message')
 
+    __table_args__ = (
+        Index('ix_group_chat_messages_conversation','group_chat_id','id'),   #history paging
+    )
+
+
 
+class ReadWatermark(Base):
+    """the last message a user has read in a conversation, the messages after it are unread"""
+    __tablename__ = "read_watermarks"
 
+    user_id = Column(Integer,ForeignKey('users.id',ondelete='CASCADE'),primary_key=True)
+    kind = Column(String(10),primary_key=True)             #dm, group or room
+    conversation_id = Column(Integer,primary_key=True)     #the other user of a dm, the group or the room
+    last_read_id = Column(Integer,nullable=False,default=0)
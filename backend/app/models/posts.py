@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey,Text,DateTime,Boolean
+from sqlalchemy import Column, Integer, String, ForeignKey,Text,DateTime,Boolean,Index,UniqueConstraint,JSON
 from sqlalchemy.orm import relationship
 from app.database import Base
 from datetime import datetime
@@ -9,7 +9,7 @@ class Post(Base):
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String(200))
     content = Column(Text)
-    created_at = Column(DateTime, default=datetime.now())
+    created_at = Column(DateTime, default=datetime.now)
     likes_nbr = Column(Integer, default=0)
     user_id = Column(Integer, ForeignKey("users.id"))
     space_id = Column(Integer,ForeignKey('spaces.id'),nullable=True)
@@ -22,6 +22,11 @@ class Post(Base):
     space = relationship("Space",back_populates="posts")
     attachments = relationship("PostAttachment",back_populates='post',cascade="all,delete")   #delete when deleting post
 
+    __table_args__ = (
+        Index('ix_posts_created','created_at','id'),                  #global feed
+        Index('ix_posts_user_created','user_id','created_at','id'),   #user posts, fan-out on read for big accounts
+        Index('ix_posts_space_created','space_id','created_at','id'), #space posts, fan-out on read for big spaces
+    )
 
     def __repr__(self):
         return f'post: {self.title} by {self.user.email} - {self.created_at}'
@@ -36,8 +41,23 @@ class Like(Base):
     post = relationship("Post", back_populates="likes")
     user = relationship("User", back_populates="likes")
 
+    __table_args__ = (
+        UniqueConstraint('post_id','user_id',name='unique_like'),   #a user likes a post once, even under concurrent requests
+    )
+
     def __repr__(self):
         return f'like on {self.post_id} by {self.user.email}'
+
+
+class LikeCounterShard(Base):
+    """
+    Pending like count changes of a post, spread over a few rows so concurrent likes
+    do not all wait on the post row. They are rolled up into posts.likes_nbr by the scheduler.
+    """
+    __tablename__ = "like_counter_shards"
+    post_id = Column(Integer, ForeignKey("posts.id",ondelete='CASCADE'), primary_key=True)
+    shard = Column(Integer, primary_key=True)
+    delta = Column(Integer, default=0, nullable=False)
     
 
 
@@ -50,13 +70,19 @@ class Comment(Base):
     post_id = Column(Integer,ForeignKey('posts.id'))
     likes_nbr = Column(Integer,default=0)
     parent_id = Column(Integer,ForeignKey('comments.id'),nullable=True)
+    created_at = Column(DateTime,default=datetime.now)
 
     user = relationship("User",back_populates='comments')
     post = relationship("Post",back_populates='comments')
     parent_comment = relationship("Comment",remote_side = [id],back_populates='sub_comments')
     sub_comments = relationship("Comment",back_populates='parent_comment')
     reactions = relationship("Reaction",back_populates="comment",cascade="all,delete")   #delete when deleting comment
+    reaction_counts = relationship("ReactionCount",cascade="all,delete")
 
+    __table_args__ = (
+        Index('ix_comments_post_created','post_id','created_at','id'),
+        Index('ix_comments_parent_created','parent_id','created_at','id'),   #reply lists of the comment tree
+    )
 
 
 
@@ -71,6 +97,18 @@ class Reaction(Base):
     user = relationship("User",back_populates="reactions")
     comment = relationship("Comment",back_populates="reactions",cascade="all,delete")   #delete when deleting comment
 
+    __table_args__ = (
+        UniqueConstraint('comment_id','user_id','reaction_type',name='unique_reaction'),   #one reaction of each type per user
+    )
+
+
+class ReactionCount(Base):
+    """Number of reactions of each type on a comment, kept up to date by the reaction toggle"""
+    __tablename__ = "reaction_counts"
+    comment_id = Column(Integer, ForeignKey("comments.id",ondelete='CASCADE'), primary_key=True)
+    reaction_type = Column(String(20), primary_key=True)
+    count = Column(Integer, default=0, nullable=False)
+
 
 
 class PostAttachment(Base):
@@ -79,6 +117,8 @@ class PostAttachment(Base):
     id = Column(Integer,primary_key=True, index=True)
     file = Column(Text,nullable=False)
     file_public_id = Column(Text,nullable=False)
+    variants = Column(JSON,nullable=True)   #smaller sizes, {name: {url, public_id}}
+    blob_id = Column(Integer,ForeignKey('media_blobs.id'),nullable=True)   #the shared stored image, null for the older uploads
     post_id = Column(Integer,ForeignKey('posts.id'))
 
     post = relationship(Post,back_populates='attachments')
@@ -1,5 +1,5 @@
 from app.database import Base
-from sqlalchemy import Column,Integer,String,Text,ForeignKey,DateTime,Table
+from sqlalchemy import Column,Integer,String,Text,ForeignKey,DateTime,Table,Index
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from sqlalchemy import UniqueConstraint
@@ -75,5 +75,6 @@ membership = Table(
     Base.metadata,
     Column('user_id',Integer,ForeignKey('users.id')),
     Column('space_id',Integer,ForeignKey('spaces.id')),
+    Index('ix_membership_space_user','space_id','user_id'),   #is-member checks and member set loads
 
 )
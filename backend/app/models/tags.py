@@ -0,0 +1,41 @@
+from app.database import Base
+from sqlalchemy import Column,Integer,String,ForeignKey,DateTime,Index
+from sqlalchemy.orm import relationship
+
+
+class Tag(Base):
+    __tablename__ = "tags"
+
+    id = Column(Integer,primary_key=True,index=True)
+    name = Column(String(50),unique=True,nullable=False)   #normalized: lowercase, no leading '#'
+
+    def __repr__(self):
+        return f'tag: {self.name}'
+
+
+class PostTag(Base):
+    """a tag of a post, posts.tags keeps the display copy"""
+    __tablename__ = "post_tags"
+
+    post_id = Column(Integer,ForeignKey('posts.id',ondelete='CASCADE'),primary_key=True)
+    tag_id = Column(Integer,ForeignKey('tags.id',ondelete='CASCADE'),primary_key=True)
+    created_at = Column(DateTime,nullable=False)   #copy of the post's created_at so a tag's posts are paged without sorting posts
+
+    tag = relationship("Tag")
+
+    __table_args__ = (
+        Index('ix_post_tags_tag_created','tag_id','created_at','post_id'),
+    )
+
+
+class TagCount(Base):
+    """number of public posts created with a tag during one hour, summed over a window for trending tags"""
+    __tablename__ = "tag_counts"
+
+    tag_id = Column(Integer,ForeignKey('tags.id',ondelete='CASCADE'),primary_key=True)
+    bucket = Column(DateTime,primary_key=True)   #start of the hour
+    count = Column(Integer,default=0,nullable=False)
+
+    __table_args__ = (
+        Index('ix_tag_counts_bucket','bucket'),
+    )
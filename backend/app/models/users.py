@@ -1,5 +1,5 @@
 from fastapi import Depends
-from sqlalchemy import Column, Integer, String, Boolean,URL,Text
+from sqlalchemy import Column, Integer, String, Boolean,URL,Text,JSON,ForeignKey,DateTime
 from sqlalchemy.orm import relationship
 from app.database import Base
 from app.models.follows import Follow,FollowRequest
@@ -18,6 +18,10 @@ class User(Base):
     level = Column(Integer, default=1)
     pfp = Column(String(255),nullable=True)
     pfp_public_id = Column(Text,nullable=True)
+    pfp_variants = Column(JSON,nullable=True)   #smaller sizes of the pfp, {name: {url, public_id}}
+    pfp_blob_id = Column(Integer,ForeignKey('media_blobs.id'),nullable=True)
+    last_seen = Column(DateTime,nullable=True)   #last websocket activity, written in batches (see presence.py)
+    followers_nbr = Column(Integer, default=0)   #accepted followers, used to pick fan-out on write or on read
 
     posts = relationship("Post",back_populates='user')
     likes = relationship("Like",back_populates='user')
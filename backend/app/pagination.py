@@ -0,0 +1,102 @@
+import base64
+import json
+from datetime import datetime
+from fastapi.exceptions import HTTPException
+from fastapi import status,Request,Response
+from sqlalchemy import tuple_
+from sqlalchemy.orm import Query
+
+
+MAX_PAGE_SIZE = 100
+
+
+def encode_cursor(created_at:datetime, id:int) -> str:
+    """Build an opaque cursor pointing right after the (created_at, id) row"""
+    raw = json.dumps([created_at.isoformat(),id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor:str) -> tuple[datetime,int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        created_at,id = json.loads(raw)
+        return datetime.fromisoformat(created_at),int(id)
+    except Exception:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,detail='invalid pagination cursor')
+
+
+def encode_id_cursor(id:int) -> str:
+    """Cursor for lists ordered by id only"""
+    return base64.urlsafe_b64encode(json.dumps([id]).encode()).decode().rstrip('=')
+
+
+def decode_id_cursor(cursor:str) -> int:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        (id,) = json.loads(raw)
+        return int(id)
+    except Exception:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,detail='invalid pagination cursor')
+
+
+def keyset_filter(created_col, id_col, cursor:str):
+    """Rows strictly older than the cursor in (created_at desc, id desc) order"""
+    created_at,id = decode_cursor(cursor)
+    return tuple_(created_col,id_col) < tuple_(created_at,id)
+
+
+def paginate(query:Query, created_col, id_col, cursor:str|None = None, page:int = 1, page_size:int = 10):
+    """
+    Page a query newest first
+
+    Args:
+        query: the filtered query, without ordering
+        created_col, id_col: the columns the rows are ordered by (descending)
+        cursor: the next_cursor of the previous page, pages are then read with an index seek
+        page: legacy offset paging, only used when no cursor is given
+
+    Returns:
+        (items, next_cursor), next_cursor is None on the last page
+    """
+    page_size = max(1,min(page_size,MAX_PAGE_SIZE))
+    query = query.order_by(created_col.desc(),id_col.desc())
+    if cursor:
+        query = query.filter(keyset_filter(created_col,id_col,cursor))
+    else:
+        query = query.offset((max(page,1)-1)*page_size)
+
+    rows = query.limit(page_size+1).all()   #one extra row tells us if there is a next page
+    items = rows[:page_size]
+    return items,next_cursor(rows,page_size,lambda row: (getattr(row,created_col.key),getattr(row,id_col.key)))
+
+
+def set_next_cursor(request:Request, response:Response, next_cursor:str|None):
+    """
+    Give the next cursor of an endpoint whose body stays a plain list (the contract before cursors)
+
+    The cursor goes in X-Next-Cursor and in a Link rel="next" header to the same url with ?cursor=,
+    nothing is set on the last page.
+    """
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+        response.headers['Link'] = f'<{request.url.include_query_params(cursor=next_cursor)}>; rel="next"'
+
+
+def next_cursor(rows:list, page_size:int, key, encode=encode_cursor) -> str|None:
+    if len(rows) <= page_size:
+        return None
+    return encode(*key(rows[page_size-1]))
+
+
+def encode_score_cursor(score:float, id:int) -> str:
+    """Cursor for ranked lists ordered by (score desc, id desc)"""
+    return base64.urlsafe_b64encode(json.dumps([score,id]).encode()).decode().rstrip('=')
+
+
+def decode_score_cursor(cursor:str) -> tuple[float,int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        score,id = json.loads(raw)
+        return float(score),int(id)
+    except Exception:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,detail='invalid pagination cursor')
@@ -0,0 +1,124 @@
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional, Tuple
+from fastapi import Request, Response
+from pydantic import BaseModel
+import os
+import dotenv
+
+dotenv.load_dotenv()
+
+
+RESPONSE_CACHE_URL = os.getenv('RESPONSE_CACHE_URL')                  #unset: in-process LRU, redis://...: shared by the workers
+RESPONSE_CACHE_SIZE = int(os.getenv('RESPONSE_CACHE_SIZE',10000))      #entries of the in-process LRU
+RESPONSE_CACHE_TTL = int(os.getenv('RESPONSE_CACHE_TTL',60))           #seconds, bounds staleness for the changes not invalidated
+RESPONSE_CACHE_VERSION = 1   #bump when a cached schema changes, the old entries are then never read
+
+
+class MemoryCacheBackend:
+    """in-process LRU with TTL, each worker has its own copy"""
+    def __init__(self, max_size: int = RESPONSE_CACHE_SIZE) -> None:
+        self.max_size = max_size
+        # key -> (expires_at, (etag, body))
+        self._entries: OrderedDict[str, Tuple[float, Tuple[str, bytes]]] = OrderedDict()
+
+    async def get(self, key: str) -> Optional[Tuple[str, bytes]]:
+        entry = self._entries.get(key)
+        if not entry:
+            return None
+        if entry[0] <= time.time():
+            self._entries.pop(key, None)
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    async def set(self, key: str, etag: str, body: bytes, ttl: int):
+        self._entries[key] = (time.time() + ttl, (etag, body))
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:   #evict the least recently used
+            self._entries.popitem(last=False)
+
+    async def delete(self, *keys: str):
+        for key in keys:
+            self._entries.pop(key, None)
+
+
+class RedisCacheBackend:
+    """shared by all the workers, an invalidation on one worker is seen by all of them"""
+    def __init__(self, client) -> None:
+        self.client = client   #redis.asyncio client
+
+    async def get(self, key: str) -> Optional[Tuple[str, bytes]]:
+        value = await self.client.get(key)
+        if value is None:
+            return None
+        etag, _, body = value.partition(b'\n')
+        return etag.decode(), body
+
+    async def set(self, key: str, etag: str, body: bytes, ttl: int):
+        await self.client.set(key, etag.encode() + b'\n' + body, ex=ttl)
+
+    async def delete(self, *keys: str):
+        if keys:
+            await self.client.delete(*keys)
+
+
+def cache_backend_from_url(url: str | None = RESPONSE_CACHE_URL):
+    if not url:
+        return MemoryCacheBackend()
+    import redis.asyncio as redis   #optional dependency, only needed for a shared cache
+    return RedisCacheBackend(redis.Redis.from_url(url))
+
+
+class ResponseCache:
+    """
+    Cache of serialized GET responses, keyed on resource and id
+
+    Every entry keeps the JSON body and its strong ETag (hash of the body). A request whose
+    If-None-Match holds the ETag gets a 304 without a body; otherwise the cached body is sent as is,
+    without touching the database nor serializing again. The mutations call invalidate() for the
+    resources they change, after their commit.
+    """
+    def __init__(self, backend=None, ttl: int = RESPONSE_CACHE_TTL) -> None:
+        self.backend = backend or cache_backend_from_url()
+        self.ttl = ttl
+
+    @staticmethod
+    def key(resource: str, *ids) -> str:
+        return ':'.join(['response', str(RESPONSE_CACHE_VERSION), resource, *map(str, ids)])
+
+    async def respond(self, request: Request, key: str, build: Callable[[], Awaitable[BaseModel]]) -> Response:
+        """
+        Args:
+            key: ResponseCache.key(resource, *ids)
+            build: coroutine function returning the response model, only awaited on a miss
+        """
+        entry = await self.backend.get(key)
+        if entry is None:
+            body = (await build()).model_dump_json().encode()
+            etag = '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+            await self.backend.set(key, etag, body, self.ttl)
+        else:
+            etag, body = entry
+        headers = {'ETag': etag, 'Cache-Control': 'no-cache'}   #clients may keep it but revalidate every time
+        if _matches(request.headers.get('if-none-match'), etag):
+            return Response(status_code=304, headers=headers)
+        return Response(content=body, media_type='application/json', headers=headers)
+
+    async def invalidate(self, resource: str, *ids):
+        await self.backend.delete(self.key(resource, *ids))
+
+    async def invalidate_many(self, resource: str, ids):
+        await self.backend.delete(*(self.key(resource, *id) if isinstance(id, tuple) else self.key(resource, id) for id in ids))
+
+
+def _matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    #If-None-Match uses the weak comparison, W/"x" matches "x"
+    tags = [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]
+    return '*' in tags or etag in tags
+
+
+response_cache = ResponseCache()
@@ -1,5 +1,6 @@
 from pydantic import BaseModel
-from typing import List
+from typing import List,Dict
+from datetime import datetime
 
 
 class CommentDisplay(BaseModel):
@@ -9,6 +10,30 @@ class CommentDisplay(BaseModel):
     post_id : int
     likes_nbr : int
     parent_id : int | None
+    created_at : datetime | None = None
     sub_comments : List["CommentDisplay"] = []
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+
+class CommentNode(BaseModel):
+    id : int
+    content : str
+    user_id : int
+    post_id : int
+    likes_nbr : int
+    parent_id : int | None
+    created_at : datetime | None = None
+    replies : List["CommentNode"] = []
+    more_replies : str | None = None   #cursor for /comment/{id}/replies/ when some replies were left out
+
+
+class CommentTree(BaseModel):
+    items : List[CommentNode]
+    next_cursor : str | None = None
+
+
+class ReactionSummary(BaseModel):
+    comment_id : int
+    counts : Dict[str,int] = {}   #reaction type -> number of reactions
+    mine : List[str] = []         #types the caller reacted with
@@ -1,4 +1,4 @@
-from typing import Optional
+from typing import Optional,Literal
 from pydantic import BaseModel
 from datetime import datetime
 
@@ -8,8 +8,9 @@ class DmMessageDisplay(BaseModel):
     sender_id : int
     recipient_id : int
     timestamp : datetime
-    is_read : bool
+    is_read : bool = False   #set from the read watermarks by the history endpoint
     parent_message_id : Optional[int] = None
+    attachment : Optional[str] = None
 
     class Config:
         from_attributes = True
@@ -37,3 +38,21 @@ class RoomMessageDisplay(BaseModel):
 
     class Config:
         from_attributes = True
+
+
+class ReadMark(BaseModel):
+    kind : Literal['dm','group','room']
+    conversation_id : int    #the other user of a dm, the group or the room
+    last_read_id : int       #the last message read, the ones before it are read too
+
+
+class ReadWatermarkDisplay(ReadMark):
+    user_id : int
+
+
+class UnreadDisplay(BaseModel):
+    kind : str
+    conversation_id : int
+    space_id : Optional[int] = None   #rooms only
+    last_read_id : int
+    unread : int
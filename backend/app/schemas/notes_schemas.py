@@ -0,0 +1,6 @@
+from pydantic import BaseModel
+
+
+class NoteDisplay(BaseModel):
+    exists : bool
+    note : str
@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel,field_validator
 
 
 
@@ -7,6 +7,15 @@ class PostAttachmentDisplay(BaseModel):
     file : str
     file_public_id : str
     post_id : int
+    variants : dict[str,str] | None = None   #size name -> url
+
+    @field_validator('variants',mode='before')
+    @classmethod
+    def variant_urls(cls, variants):
+        #stored as {name: {url, public_id}}
+        if variants:
+            return {name: variant['url'] if isinstance(variant,dict) else variant for name,variant in variants.items()}
+        return variants
 
     class Config:
         from_attributes = True
\ No newline at end of file
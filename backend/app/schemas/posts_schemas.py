@@ -1,6 +1,6 @@
 from app.models.posts import Post
 from app.schemas.post_attachments_schema import PostAttachmentDisplay
-from pydantic import BaseModel
+from pydantic import BaseModel,field_validator
 from datetime import datetime
 
 class PostBase(BaseModel):
@@ -20,6 +20,14 @@ class PostDisplay(PostBase):
     user_id : int
     space_id : int | None 
     attachments : list[PostAttachmentDisplay] | None
+
+    @field_validator('tags',mode='before')
+    @classmethod
+    def split_tags(cls, tags):
+        #stored as "tag1,tag2" on the post
+        if isinstance(tags,str):
+            return tags.split(',')
+        return tags
     
 
 
@@ -33,3 +41,11 @@ class Post(PostDisplay):
         from_attributes = True
 
 
+class PostPage(BaseModel):
+    items : list[PostDisplay]
+    next_cursor : str | None = None   #pass it back as ?cursor= to get the next page
+
+
+class TrendingTag(BaseModel):
+    tag : str
+    posts_nbr : int   #public posts with the tag over the window
@@ -0,0 +1,9 @@
+from typing import Optional
+from pydantic import BaseModel
+from datetime import datetime
+
+
+class PresenceDisplay(BaseModel):
+    user_id : int
+    online : bool
+    last_seen : Optional[datetime] = None   #last websocket activity, null if never connected
@@ -0,0 +1,19 @@
+from pydantic import BaseModel
+
+
+class AutocompleteItem(BaseModel):
+    id : int
+    name : str          #username or space name
+    scoped : bool       #someone the caller follows / a space they are in
+
+
+class UserSearchResult(BaseModel):
+    #public fields only, the search is open to any signed in user
+    id : int
+    username : str
+    pfp : str | None = None
+
+
+class UserSearchPage(BaseModel):
+    items : list[UserSearchResult]
+    next_cursor : str | None = None   #pass it back as ?cursor= to get the next page
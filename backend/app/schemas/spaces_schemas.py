@@ -21,3 +21,8 @@ class SpaceUpdate(SpaceBase):
 class Space(SpaceDisplay):
     class Config:
         from_attributes = True
+
+
+class SpacePage(BaseModel):
+    items : list[SpaceDisplay]
+    next_cursor : str | None = None   #pass it back as ?cursor= to get the next page
@@ -0,0 +1,32 @@
+from pydantic import BaseModel
+from datetime import datetime
+from typing import Literal
+from app.schemas.post_attachments_schema import PostAttachmentDisplay
+from app.schemas.dm_messages_schemas import DmMessageDisplay
+
+
+class UploadSessionCreate(BaseModel):
+    target : Literal['post','dm']
+    target_id : int                 #the post, or the recipient of the dm
+    size : int                      #of the whole file, in bytes
+    content_type : str
+    filename : str | None = None
+    content : str | None = None     #text of the dm
+
+
+class UploadSessionDisplay(BaseModel):
+    id : str
+    target : str
+    target_id : int
+    size : int
+    chunk_size : int                #every chunk but the last one has this size
+    received : int                  #the offset of the next chunk
+    expires_at : datetime
+
+    class Config:
+        from_attributes = True
+
+
+class UploadResult(BaseModel):
+    attachment : PostAttachmentDisplay | None = None   #target post
+    message : DmMessageDisplay | None = None           #target dm
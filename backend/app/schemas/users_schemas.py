@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel,field_validator
 from app.models.users import User
 from typing import Optional
 
@@ -22,9 +22,18 @@ class UserDisplay(UserBase):
     xp : int
     level : int
     pfp : str | None = None
+    pfp_variants : dict[str,str] | None = None   #size name -> url
+
+    @field_validator('pfp_variants',mode='before')
+    @classmethod
+    def variant_urls(cls, variants):
+        #stored as {name: {url, public_id}}
+        if variants:
+            return {name: variant['url'] if isinstance(variant,dict) else variant for name,variant in variants.items()}
+        return variants
 
 
 
 class User(UserDisplay):
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
@@ -0,0 +1,218 @@
+import asyncio
+import hashlib
+import io
+import logging
+import shutil
+import uuid
+from pathlib import Path
+from typing import BinaryIO, Dict, List, NamedTuple, Tuple
+from anyio import CapacityLimiter, to_thread
+from fastapi import UploadFile
+from app.images import derive_async, InvalidImage, IMAGE_FORMAT, IMAGE_MAX_BYTES, EXTENSIONS
+import os
+import dotenv
+
+dotenv.load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND','cloudinary')       #cloudinary, or local (development, tests)
+STORAGE_LOCAL_DIR = os.getenv('STORAGE_LOCAL_DIR','media')          #where the local backend writes the files
+STORAGE_LOCAL_URL = os.getenv('STORAGE_LOCAL_URL','/media')         #prefix the local files are served under
+UPLOAD_CONCURRENCY = int(os.getenv('UPLOAD_CONCURRENCY',4))        #uploads running at once in this worker, all requests together
+UPLOAD_SPOOL_DIR = os.getenv('UPLOAD_SPOOL_DIR','spool')            #parts of the chunked uploads, must be shared by the workers
+
+POSTS_FOLDER = 'socmel/posts_attacments'   #the existing folder name
+PFPS_FOLDER = 'socmel/pfps'
+DMS_FOLDER = 'socmel/dm_attachments'
+READ_CHUNK_SIZE = 1024*1024
+
+
+class StoredFile(NamedTuple):
+    url: str
+    public_id: str   #what delete() needs
+
+
+class CloudinaryStorage:
+    """the cloudinary SDK is blocking, its calls are run in worker threads by MediaStore"""
+    def save(self, file: BinaryIO, folder: str, name: str, filename: str | None = None) -> StoredFile:
+        import cloudinary.uploader
+        result = cloudinary.uploader.upload(file, folder=folder, public_id=name, overwrite=False)
+        return StoredFile(result.get('secure_url'), result.get('public_id'))
+
+    def delete(self, public_id: str):
+        import cloudinary.uploader
+        cloudinary.uploader.destroy(public_id, invalidate=True)
+
+
+class LocalStorage:
+    """files written under STORAGE_LOCAL_DIR and served by the app under STORAGE_LOCAL_URL"""
+    def __init__(self, root: str = STORAGE_LOCAL_DIR, base_url: str = STORAGE_LOCAL_URL) -> None:
+        self.root = Path(root)
+        self.base_url = base_url.rstrip('/')
+
+    def save(self, file: BinaryIO, folder: str, name: str, filename: str | None = None) -> StoredFile:
+        public_id = f'{folder}/{name}{Path(filename or "").suffix.lower()}'   #the extension gives the served content type
+        path = self.root / public_id
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'wb') as out:
+            shutil.copyfileobj(file, out)
+        return StoredFile(f'{self.base_url}/{public_id}', public_id)
+
+    def delete(self, public_id: str):
+        (self.root / public_id).unlink(missing_ok=True)
+
+
+class StoredImage(NamedTuple):
+    file: StoredFile                    #the 'full' size, stands in for the original
+    variants: Dict[str, StoredFile]     #the smaller sizes
+
+    def public_ids(self) -> List[str]:
+        return [self.file.public_id, *(variant.public_id for variant in self.variants.values())]
+
+    def variants_column(self) -> dict:
+        """what is stored in the variants JSON columns"""
+        return {name: {'url': variant.url, 'public_id': variant.public_id} for name, variant in self.variants.items()}
+
+
+def variant_public_ids(variants: dict | None) -> List[str]:
+    return [variant['public_id'] for variant in (variants or {}).values()]
+
+
+class MediaStore:
+    """
+    Uploads and deletions off the event loop
+
+    The backend calls run in worker threads, at most UPLOAD_CONCURRENCY of them at once. Every file
+    gets a unique name, so concurrent uploads never overwrite each other. Images are decoded and
+    re-encoded at every size in the image process pool before being stored (app/images.py).
+    delete() is a plain function meant for BackgroundTasks: the response does not wait for the storage provider.
+    """
+    def __init__(self, backend=None) -> None:
+        self.backend = backend or (LocalStorage() if STORAGE_BACKEND == 'local' else CloudinaryStorage())
+        self._limiter = CapacityLimiter(UPLOAD_CONCURRENCY)
+
+    async def _save(self, file: BinaryIO, folder: str, name: str, filename: str | None) -> StoredFile:
+        return await to_thread.run_sync(self.backend.save, file, folder, name, filename, limiter=self._limiter)
+
+    async def _all_or_nothing(self, uploads, public_ids):
+        #run the uploads concurrently, when one fails the stored ones are deleted and its error raised
+        results = await asyncio.gather(*uploads, return_exceptions=True)
+        errors = [result for result in results if isinstance(result, BaseException)]
+        if errors:
+            stored = [public_id for result in results if not isinstance(result, BaseException) for public_id in public_ids(result)]
+            await to_thread.run_sync(lambda: self.delete(*stored))
+            raise errors[0]
+        return results
+
+    async def upload(self, file: UploadFile, folder: str, prefix: str) -> StoredFile:
+        """store a file as sent"""
+        return await self._save(file.file, folder, f'{prefix}_{uuid.uuid4().hex}', file.filename)
+
+    async def upload_image(self, data: bytes | str, folder: str, prefix: str, sizes: Dict[str, int]) -> StoredImage:
+        """
+        Store the derivatives of an image, the original is never stored
+
+        Args:
+            data: the uploaded file (see read_upload), or the path of a spooled one
+            sizes: name -> longest side, must hold 'full'
+
+        Raises:
+            InvalidImage: the file can not be decoded or is too large
+        """
+        encoded = await derive_async(data, sizes)
+        name = f'{prefix}_{uuid.uuid4().hex}'
+        filename = 'image' + EXTENSIONS[IMAGE_FORMAT]
+        names = list(encoded)
+        stored = await self._all_or_nothing(
+            [self._save(io.BytesIO(encoded[size]), folder, name if size == 'full' else f'{name}_{size}', filename) for size in names],
+            lambda stored_file: [stored_file.public_id],
+        )
+        files = dict(zip(names, stored))
+        full = files.pop('full')
+        return StoredImage(full, files)
+
+    async def upload_images(self, files: List[bytes | str], folder: str, prefix: str, sizes: Dict[str, int]) -> List[StoredImage]:
+        """
+        upload_image for every file concurrently, all or nothing: when one fails, the others are deleted
+
+        Returns:
+            the stored images, in the order given
+        """
+        return await self._all_or_nothing(
+            [self.upload_image(data, folder, prefix, sizes) for data in files],
+            StoredImage.public_ids,
+        )
+
+    def delete(self, *public_ids: str):
+        for public_id in public_ids:
+            try:
+                self.backend.delete(public_id)
+            except Exception:   #a leftover file costs storage only, it must not fail the caller
+                logger.exception('failed to delete %s', public_id)
+
+
+async def read_upload(file: UploadFile, max_bytes: int = IMAGE_MAX_BYTES) -> Tuple[bytes, str]:
+    """
+    Read an upload in chunks, hashing it on the way
+
+    Raises:
+        InvalidImage: the file is bigger than max_bytes, the rest of it is not read
+
+    Returns:
+        (content, sha256 hex digest)
+    """
+    digest = hashlib.sha256()
+    chunks, size = [], 0
+    while chunk := await file.read(READ_CHUNK_SIZE):
+        size += len(chunk)
+        if size > max_bytes:
+            raise InvalidImage(f'images are limited to {max_bytes // (1024*1024)} MB')
+        digest.update(chunk)
+        chunks.append(chunk)
+    return b''.join(chunks), digest.hexdigest()
+
+
+class LocalSpool:
+    """
+    Parts of the resumable uploads, one file per upload written at the chunk offsets
+
+    The file is created at its full size with the session, the chunks only ever open it for update:
+    chunks arriving together never truncate each other, and writing a chunk again at the same offset
+    overwrites it, so a retried chunk is harmless. The image processes read the assembled file from its path.
+    """
+    def __init__(self, root: str = UPLOAD_SPOOL_DIR) -> None:
+        self.root = Path(root)
+
+    def path(self, upload_id: str) -> str:
+        return os.path.abspath(self.root / upload_id)   #also opened by the image processes
+
+    def create(self, upload_id: str, size: int):
+        self.root.mkdir(parents=True, exist_ok=True)
+        with open(self.path(upload_id), 'xb') as out:   #upload ids are unique, never reuse a file
+            out.truncate(size)
+
+    def write(self, upload_id: str, offset: int, data: bytes):
+        with open(self.path(upload_id), 'r+b') as out:
+            out.seek(offset)
+            out.write(data)
+
+    def digest(self, upload_id: str) -> str:
+        """sha256 of the assembled file, read in chunks"""
+        digest = hashlib.sha256()
+        with open(self.path(upload_id), 'rb') as file:
+            while chunk := file.read(READ_CHUNK_SIZE):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def delete(self, upload_id: str):
+        Path(self.path(upload_id)).unlink(missing_ok=True)
+
+
+def is_image(file: UploadFile) -> bool:
+    return bool(file.content_type) and file.content_type.startswith('image/')
+
+
+media_store = MediaStore()
+upload_spool = LocalSpool()
@@ -5,6 +5,14 @@ from datetime import datetime,timedelta
 from app.dependencies import SessionDep,SessionLocal
 from app.models.notes import Note
 from app.models.posts import PostAttachment
+from app.manage.feed_manager import trim_feeds
+from app.manage.like_counter import roll_up_like_counters,LIKE_ROLLUP_SECONDS
+from app.manage.tags import prune_tag_counts
+from app.manage.autocomplete import autocomplete,AUTOCOMPLETE_REBUILD_MINUTES
+from app.manage.trending import trending,TRENDING_REFRESH_SECONDS
+from app.storage import media_store
+from app.manage.media_blobs import release_attachment
+from app.manage.uploads_manage import prune_upload_sessions
 
 
 scheduler = BackgroundScheduler()
@@ -26,8 +34,11 @@ def clean_notes_job():
 
 
 def clean_orphan_post_attachments(db:SessionDep):
-    deleted_count = db.query(PostAttachment).filter(PostAttachment.post_id == None).delete(synchronize_session=False)
+    orphans = db.query(PostAttachment).filter(PostAttachment.post_id == None).all()
+    deleted_count = db.query(PostAttachment).filter(PostAttachment.id.in_([orphan.id for orphan in orphans])).delete(synchronize_session=False)
+    public_ids = [public_id for orphan in orphans for public_id in release_attachment(orphan,db)]
     db.commit()
+    media_store.delete(*public_ids)   #the stored files too, once no row points to them
     print(f'{deleted_count} orphan post attachments have been deleted successfully')
 
 def clean_orphan_post_attachments_job():
@@ -38,5 +49,78 @@ def clean_orphan_post_attachments_job():
         db.close()
 
 
+def clean_feed_entries(db:SessionDep):
+    deleted_count = trim_feeds(db)
+    db.commit()
+    print(f'{deleted_count} old feed entries have been trimmed successfully')
+
+def clean_feed_entries_job():
+    db = SessionLocal()
+    try:
+        clean_feed_entries(db)
+    finally:
+        db.close()
+
+
+def roll_up_likes(db:SessionDep):
+    roll_up_like_counters(db)
+    db.commit()
+
+def roll_up_likes_job():
+    db = SessionLocal()
+    try:
+        roll_up_likes(db)
+    finally:
+        db.close()
+
+
+def clean_tag_counts(db:SessionDep):
+    deleted_count = prune_tag_counts(db)
+    db.commit()
+    print(f'{deleted_count} old tag counts have been deleted successfully')
+
+def clean_tag_counts_job():
+    db = SessionLocal()
+    try:
+        clean_tag_counts(db)
+    finally:
+        db.close()
+
+
+def rebuild_autocomplete_job():
+    db = SessionLocal()
+    try:
+        autocomplete.rebuild(db)
+    finally:
+        db.close()
+
+
+def clean_upload_sessions(db:SessionDep):
+    deleted_count = prune_upload_sessions(db)
+    db.commit()
+    print(f'{deleted_count} expired uploads have been deleted successfully')
+
+def clean_upload_sessions_job():
+    db = SessionLocal()
+    try:
+        clean_upload_sessions(db)
+    finally:
+        db.close()
+
+
+def refresh_trending_job():
+    db = SessionLocal()
+    try:
+        trending.refresh(db)
+    finally:
+        db.close()
+
+
 scheduler.add_job(clean_notes_job,'interval',hours=1)
-scheduler.add_job(clean_orphan_post_attachments_job,'interval',hours=24)
\ No newline at end of file
+scheduler.add_job(clean_orphan_post_attachments_job,'interval',hours=24)
+scheduler.add_job(clean_feed_entries_job,'interval',hours=6)
+scheduler.add_job(roll_up_likes_job,'interval',seconds=LIKE_ROLLUP_SECONDS)
+scheduler.add_job(clean_tag_counts_job,'interval',hours=1)
+scheduler.add_job(rebuild_autocomplete_job,'interval',minutes=AUTOCOMPLETE_REBUILD_MINUTES)
+scheduler.add_job(clean_upload_sessions_job,'interval',hours=1)
+scheduler.add_job(refresh_trending_job,'interval',seconds=TRENDING_REFRESH_SECONDS,next_run_time=datetime.now())   #first snapshot at startup
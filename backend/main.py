@@ -1,6 +1,6 @@
 from fastapi import FastAPI
 from fastapi import Request
-from app.database import engine
+from app.database import engine,async_engine,pool_metrics,async_pool_metrics
 from app import models
 from contextlib import asynccontextmanager
 
@@ -13,7 +13,15 @@ from app.manage.follows_manage import follow_router
 from app.manage.direct_messaging import messages_router
 from app.manage.groups_manage import groups_router
 from app.manage.notes_manage import notes_router
+from app.manage.search_manage import search_router
+from app.manage.uploads_manage import uploads_router
 from app.tasks.tasks import scheduler
+from app.manage.connection_manager import manager
+from app.manage.backplane import backplane_from_url
+from app.manage.chat_pipeline import pipeline
+from app.storage import STORAGE_BACKEND,STORAGE_LOCAL_DIR,STORAGE_LOCAL_URL
+from app.images import shutdown_image_pool
+from fastapi.staticfiles import StaticFiles
 
 from slowapi.errors import RateLimitExceeded
 from slowapi import Limiter,_rate_limit_exceeded_handler
@@ -39,7 +47,13 @@ async def lifespan(app:FastAPI):
  #   models.Base.metadata.create_all(bind=engine)
     scheduler.start()
     print("scheduler started")
+    await manager.use_backplane(backplane_from_url())   #websocket events are shared with the other workers
+    manager.start()   #heartbeats, presence and last seen
+    pipeline.start()
     yield
+    await pipeline.stop()   #write the buffered chat messages before exiting
+    await manager.stop()
+    shutdown_image_pool()
     scheduler.shutdown()
     print("scheduler stopped")
 
@@ -56,6 +70,11 @@ app.include_router(follow_router)
 app.include_router(messages_router)
 app.include_router(groups_router)
 app.include_router(notes_router)
+app.include_router(search_router)
+app.include_router(uploads_router)
+if STORAGE_BACKEND == 'local':   #the local storage backend serves its own files
+    os.makedirs(STORAGE_LOCAL_DIR,exist_ok=True)
+    app.mount(STORAGE_LOCAL_URL,StaticFiles(directory=STORAGE_LOCAL_DIR),name='media')
 
 
 def user_key_fct( request: Request):
@@ -78,6 +97,15 @@ app.add_exception_handler(RateLimitExceeded,_rate_limit_exceeded_handler)
 def test_limit(request:Request):
     return {'gg':'gg'}
 
+
+#connection pool usage, watch checked_out against pool_size + max_overflow under load
+@app.get('/metrics/db_pool')
+def db_pool_metrics():
+    return {
+        'sync' : pool_metrics.snapshot(engine),
+        'async' : async_pool_metrics.snapshot(async_engine.sync_engine),
+    }
+
 from app.middlewares.auth_middleware import get_auth_details
 app.middleware("http")(get_auth_details)
 
@@ -0,0 +1,95 @@
+"""
+Like counter benchmark
+
+Creates a post and `--users` throwaway users, makes them all like the post with `--concurrency`
+requests in flight (through the same code as the like endpoints), rolls the counter up and checks
+that posts.likes_nbr matches the likes. Everything it created is deleted at the end.
+
+usage (from the backend folder, uses DATABASE_URL):
+    python scripts/like_benchmark.py --users 5000 --concurrency 200
+
+sqlite only has one writer at a time, run it against PostgreSQL for anything above --concurrency 1
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import delete, insert, select
+
+from app.database import AsyncSessionLocal, SessionLocal
+from app.manage.like_counter import add_like, like_count, roll_up_like_counters
+from app.models.posts import Like, LikeCounterShard, Post
+from app.models.users import User
+
+
+def percentile(values:list[float], pct:float) -> float:
+    values = sorted(values)
+    index = min(len(values)-1, max(0, round(pct/100*len(values))-1))
+    return values[index]
+
+
+def setup(users:int):
+    prefix = f'likebench-{uuid.uuid4().hex[:8]}'
+    with SessionLocal() as db:
+        db.execute(insert(User), [{'username': f'{prefix}-{i}', 'email': f'{prefix}-{i}@bench', 'password': '-'} for i in range(users)])
+        user_ids = db.scalars(select(User.id).where(User.email.like(f'{prefix}-%'))).all()
+        post = Post(title=prefix, content='like benchmark', user_id=user_ids[0], likes_nbr=0)
+        db.add(post)
+        db.commit()
+        return prefix, post.id, user_ids
+
+
+def teardown(prefix:str, post_id:int):
+    with SessionLocal() as db:
+        db.execute(delete(LikeCounterShard).where(LikeCounterShard.post_id == post_id))
+        db.execute(delete(Like).where(Like.post_id == post_id))
+        db.execute(delete(Post).where(Post.id == post_id))
+        db.execute(delete(User).where(User.email.like(f'{prefix}-%')))
+        db.commit()
+
+
+async def hammer(post_id:int, user_ids:list[int], concurrency:int):
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def like(user_id:int):
+        async with semaphore:
+            start = time.perf_counter()
+            async with AsyncSessionLocal() as db:
+                await add_like(post_id, user_id, db)
+                await db.commit()
+            latencies.append((time.perf_counter()-start)*1000)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(like(user_id) for user_id in user_ids))
+    return latencies, time.perf_counter()-start
+
+
+async def main(args):
+    prefix, post_id, user_ids = setup(args.users)
+    try:
+        latencies, elapsed = await hammer(post_id, user_ids, args.concurrency)
+        async with AsyncSessionLocal() as db:
+            live = await like_count(post_id, db)
+        with SessionLocal() as db:
+            roll_up_like_counters(db)
+            db.commit()
+            stored = db.scalar(select(Post.likes_nbr).where(Post.id == post_id))
+        print(f'{len(user_ids)} likes in {elapsed:.2f}s ({len(user_ids)/elapsed:.0f} likes/s)')
+        print(f'latency p50 {statistics.median(latencies):.1f} ms, p99 {percentile(latencies, 99):.1f} ms, max {max(latencies):.1f} ms')
+        print(f'live count {live}, rolled up likes_nbr {stored}, expected {len(user_ids)}: {"ok" if live == stored == len(user_ids) else "MISMATCH"}')
+    finally:
+        teardown(prefix, post_id)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='concurrent likes on a single post')
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=100)
+    asyncio.run(main(parser.parse_args()))
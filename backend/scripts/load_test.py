@@ -0,0 +1,74 @@
+"""
+Small latency load test for the API
+
+Fires the same GET request at increasing concurrency levels and prints the
+latency percentiles for each level, so the effect of blocking work on the
+event loop shows up as p99 growing with concurrency.
+
+usage:
+    python scripts/load_test.py --base-url http://127.0.0.1:8000 --path /posts/feed/ \
+        --token <access token> --concurrency 1,10,50,100 --requests 500
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+
+def percentile(values:list[float], pct:float) -> float:
+    values = sorted(values)
+    index = min(len(values)-1, max(0, round(pct/100*len(values))-1))
+    return values[index]
+
+
+async def run_level(client:httpx.AsyncClient, path:str, concurrency:int, total:int):
+    latencies = []
+    errors = 0
+    queue = asyncio.Queue()
+    for _ in range(total):
+        queue.put_nowait(None)
+
+    async def worker():
+        nonlocal errors
+        while not queue.empty():
+            queue.get_nowait()
+            start = time.perf_counter()
+            try:
+                response = await client.get(path)
+                if response.status_code >= 400:
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+            latencies.append((time.perf_counter()-start)*1000)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter()-start
+    return latencies, errors, elapsed
+
+
+async def main(args):
+    headers = {'Authorization': f'Bearer {args.token}'} if args.token else {}
+    levels = [int(level) for level in args.concurrency.split(',')]
+    limits = httpx.Limits(max_connections=max(levels), max_keepalive_connections=max(levels))
+    async with httpx.AsyncClient(base_url=args.base_url, headers=headers, limits=limits, timeout=60) as client:
+        await client.get(args.path)   #warm up (caches, pool)
+        print(f'{"concurrency":>11} {"req/s":>8} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"max ms":>8} {"errors":>6}')
+        for concurrency in levels:
+            latencies, errors, elapsed = await run_level(client, args.path, concurrency, args.requests)
+            print(
+                f'{concurrency:>11} {len(latencies)/elapsed:>8.1f} {statistics.median(latencies):>8.1f} '
+                f'{percentile(latencies,95):>8.1f} {percentile(latencies,99):>8.1f} {max(latencies):>8.1f} {errors:>6}'
+            )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='latency percentiles per concurrency level')
+    parser.add_argument('--base-url', default='http://127.0.0.1:8000')
+    parser.add_argument('--path', default='/posts/feed/')
+    parser.add_argument('--token', default=None, help='bearer token for authenticated endpoints')
+    parser.add_argument('--concurrency', default='1,10,50,100')
+    parser.add_argument('--requests', type=int, default=500, help='requests per concurrency level')
+    asyncio.run(main(parser.parse_args()))